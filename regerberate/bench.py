@@ -0,0 +1,359 @@
+"""
+Benchmarks for the Gerber pipeline.
+
+A synthetic layer of configurable size is generated, and each stage of
+processing it is timed separately: tokenizing, parsing commands, executing
+them against a ``GraphicsState``, compositing, and writing Gerber and SVG.
+Throughput and peak memory are reported for each stage, and the results can
+be saved as JSON and compared against an earlier run. Two further stages
+parse the sample layers in ``samples/eagle``, concatenated to a given size,
+and measure the memory held by a list of parsed commands.
+
+Run with ``regerberate bench`` or ``python -m regerberate.bench``.
+"""
+from __future__ import print_function
+
+import argparse
+import glob
+import json
+import math
+import os
+import os.path
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from io import StringIO
+
+from .gerber.commands import parse_command
+from .gerber.parser import GerberTokenizer, GraphicsState
+from .gerber.plane import GraphicsPlane
+from .gerber.writer import write_gerber
+from .layerset import LayerSet
+from . import svg
+
+stage_names = ('tokenize', 'parse', 'parse_samples', 'command_memory',
+               'execute', 'composite', 'write_gerber', 'write_svg')
+
+# Results format version, bumped if the meaning of the fields changes.
+results_version = 1
+
+# Board size of synthetic layers, in 10 nm steps of the %FSLAX36Y36% format.
+board_size = 100000000
+
+sample_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                          'samples', 'eagle')
+
+sample_extensions = ('.cmp', '.sol', '.plc', '.stc', '.sts')
+
+
+def concatenated_samples(size, directory=sample_dir):
+    """
+    Return the Gerber layers in ``directory`` concatenated and repeated until
+    the result is at least ``size`` characters long.
+    """
+    chunk = ''.join(open(filename).read()
+                    for filename in sorted(glob.glob(os.path.join(directory,
+                                                                  '*')))
+                    if filename.endswith(sample_extensions))
+    return chunk * (size // len(chunk) + 1)
+
+
+def bench_parse_command(tokens):
+    """
+    Call ``parse_command`` on each of ``tokens``, discarding the results, as
+    is done when only throughput matters.
+    """
+    for s in tokens:
+        parse_command(s)
+    return len(tokens)
+
+
+def bench_command_memory(tokens):
+    """
+    Parse ``tokens`` into a list, as is done to keep a layer for round-trip
+    rewriting. Return the memory held by the list of commands, in bytes, as
+    measured by ``tracemalloc``; this is zero unless it is tracing.
+    """
+    before = tracemalloc.get_traced_memory()[0]
+    parsed = [parse_command(s) for s in tokens]
+    used = tracemalloc.get_traced_memory()[0] - before
+    del parsed
+    return used
+
+
+def synthetic_layer(flashes=20000, tracks=20000, regions=200,
+                    region_vertices=64, macros=2000, arcs=5000, seed=0):
+    """
+    Return the text of a synthetic millimetre Gerber layer, laid out like a
+    board: ``flashes`` pads of standard apertures, ``tracks`` straight
+    tracks, ``regions`` G36 pours of ``region_vertices`` vertices each,
+    ``macros`` flashes of aperture macros and ``arcs`` circular tracks.
+    """
+    rng = random.Random(seed)
+    size = board_size
+
+    def point():
+        return rng.randrange(size), rng.randrange(size)
+
+    lines = ['G04 Synthetic layer*', '%FSLAX36Y36*%', '%MOMM*%', '%LPD*%',
+             '%AMPAD*21,1,$1,$2,0,0,$3*1,0,$4,0,0*%',
+             '%AMTHERM*7,0,0,$1,$2,$3,45*%',
+             '%ADD10C,0.25*%', '%ADD11R,1.6X0.9*%', '%ADD12O,2X1.2*%',
+             '%ADD13P,1.8X8*%', '%ADD14C,0.15*%',
+             '%ADD15PAD,1.2X0.8X30X0.3*%', '%ADD16THERM,2X1.4X0.3*%']
+
+    for n in range(flashes):
+        if n % (flashes // 3 + 1) == 0:
+            lines.append('D%d*' % (11 + n // (flashes // 3 + 1)))
+        lines.append('X%dY%dD03*' % point())
+
+    if tracks:
+        lines.append('G01*')
+        lines.append('D10*')
+        for n in range(tracks):
+            x, y = point()
+            if n % 4 == 0:
+                lines.append('X%dY%dD02*' % (x, y))
+            # Tracks run orthogonally or at 45 degrees, as they do on boards.
+            length = rng.randrange(100000, 2000000)
+            direction = rng.randrange(8)
+            dx = int(length * math.cos(direction * math.pi / 4))
+            dy = int(length * math.sin(direction * math.pi / 4))
+            lines.append('X%dY%dD01*' % (min(max(x + dx, 0), size),
+                                         min(max(y + dy, 0), size)))
+
+    if macros:
+        lines.append('D15*')
+        for n in range(macros // 2):
+            lines.append('X%dY%dD03*' % point())
+        lines.append('D16*')
+        for n in range(macros - macros // 2):
+            lines.append('X%dY%dD03*' % point())
+
+    if arcs:
+        lines.append('G75*')
+        lines.append('D14*')
+        for n in range(arcs):
+            cx, cy = point()
+            radius = rng.randrange(100000, 1000000)
+            a0 = rng.uniform(0, 2 * math.pi)
+            a1 = a0 + rng.uniform(0.2, 1.5 * math.pi)
+            x0 = cx + int(radius * math.cos(a0))
+            y0 = cy + int(radius * math.sin(a0))
+            x1 = cx + int(radius * math.cos(a1))
+            y1 = cy + int(radius * math.sin(a1))
+            lines.append('X%dY%dD02*' % (x0, y0))
+            lines.append('G03X%dY%dI%dJ%dD01*' % (x1, y1, cx - x0, cy - y0))
+        lines.append('G01*')
+
+    for n in range(regions):
+        # A star shaped pour, which is simple but not convex.
+        cx, cy = point()
+        radius = rng.randrange(1000000, 5000000)
+        lines.append('G36*')
+        for k in range(region_vertices + 1):
+            a = 2 * math.pi * (k % region_vertices) / region_vertices
+            r = radius if k % 2 == 0 else radius // 2
+            lines.append('X%dY%d%s*' % (cx + int(r * math.cos(a)),
+                                        cy + int(r * math.sin(a)),
+                                        'D01' if k else 'D02'))
+        lines.append('G37*')
+
+    lines.append('M02*')
+    return '\n'.join(lines) + '\n'
+
+
+def measure(function, repeat=3):
+    """
+    Call ``function`` ``repeat`` times, and once more while tracing memory.
+    Return ``(seconds, peak, result)``: the fastest time, the peak memory
+    allocated during the traced call, in bytes, and its return value.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    try:
+        result = function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak, result
+
+
+def execute(commands):
+    state = GraphicsState()
+    plane = GraphicsPlane()
+    for cmd in commands:
+        cmd.execute(state, plane)
+    return plane
+
+
+def run_benchmarks(data, stages=stage_names, repeat=3, samples=''):
+    """
+    Benchmark each of ``stages`` over the Gerber text ``data``, returning a
+    dict of results for each stage by name. The ``parse_samples`` stage
+    parses the Gerber text ``samples`` instead, so that throughput on real
+    layers can be compared with that on synthetic ones.
+    """
+    size = len(data.encode('ascii'))
+    results = {}
+    tokens = [s for line_no, s in GerberTokenizer(StringIO(data))]
+    sample_tokens = [s for line_no, s in GerberTokenizer(StringIO(samples))]
+    commands = [parse_command(s) for s in tokens]
+    plane = execute(commands)
+    temp_dir = tempfile.mkdtemp(prefix='regerberate-bench-')
+    try:
+        gerber_filename = os.path.join(temp_dir, 'layer.gbr')
+        svg_filename = os.path.join(temp_dir, 'layer.svg')
+        layers = LayerSet()
+        layers.set_base_layer('layer.gbr', plane)
+        # An empty extra layer still flattens every object of the base.
+        extra = GraphicsPlane()
+        functions = {
+            'tokenize': lambda: list(GerberTokenizer(StringIO(data))),
+            'parse': lambda: [parse_command(s) for s in tokens],
+            'parse_samples': lambda: bench_parse_command(sample_tokens),
+            'command_memory': lambda: bench_command_memory(tokens),
+            'execute': lambda: execute(commands),
+            'composite': lambda: layers.composite(plane, extra),
+            'write_gerber': lambda: write_gerber(gerber_filename, plane),
+            'write_svg': lambda: svg.write_document(svg_filename, layers),
+        }
+        for name in stages:
+            seconds, peak, value = measure(functions[name], repeat)
+            if name == 'parse_samples':
+                stage_size = len(samples.encode('ascii'))
+                count = len(sample_tokens)
+            else:
+                stage_size = size
+                count = len(tokens)
+            result = {
+                'seconds': seconds,
+                'mb_per_s': stage_size / seconds / 1e6,
+                'commands_per_s': count / seconds,
+                'peak_bytes': peak,
+            }
+            if name == 'parse_samples':
+                result['input_bytes'] = stage_size
+                result['commands'] = count
+            elif name == 'command_memory':
+                result['held_bytes'] = value
+            if name.startswith('write_'):
+                filename = gerber_filename if name == 'write_gerber' else \
+                    svg_filename
+                result['output_bytes'] = os.path.getsize(filename)
+            results[name] = result
+    finally:
+        shutil.rmtree(temp_dir)
+    return {
+        'version': results_version,
+        'python': platform.python_version(),
+        'input_bytes': size,
+        'commands': len(tokens),
+        'primitives': len(plane),
+        'stages': results,
+    }
+
+
+def print_results(results, baseline=None):
+    print('%d bytes, %d commands, %d primitives' % (
+        results['input_bytes'], results['commands'], results['primitives']))
+    header = '%-14s%10s%10s%14s%10s' % ('stage', 'seconds', 'MB/s',
+                                        'commands/s', 'peak MB')
+    if baseline:
+        header += '%12s' % 'vs baseline'
+    print(header)
+    for name in stage_names:
+        result = results['stages'].get(name)
+        if result is None:
+            continue
+        line = '%-14s%10.3f%10.2f%14.0f%10.1f' % (
+            name, result['seconds'], result['mb_per_s'],
+            result['commands_per_s'], result['peak_bytes'] / 1e6)
+        if baseline:
+            previous = baseline['stages'].get(name)
+            if previous:
+                line += '%11.2fx' % (previous['seconds'] / result['seconds'])
+        print(line)
+    result = results['stages'].get('parse_samples')
+    if result:
+        print('parse_samples: %d bytes, %d commands of sample layers' % (
+            result['input_bytes'], result['commands']))
+    result = results['stages'].get('command_memory')
+    if result:
+        print('command_memory: %.1f MB held (%.0f bytes/command)' % (
+            result['held_bytes'] / 1e6,
+            result['held_bytes'] / max(results['commands'], 1)))
+
+
+def add_arguments(p):
+    p.add_argument('-i', '--input',
+                   help='Benchmark this Gerber file instead of a synthetic '
+                   'layer.')
+    p.add_argument('--flashes', type=int, default=20000)
+    p.add_argument('--tracks', type=int, default=20000)
+    p.add_argument('--regions', type=int, default=200)
+    p.add_argument('--region-vertices', type=int, default=64)
+    p.add_argument('--macros', type=int, default=2000)
+    p.add_argument('--arcs', type=int, default=5000)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('-s', '--stages', default=','.join(stage_names),
+                   help='Comma separated stages to run (default: all).')
+    p.add_argument('--samples', default=sample_dir,
+                   help='Directory of sample Gerber layers for the '
+                   'parse_samples stage.')
+    p.add_argument('--sample-size', type=float, default=10,
+                   help='Size of the concatenated sample input, in MB.')
+    p.add_argument('-r', '--repeat', type=int, default=3,
+                   help='Number of timed runs; the fastest is reported.')
+    p.add_argument('-o', '--output',
+                   help='Save the results to this JSON file.')
+    p.add_argument('-c', '--compare',
+                   help='Compare against results saved in this JSON file.')
+
+
+def run(opts):
+    stages = [name for name in opts.stages.split(',') if name]
+    for name in stages:
+        if name not in stage_names:
+            raise ValueError('unknown stage %r' % name)
+    if opts.input:
+        with open(opts.input) as f:
+            data = f.read()
+    else:
+        data = synthetic_layer(opts.flashes, opts.tracks, opts.regions,
+                               opts.region_vertices, opts.macros, opts.arcs,
+                               opts.seed)
+
+    samples = ''
+    if 'parse_samples' in stages:
+        samples = concatenated_samples(int(opts.sample_size * 1e6),
+                                       opts.samples)
+    results = run_benchmarks(data, stages, opts.repeat, samples)
+    baseline = None
+    if opts.compare:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Benchmark the Gerber pipeline.')
+    add_arguments(p)
+    return run(p.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
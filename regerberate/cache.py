@@ -0,0 +1,169 @@
+"""
+Caches of parsed Gerber layers, on disk and in memory.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import os.path
+import tempfile
+from collections import OrderedDict
+
+from . import __version__
+from .gerber.plane import GraphicsPlane, file_version
+from .gerber.parser import GerberParser
+
+log = logging.getLogger(__name__)
+
+# Bump whenever parsing would produce a different plane for the same input.
+parser_version = '%s-%d-3' % (__version__, file_version)
+
+
+def gerber_key(data):
+    """
+    Return a hex digest identifying the parse of Gerber content ``data``.
+    """
+    h = hashlib.sha256(parser_version.encode('ascii'))
+    h.update(data)
+    return h.hexdigest()
+
+
+def file_key(filename):
+    with open(filename, 'rb') as f:
+        return gerber_key(f.read())
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'regerberate')
+
+
+class PlaneCache(object):
+    """
+    Base class for caches of parsed planes, which implement ``get()`` and
+    ``put()``.
+    """
+    def read_gerber(self, filename):
+        """
+        Return the parsed plane for ``filename``, from the cache if its
+        content is unchanged.
+        """
+        key = file_key(filename)
+        plane = self.get(key)
+        if plane is None:
+            plane = GerberParser(filename).parse()
+            self.put(key, plane)
+        else:
+            log.debug('using cached parse of %s', filename)
+        return plane
+
+
+class ParseCache(PlaneCache):
+    """
+    Cache of parsed ``GraphicsPlane`` instances, keyed by a hash of the Gerber
+    file content and the parser version.
+
+    Each entry is a plane file which is memory-mapped when read. Entries are
+    evicted least recently used first once the cache exceeds ``max_size``
+    bytes.
+    """
+    suffix = '.plane'
+
+    def __init__(self, directory=None, max_size=512 * 1024 * 1024):
+        self.directory = directory or default_cache_dir()
+        self.max_size = max_size
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        """
+        Return the cached plane for ``key``, or ``None``.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        # Entry use is tracked by modification time, for eviction.
+        os.utime(path)
+        try:
+            return GraphicsPlane.load(buf)
+        except ValueError:
+            log.warning('discarding invalid cache entry %s', path)
+            return None
+
+    def put(self, key, plane):
+        """
+        Store ``plane`` under ``key``, then evict old entries if needed.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                plane.dump(f)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        while total > self.max_size and entries:
+            mtime, size, path = entries.pop(0)
+            log.debug('evicting %s', path)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class MemoryCache(PlaneCache):
+    """
+    Cache of parsed planes held in memory, for long running processes, in
+    front of an optional ``ParseCache``. At most ``max_entries`` planes are
+    kept, evicting the least recently used.
+    """
+    def __init__(self, parent=None, max_entries=64):
+        self.parent = parent
+        self.max_entries = max_entries
+        self.planes = OrderedDict()
+
+    def get(self, key):
+        plane = self.planes.get(key)
+        if plane is not None:
+            self.planes.move_to_end(key)
+            return plane
+        if self.parent:
+            plane = self.parent.get(key)
+            if plane is not None:
+                self.remember(key, plane)
+        return plane
+
+    def put(self, key, plane):
+        self.remember(key, plane)
+        if self.parent:
+            self.parent.put(key, plane)
+
+    def remember(self, key, plane):
+        self.planes[key] = plane
+        self.planes.move_to_end(key)
+        while len(self.planes) > self.max_entries:
+            self.planes.popitem(last=False)
@@ -0,0 +1,630 @@
+"""
+Polygon boolean operations over integer coordinates.
+
+``flatten()`` takes a sequence of ``(dark, points)`` polygons, applied in
+order as Gerber applies level polarity: each dark polygon is united with the
+image so far, and each clear polygon is subtracted from it. The result is
+computed with a scanbeam sweep in the style of Vatti's algorithm:
+
+1. All polygon edges are collected, and pairs which may cross are found with
+   a uniform grid, so that only edges in the same neighbourhood are ever
+   tested against each other. The edges are then snap rounded, so that they
+   only meet at their ends. The grids' cells are a few typical edges across,
+   not the board divided by the number of edges: the vertices of a layer
+   crowd into its pads and curves, and cells sized for an even spread would
+   hold hundreds of them each.
+2. The plane is cut into horizontal beams at every vertex. Within a beam no
+   two edges cross, so the active edges keep their order from left to right
+   from one beam to the next: at each vertex, the edges which end are
+   removed from the list and those which start are inserted by binary
+   search.
+3. Each active edge keeps the winding number of every polygon just to its
+   right. A vertex only changes the windings between the edges which end or
+   start there, so only that range is walked again to find where the image
+   turns filled or empty, starting from the windings of the edge to its
+   left.
+4. The filled spans are built into contours, strip by strip. Only the
+   strips which overlap a changed range are carried on, split, joined or
+   closed; the rest continue untouched.
+
+Each vertex therefore costs time logarithmic in the number of active edges,
+plus the number of edges and strips in the range it changes, and the number
+of polygons overlapping there; only the memory moves of inserting into and
+deleting from the lists grow with the width of the sweep.
+
+The output contours are y-monotone, and do not overlap each other.
+"""
+from bisect import insort
+from collections import defaultdict
+
+
+def segment_cells(x0, y0, x1, y1, xmin, ymin, size):
+    """
+    Yield the ``(i, j)`` cells of a grid of squares of ``size``, with its
+    first cell's corner at ``(xmin, ymin)``, which the segment from ``(x0,
+    y0)`` up to ``(x1, y1)``, widened by a unit, passes through. A segment
+    visits about twice as many cells as its length in cells, so long
+    segments do not fill their whole bounding box.
+    """
+    dy = y1 - y0
+    for j in range((y0 - 1 - ymin) // size, (y1 + 1 - ymin) // size + 1):
+        ya = max(y0, ymin + j * size - 1)
+        yb = min(y1, ymin + (j + 1) * size + 1)
+        if dy:
+            xa = x0 + (x1 - x0) * (ya - y0) // dy
+            xb = x0 + (x1 - x0) * (yb - y0) // dy
+        else:
+            xa, xb = x0, x1
+        for i in range((min(xa, xb) - 1 - xmin) // size,
+                       (max(xa, xb) + 2 - xmin) // size + 1):
+            yield i, j
+
+
+class GridIndex(object):
+    """
+    A uniform grid of square cells of ``cell_size``, each listing the
+    segments which pass through it.
+    """
+    def __init__(self, bounds, cell_size):
+        self.xmin = bounds[0]
+        self.ymin = bounds[1]
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        self.boxes = {}
+
+    def insert(self, item, x0, y0, x1, y1):
+        """
+        Add the segment ``item`` from ``(x0, y0)`` up to ``(x1, y1)``.
+        Items must be inserted in increasing order.
+        """
+        self.boxes[item] = min(x0, x1), y0, max(x0, x1), y1
+        cells = self.cells
+        for key in segment_cells(x0, y0, x1, y1, self.xmin, self.ymin,
+                                 self.cell_size):
+            cells[key].append(item)
+
+    def candidate_pairs(self):
+        """
+        Yield each pair of items ``(a, b)``, with ``a < b``, which share a
+        cell and whose bounding boxes overlap, once.
+        """
+        boxes = self.boxes
+        seen = set()
+        for items in self.cells.values():
+            n = len(items)
+            for m in range(n):
+                a = items[m]
+                axmin, aymin, axmax, aymax = boxes[a]
+                for b in items[m + 1:]:
+                    bxmin, bymin, bxmax, bymax = boxes[b]
+                    if bxmin > axmax or bxmax < axmin or \
+                            bymin > aymax or bymax < aymin:
+                        continue
+                    if (a, b) not in seen:
+                        seen.add((a, b))
+                        yield a, b
+
+
+def intersection(ax0, ay0, ax1, ay1, bx0, by0, bx1, by1):
+    """
+    Return the crossing point of two segments rounded to integers, or
+    ``None`` if they do not cross or are parallel.
+    """
+    dax = ax1 - ax0
+    day = ay1 - ay0
+    dbx = bx1 - bx0
+    dby = by1 - by0
+    d = dax * dby - day * dbx
+    if not d:
+        return None
+    t = (bx0 - ax0) * dby - (by0 - ay0) * dbx
+    u = (bx0 - ax0) * day - (by0 - ay0) * dax
+    if d < 0:
+        d, t, u = -d, -t, -u
+    if not (0 <= t <= d and 0 <= u <= d):
+        return None
+    return (ax0 + (2 * dax * t + d) // (2 * d),
+            ay0 + (2 * day * t + d) // (2 * d))
+
+
+class Edges(object):
+    """
+    Non-horizontal polygon edges in parallel lists, each directed upwards
+    with ``y0 < y1``. ``winding`` is +1 if the contour ran upwards along the
+    edge and -1 if it ran downwards.
+    """
+    def __init__(self):
+        self.x0 = []
+        self.y0 = []
+        self.x1 = []
+        self.y1 = []
+        self.winding = []
+        self.owner = []
+
+    def __len__(self):
+        return len(self.x0)
+
+    def add(self, xa, ya, xb, yb, owner):
+        if ya == yb:
+            return
+        if ya < yb:
+            winding = 1
+        else:
+            xa, ya, xb, yb = xb, yb, xa, ya
+            winding = -1
+        self.x0.append(xa)
+        self.y0.append(ya)
+        self.x1.append(xb)
+        self.y1.append(yb)
+        self.winding.append(winding)
+        self.owner.append(owner)
+
+    def x_at(self, e, y):
+        """
+        Return the x coordinate of edge ``e`` at ``y``, rounded.
+        """
+        x0 = self.x0[e]
+        y0 = self.y0[e]
+        dy = self.y1[e] - y0
+        return x0 + (2 * (self.x1[e] - x0) * (y - y0) + dy) // (2 * dy)
+
+    def x_between(self, e, y):
+        """
+        Return the x coordinate of edge ``e`` at ``y``, which may lie between
+        two integers, unrounded.
+        """
+        x0 = self.x0[e]
+        y0 = self.y0[e]
+        return x0 + (self.x1[e] - x0) * (y - y0) / (self.y1[e] - y0)
+
+
+def pixel_touches(px, py, x0, y0, x1, y1):
+    """
+    Return whether the segment from ``(x0, y0)`` to ``(x1, y1)`` meets the
+    unit square centred on the integer point ``(px, py)``, which includes
+    its left and bottom sides but not its right and top ones, so that every
+    point is in exactly one square.
+
+    Everything is scaled up until moving the right and top sides in by one
+    is too little to change the answer for any segment this size, and the
+    square is then tested closed, exactly.
+    """
+    k = 2 * max(abs(x1 - x0), abs(y1 - y0)) + 1
+    left = k * (2 * px - 1)
+    right = left + 2 * k - 1
+    bottom = k * (2 * py - 1)
+    top = bottom + 2 * k - 1
+    x0, y0, x1, y1 = 2 * k * x0, 2 * k * y0, 2 * k * x1, 2 * k * y1
+    if right < min(x0, x1) or left > max(x0, x1) or \
+            top < min(y0, y1) or bottom > max(y0, y1):
+        return False
+    dx = x1 - x0
+    dy = y1 - y0
+    sides = [dx * (y - y0) - dy * (x - x0)
+             for x in (left, right) for y in (bottom, top)]
+    return min(sides) <= 0 <= max(sides)
+
+
+class PixelGrid(object):
+    """
+    Integer points in a uniform grid of square cells of ``cell_size``, for
+    finding those whose unit squares a segment may pass through.
+    """
+    def __init__(self, bounds, points, cell_size):
+        xmin = self.xmin = bounds[0]
+        ymin = self.ymin = bounds[1]
+        self.cell_size = size = cell_size
+        self.cells = cells = defaultdict(list)
+        for x, y in points:
+            cells[(x - xmin) // size, (y - ymin) // size].append((x, y))
+
+    def near(self, x0, y0, x1, y1):
+        """
+        Yield the points in the cells which the segment from ``(x0, y0)`` up
+        to ``(x1, y1)``, widened by half a unit, passes through.
+        """
+        cells = self.cells
+        for key in segment_cells(x0, y0, x1, y1, self.xmin, self.ymin,
+                                 self.cell_size):
+            for point in cells.get(key, ()):
+                yield point
+
+
+def typical_length(edges):
+    """
+    Return a few times the median extent of the edges along their longer
+    axis, which sizes the grids used to find nearby edges and hot pixels: a
+    cell then holds a handful of vertices even where they crowd, while long
+    edges still cross few cells.
+    """
+    lengths = sorted(max(abs(x1 - x0), y1 - y0) for x0, y0, x1, y1
+                     in zip(edges.x0, edges.y0, edges.x1, edges.y1))
+    return max(lengths[len(lengths) // 2] * 4, 2)
+
+
+def snap_round(edges):
+    """
+    Return a new ``Edges`` in which no two edges cross except at their ends,
+    by snap rounding: the ends of the edges and their crossing points,
+    rounded, are hot pixels, and every edge passing through the unit square
+    of a hot pixel is bent through its centre. Rounding the crossings alone
+    could leave edges which still cross close to them.
+    """
+    n = len(edges)
+    if not n:
+        return edges
+    x0, y0, x1, y1 = edges.x0, edges.y0, edges.x1, edges.y1
+    bounds = (min(min(x0), min(x1)), min(y0), max(max(x0), max(x1)), max(y1))
+    cell_size = typical_length(edges)
+    index = GridIndex(bounds, cell_size)
+    for e in range(n):
+        index.insert(e, x0[e], y0[e], x1[e], y1[e])
+
+    hot = set(zip(x0, y0))
+    hot.update(zip(x1, y1))
+    crossings = False
+    for a, b in index.candidate_pairs():
+        p = intersection(x0[a], y0[a], x1[a], y1[a],
+                         x0[b], y0[b], x1[b], y1[b])
+        if p is None:
+            continue
+        hot.add(p)
+        if p not in ((x0[a], y0[a]), (x1[a], y1[a])) or \
+                p not in ((x0[b], y0[b]), (x1[b], y1[b])):
+            crossings = True
+    if not crossings:
+        # Edges which only meet at their ends need no bending.
+        return edges
+
+    grid = PixelGrid(bounds, hot, cell_size)
+    result = Edges()
+    for e in range(n):
+        xa, ya, xb, yb = x0[e], y0[e], x1[e], y1[e]
+        dx = xb - xa
+        dy = yb - ya
+        left = min(xa, xb) - 1
+        right = max(xa, xb) + 1
+        # A unit square can only meet the edge's line if its centre is
+        # within half of |dx| + |dy| of it, in units of the cross product;
+        # this cheap test rejects almost every point the grid returns.
+        reach = abs(dx) + abs(dy)
+        points = sorted(
+            (p for p in grid.near(xa, ya, xb, yb)
+             if left <= p[0] <= right and ya - 1 <= p[1] <= yb + 1 and
+             2 * abs(dx * (p[1] - ya) - dy * (p[0] - xa)) <= reach and
+             p != (xa, ya) and p != (xb, yb) and
+             pixel_touches(p[0], p[1], xa, ya, xb, yb)),
+            key=lambda p: (p[0] - xa) * dx + (p[1] - ya) * dy)
+        points.insert(0, (xa, ya))
+        points.append((xb, yb))
+        if edges.winding[e] < 0:
+            points.reverse()
+        owner = edges.owner[e]
+        for (px, py), (qx, qy) in zip(points, points[1:]):
+            result.add(px, py, qx, qy, owner)
+    return result
+
+
+class Strip(object):
+    """
+    An output contour being built upwards, beam by beam, as its left and
+    right boundaries.
+    """
+    __slots__ = ('left', 'right', 'left_points', 'right_points')
+
+    def __init__(self, left, right, y, edges):
+        self.left = left
+        self.right = right
+        self.left_points = [(edges.x_at(left, y), y)]
+        self.right_points = [(edges.x_at(right, y), y)]
+
+    def follow(self, left, right, y, edges):
+        """
+        Continue the strip at ``y`` between new boundary edges, with a
+        horizontal step if a boundary moves.
+        """
+        if left != self.left:
+            self.left_points.append((edges.x_at(self.left, y), y))
+            self.left_points.append((edges.x_at(left, y), y))
+            self.left = left
+        if right != self.right:
+            self.right_points.append((edges.x_at(self.right, y), y))
+            self.right_points.append((edges.x_at(right, y), y))
+            self.right = right
+
+    def close(self, y, edges):
+        """
+        Return the finished contour, counterclockwise, as ``(xs, ys)``.
+        """
+        points = self.right_points + [(edges.x_at(self.right, y), y),
+                                      (edges.x_at(self.left, y), y)]
+        points.extend(reversed(self.left_points))
+        contour = []
+        for p in points:
+            if not contour or contour[-1] != p:
+                contour.append(p)
+        if contour[-1] == contour[0]:
+            contour.pop()
+        if len(contour) < 3:
+            return None
+        contour.append(contour[0])
+        return [x for x, y in contour], [y for x, y in contour]
+
+
+def lower_bound(items, value, key):
+    """
+    Return the first position in ``items``, which are in order of ``key``,
+    whose key is not less than ``value``.
+    """
+    lo = 0
+    hi = len(items)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key(items[mid]) < value:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def upper_bound(items, value, key):
+    """
+    Return the first position in ``items``, which are in order of ``key``,
+    whose key is greater than ``value``.
+    """
+    lo = 0
+    hi = len(items)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key(items[mid]) <= value:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def change_ranges(changes):
+    """
+    Yield ``(xa, xb, inserted)`` ranges covering ``changes``, each an ``(x,
+    owner, delta, edge)`` change to the winding of polygon ``owner`` from
+    ``x`` rightwards, with the ``edge`` inserted there if any. A range ends
+    wherever every winding is back to what it was, so nothing between two
+    ranges is affected.
+    """
+    changes.sort(key=lambda change: change[0])
+    deltas = defaultdict(int)
+    unbalanced = 0
+    start = None
+    inserted = []
+    for k, (x, owner, delta, e) in enumerate(changes):
+        if start is None:
+            start = x
+        if e is not None:
+            inserted.append(e)
+        before = deltas[owner]
+        after = deltas[owner] = before + delta
+        if not before:
+            unbalanced += 1
+        elif not after:
+            unbalanced -= 1
+        if not unbalanced and (k + 1 == len(changes) or
+                               changes[k + 1][0] > x):
+            yield start, x, inserted
+            start = None
+            inserted = []
+
+
+class Sweep(object):
+    """
+    The state of the sweep within a beam: the active edges from left to
+    right, the windings of every polygon just to the right of each of them,
+    and the strips being built, also from left to right.
+    """
+    def __init__(self, edges, polarity):
+        self.edges = edges
+        self.polarity = polarity
+        self.active = []
+        self.windings = {}
+        self.strips = []
+        self.contours = []
+
+    def find(self, e, x, key):
+        """
+        Return the position of active edge ``e``, whose ``key`` is ``x``.
+        """
+        active = self.active
+        i = lower_bound(active, x, key)
+        while i < len(active) and active[i] != e and key(active[i]) == x:
+            i += 1
+        if i < len(active) and active[i] == e:
+            return i
+        # Rounding of split points may leave an edge a unit out of order.
+        return active.index(e)
+
+    def remove(self, e, y):
+        """
+        Remove edge ``e``, which ends at ``y``, from the active edges.
+        """
+        x_at = self.edges.x_at
+        del self.active[self.find(e, x_at(e, y), lambda f: x_at(f, y))]
+        del self.windings[e]
+
+    def insert(self, e, ymid):
+        """
+        Insert edge ``e`` into the active edges in its place at ``ymid``, the
+        middle of the beam it starts.
+        """
+        x_between = self.edges.x_between
+        active = self.active
+        active.insert(upper_bound(active, x_between(e, ymid),
+                                  lambda f: x_between(f, ymid)), e)
+
+    def advance(self, y, ending, starting, ymid):
+        """
+        Move the sweep up to the vertices at ``y``: remove the ``ending``
+        edges, insert the ``starting`` edges in their place at ``ymid``, and
+        update the image wherever it may have changed.
+        """
+        edges = self.edges
+        changes = []
+        for e in ending:
+            self.remove(e, y)
+            changes.append((edges.x1[e], edges.owner[e], -edges.winding[e],
+                            None))
+        for e in starting:
+            self.insert(e, ymid)
+            changes.append((edges.x0[e], edges.owner[e], edges.winding[e],
+                            e))
+        for xa, xb, inserted in change_ranges(changes):
+            self.update(y, ymid, xa, xb, inserted)
+
+    def update(self, y, ymid, xa, xb, inserted):
+        """
+        Find the filled spans between ``xa`` and ``xb`` at ``y`` again, and
+        carry the strips there on into them. The ``inserted`` edges start in
+        that range.
+        """
+        edges = self.edges
+        x_at = edges.x_at
+        x_between = edges.x_between
+        owner = edges.owner
+        winding = edges.winding
+        polarity = self.polarity
+        active = self.active
+        windings = self.windings
+
+        def key(e):
+            return x_at(e, y)
+
+        def key_between(e):
+            return x_between(e, ymid)
+
+        lo = lower_bound(active, xa, key)
+        hi = upper_bound(active, xb, key)
+        while lo and key(active[lo - 1]) >= xa:
+            lo -= 1
+        while hi < len(active) and key(active[hi]) <= xb:
+            hi += 1
+        for e in inserted:
+            i = self.find(e, key_between(e), key_between)
+            lo = min(lo, i)
+            hi = max(hi, i + 1)
+        active[lo:hi] = sorted(active[lo:hi],
+                               key=lambda e: (key(e), key_between(e)))
+
+        state = dict(windings[active[lo - 1]]) if lo else {}
+        inside = sorted(state)
+        filled = polarity[inside[-1]] if inside else False
+        bounds = []
+        for e in active[lo:hi]:
+            o = owner[e]
+            before = state.get(o, 0)
+            after = before + winding[e]
+            if after:
+                state[o] = after
+            else:
+                del state[o]
+            if not before:
+                insort(inside, o)
+            elif not after:
+                inside.remove(o)
+            windings[e] = dict(state)
+            now = polarity[inside[-1]] if inside else False
+            if now != filled:
+                bounds.append(e)
+                filled = now
+
+        # The strips overlapping the range, and the edges outside it which
+        # bound the spans running into it.
+        strips = self.strips
+        first = lower_bound(strips, xa, lambda strip: x_at(strip.right, y))
+        last = upper_bound(strips, xb, lambda strip: x_at(strip.left, y))
+        old = strips[first:last]
+        if old and x_at(old[0].left, y) < xa:
+            bounds.insert(0, old[0].left)
+        if old and x_at(old[-1].right, y) > xb:
+            bounds.append(old[-1].right)
+        spans = list(zip(bounds[::2], bounds[1::2]))
+        strips[first:last] = self.join(old, spans, y)
+
+    def join(self, old, spans, y):
+        """
+        Return the strips of the new ``spans`` starting at ``y``. A strip of
+        ``old`` carries on into a span when they overlap at ``y`` and
+        neither overlaps anything else; the rest of the old strips are
+        closed, and the rest of the spans start new ones.
+        """
+        edges = self.edges
+        x_at = edges.x_at
+        partners = defaultdict(list)
+        span_partners = defaultdict(list)
+        i = 0
+        for k, (left, right) in enumerate(spans):
+            xl = x_at(left, y)
+            xr = x_at(right, y)
+            while i < len(old) and x_at(old[i].right, y) <= xl:
+                i += 1
+            j = i
+            while j < len(old) and x_at(old[j].left, y) < xr:
+                partners[j].append(k)
+                span_partners[k].append(j)
+                j += 1
+        continuing = []
+        carried = set()
+        for k, (left, right) in enumerate(spans):
+            matches = span_partners.get(k, ())
+            if len(matches) == 1 and len(partners[matches[0]]) == 1:
+                strip = old[matches[0]]
+                strip.follow(left, right, y, edges)
+                carried.add(matches[0])
+            else:
+                strip = Strip(left, right, y, edges)
+            continuing.append(strip)
+        for i, strip in enumerate(old):
+            if i not in carried:
+                self.close(strip, y)
+        return continuing
+
+    def close(self, strip, y):
+        contour = strip.close(y, self.edges)
+        if contour:
+            self.contours.append(contour)
+
+
+def flatten(polygons):
+    """
+    Apply ``(dark, points)`` polygons in order and return the resulting
+    image as a list of non-overlapping ``(xs, ys)`` closed contours.
+    """
+    edges = Edges()
+    polarity = []
+    for owner, (dark, points) in enumerate(polygons):
+        polarity.append(dark)
+        n = len(points)
+        for i in range(n):
+            xa, ya = points[i - 1]
+            xb, yb = points[i]
+            edges.add(xa, ya, xb, yb, owner)
+    edges = snap_round(edges)
+    if not len(edges):
+        return []
+
+    y0, y1 = edges.y0, edges.y1
+    n = len(edges)
+    starting = sorted(range(n), key=y0.__getitem__)
+    ending = sorted(range(n), key=y1.__getitem__)
+    ys = sorted(set(y0) | set(y1))
+    sweep = Sweep(edges, polarity)
+    s = t = 0
+    for k, y in enumerate(ys):
+        t0 = t
+        while t < n and y1[ending[t]] == y:
+            t += 1
+        s0 = s
+        while s < n and y0[starting[s]] == y:
+            s += 1
+        ymid = (y + ys[k + 1]) / 2.0 if s > s0 else y
+        sweep.advance(y, ending[t0:t], starting[s0:s], ymid)
+    for strip in sweep.strips:
+        sweep.close(strip, ys[-1])
+    return sweep.contours
@@ -6,7 +6,11 @@ import os.path
 
 import coloredlogs
 
+from . import bench, svg
+from .cache import ParseCache
 from .layerset import LayerSet
+from .project import project_extension
+from .gerber.coordinates import UNITS_PER_MM, parse_decimal
 from .gerber.parser import GerberParser
 
 
@@ -14,26 +18,172 @@ log = logging.getLogger(__name__)
 
 
 def prepare(opts):
-    if os.path.exists(opts.output):
-        layers = LayerSet.load_svg(opts.output)
+    is_project = opts.output.endswith(project_extension)
+    if is_project and os.path.exists(opts.output):
+        layers = LayerSet.load_project(opts.output)
     else:
         layers = LayerSet()
+    if not opts.no_cache:
+        layers.cache = ParseCache(opts.cache_dir)
 
-    for filename in opts.inputs:
-        layers.update_from_gerber(filename)
+    # Layers whose Gerber content matches the key recorded in the SVG being
+    # updated are copied through by update_svg(), so need not be parsed.
+    unchanged = None
+    if not is_project and os.path.exists(opts.output):
+        unchanged = svg.document_keys(opts.output)
 
-    layers.write_svg(opts.output)
+    try:
+        layers.update_from_gerbers(opts.inputs,
+                                   jobs=opts.jobs or os.cpu_count(),
+                                   unchanged=unchanged)
+    except ValueError as e:
+        log.error('%s', e)
+        return 1
+
+    if is_project:
+        layers.write_project(opts.output)
+    elif os.path.exists(opts.output):
+        layers.update_svg(opts.output)
+    else:
+        layers.write_svg(opts.output)
     return 0
 
 
+def pack(opts):
+    layers = LayerSet.load_file(opts.input)
+    layers.write_project(opts.output)
+    return 0
+
+
+def parse_rules(opts):
+    from .drc import parse_rule
+
+    rules = {}
+    for s in opts.rules or ():
+        try:
+            key, rule = parse_rule(s, rules)
+        except ValueError as e:
+            log.error('%s', e)
+            return None
+        rules[key] = rule
+    return rules
+
+
 def render(opts):
     layers = LayerSet.load_file(opts.input)
+    for name in opts.layers or ():
+        if name not in layers.layers:
+            log.error('no layer named %s in %s', name, opts.input)
+            return 1
+    rules = None
+    if opts.drc:
+        rules = parse_rules(opts)
+        if rules is None:
+            return 1
+    layers.render_gerbers(opts.output, opts.layers, rules)
+    return 0
+
+
+def drc(opts):
+    layers = LayerSet.load_file(opts.input)
+    for name in opts.layers or ():
+        if name not in layers.layers:
+            log.error('no layer named %s in %s', name, opts.input)
+            return 1
+    if opts.overlay and opts.input.endswith(project_extension):
+        log.error('--overlay needs an SVG file')
+        return 1
+    rules = parse_rules(opts)
+    if rules is None:
+        return 1
+    violations = layers.check_rules(opts.layers, rules)
+    if opts.overlay:
+        layers.write_drc_overlay(opts.input, violations)
+    count = sum(len(layer_violations)
+                for layer_violations in violations.values())
+    if not count:
+        print('No design rule violations.')
+        return 0
+    print('%d design rule violations' % count)
+    return 1
+
+
+def panelize(opts):
+    layers = LayerSet()
+    if not opts.no_cache:
+        layers.cache = ParseCache(opts.cache_dir)
+
+    try:
+        layers.update_from_gerbers(opts.inputs,
+                                   jobs=opts.jobs or os.cpu_count())
+    except ValueError as e:
+        log.error('%s', e)
+        return 1
+    layers.panelize(opts.columns, opts.rows, parse_decimal(opts.gap, 'MM'))
     layers.render_gerbers(opts.output)
     return 0
 
 
+def preview(opts):
+    if len(opts.inputs) == 1 and opts.inputs[0].lower().endswith('.svg'):
+        layers = LayerSet.load_file(opts.inputs[0])
+    else:
+        layers = LayerSet()
+        layers.update_from_gerbers(opts.inputs,
+                                   jobs=opts.jobs or os.cpu_count())
+    layers.write_preview(opts.output, dpi=opts.dpi,
+                         jobs=opts.jobs or os.cpu_count())
+    return 0
+
+
+def diff(opts):
+    from .raster import diff_planes
+
+    a, b = [LayerSet().gerber_read(filename)
+            for filename in (opts.a, opts.b)]
+    area, boxes = diff_planes(a, b, opts.dpi)
+    if not boxes:
+        print('No differences at %d DPI.' % opts.dpi)
+        return 0
+    print('Changed area: %.4f mm^2 in %d regions' %
+          (area / UNITS_PER_MM ** 2, len(boxes)))
+    for xmin, ymin, xmax, ymax in boxes:
+        print('  (%.4f, %.4f) - (%.4f, %.4f) mm' % (
+            xmin / UNITS_PER_MM, ymin / UNITS_PER_MM, xmax / UNITS_PER_MM,
+            ymax / UNITS_PER_MM))
+    return 1
+
+
+def watch(opts):
+    from .watch import Watcher
+
+    cache = None if opts.no_cache else ParseCache(opts.cache_dir)
+    watcher = Watcher(opts.input, opts.output, cache, interval=opts.interval,
+                      debounce=opts.debounce)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
 def parse(opts):
-    GerberParser(opts.input).parse()
+    parser = GerberParser(opts.input)
+    if not (opts.table or opts.verify):
+        parser.parse()
+        return 0
+
+    raw_width = 36
+    if opts.table:
+        print('Line\t%s\tResult' % "Raw".ljust(raw_width))
+        print('----\t%s\t-----------' % ('-' * raw_width))
+    for line_no, s, cmd in parser:
+        if opts.table:
+            print("%04d\t%s\t%r" % (line_no, s.ljust(raw_width), cmd))
+        if opts.verify and cmd.to_string() != s:
+            log.error('line %d: round trip mismatch: %r != %r',
+                      line_no, cmd.to_string(), s)
+            return 1
     return 0
 
 
@@ -47,20 +197,137 @@ def main(argv=sys.argv):
         help='Prepare or update SVG file from intermediate Gerbers.')
     p_prepare.add_argument('inputs', nargs='*')
     p_prepare.add_argument('-o', '--output', dest='output',
-                           default='board.svg')
+                           default='board.svg',
+                           help='SVG file, or project file if it ends in '
+                           '%s.' % project_extension)
+    p_prepare.add_argument('-j', '--jobs', type=int, default=1,
+                           help='Number of Gerber files to parse in '
+                           'parallel, or 0 for one per CPU.')
+    p_prepare.add_argument('--no-cache', action='store_true',
+                           help='Always parse Gerber files, without using '
+                           'or updating the parse cache.')
+    p_prepare.add_argument('--cache-dir',
+                           help='Directory for the parse cache (default: '
+                           '~/.cache/regerberate).')
     p_prepare.set_defaults(function=prepare)
 
     p_render = subparsers.add_parser(
         'render',
         help='Render output Gerbers from an SVG file.')
     p_render.add_argument('input')
-    p_render.add_argument('-o', '--output', dest='output')
+    p_render.add_argument('-o', '--output', dest='output', required=True,
+                          help='Directory to write the Gerber files to.')
+    p_render.add_argument('-l', '--layer', dest='layers', action='append',
+                          help='Only render this layer. May be given more '
+                          'than once.')
+    p_render.add_argument('--drc', action='store_true',
+                          help='Check the art against design rules. Needs '
+                          'NumPy.')
+    p_render.add_argument('--rule', dest='rules', action='append',
+                          help='Design rule for a layer name or extension, '
+                          'in mm, e.g. .cmp:clearance=0.2 or '
+                          '.plc:width=0.15. May be given more than once.')
     p_render.set_defaults(function=render)
 
+    p_drc = subparsers.add_parser(
+        'drc',
+        help='Check the art in an SVG file against design rules.')
+    p_drc.add_argument('input')
+    p_drc.add_argument('-l', '--layer', dest='layers', action='append',
+                       help='Only check this layer. May be given more than '
+                       'once.')
+    p_drc.add_argument('--rule', dest='rules', action='append',
+                       help='Design rule for a layer name or extension, in '
+                       'mm, e.g. .cmp:clearance=0.2 or .plc:width=0.15. May '
+                       'be given more than once.')
+    p_drc.add_argument('--overlay', action='store_true',
+                       help='Mark violations in a drc layer of the SVG '
+                       'file.')
+    p_drc.set_defaults(function=drc)
+
+    p_pack = subparsers.add_parser(
+        'pack',
+        help='Save an SVG file as a project file, which opens faster.')
+    p_pack.add_argument('input')
+    p_pack.add_argument('-o', '--output', dest='output', required=True)
+    p_pack.set_defaults(function=pack)
+
+    p_panelize = subparsers.add_parser(
+        'panelize',
+        help='Repeat Gerbers in a grid to make a production panel.')
+    p_panelize.add_argument('inputs', nargs='+')
+    p_panelize.add_argument('-o', '--output', dest='output', required=True,
+                            help='Directory to write the Gerber files to.')
+    p_panelize.add_argument('-c', '--columns', type=int, default=1)
+    p_panelize.add_argument('-r', '--rows', type=int, default=1)
+    p_panelize.add_argument('-g', '--gap', default='0',
+                            help='Space between copies, in mm.')
+    p_panelize.add_argument('-j', '--jobs', type=int, default=1,
+                            help='Number of Gerber files to parse in '
+                            'parallel, or 0 for one per CPU.')
+    p_panelize.add_argument('--no-cache', action='store_true',
+                            help='Always parse Gerber files, without using '
+                            'or updating the parse cache.')
+    p_panelize.add_argument('--cache-dir',
+                            help='Directory for the parse cache (default: '
+                            '~/.cache/regerberate).')
+    p_panelize.set_defaults(function=panelize)
+
+    p_preview = subparsers.add_parser(
+        'preview',
+        help='Render a PNG preview of an SVG file or of Gerbers.')
+    p_preview.add_argument('inputs', nargs='+')
+    p_preview.add_argument('-o', '--output', dest='output',
+                           default='preview.png')
+    p_preview.add_argument('-d', '--dpi', type=int, default=300)
+    p_preview.add_argument('-j', '--jobs', type=int, default=1,
+                           help='Number of processes to render with, or 0 '
+                           'for one per CPU.')
+    p_preview.set_defaults(function=preview)
+
+    p_diff = subparsers.add_parser(
+        'diff',
+        help='Compare the images of two Gerber files.')
+    p_diff.add_argument('a')
+    p_diff.add_argument('b')
+    p_diff.add_argument('-d', '--dpi', type=int, default=1000,
+                        help='Resolution to compare at.')
+    p_diff.set_defaults(function=diff)
+
+    p_watch = subparsers.add_parser(
+        'watch',
+        help='Render output Gerbers again whenever an SVG or project file, '
+        'or the Gerbers it was prepared from, change.')
+    p_watch.add_argument('input')
+    p_watch.add_argument('-o', '--output', dest='output', required=True,
+                         help='Directory to write the Gerber files to.')
+    p_watch.add_argument('--interval', type=float, default=0.2,
+                         help='Seconds between checks for changes.')
+    p_watch.add_argument('--debounce', type=float, default=0.3,
+                         help='Seconds to wait for files to stop changing '
+                         'before updating.')
+    p_watch.add_argument('--no-cache', action='store_true',
+                         help='Do not use or update the parse cache.')
+    p_watch.add_argument('--cache-dir',
+                         help='Directory for the parse cache (default: '
+                         '~/.cache/regerberate).')
+    p_watch.set_defaults(function=watch)
+
+    p_bench = subparsers.add_parser(
+        'bench',
+        help='Benchmark each stage of the pipeline on a synthetic layer.')
+    bench.add_arguments(p_bench)
+    p_bench.set_defaults(function=bench.run)
+
     p_parse = subparsers.add_parser(
         'parse',
         help='Test parse a Gerber file.')
     p_parse.add_argument('input')
+    p_parse.add_argument('-t', '--table', action='store_true',
+                         help='Print a table of each parsed command.')
+    p_parse.add_argument('--verify', action='store_true',
+                         help='Check that each command re-serializes to '
+                         'its original text.')
     p_parse.set_defaults(function=parse)
 
     coloredlogs.install(level='DEBUG')
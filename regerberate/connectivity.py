@@ -0,0 +1,420 @@
+"""
+Connectivity of copper layers.
+
+The dark material of a layer is described as shapes, each a polyline with a
+radius: draws, arcs and flashes of circular apertures are their centre line
+with the aperture's radius, cut into short pieces, and everything else is a
+closed contour with no radius. Shapes which touch are grouped into islands
+with a union-find structure. Only pairs of shapes whose bounding boxes
+overlap, found by descending a packed R-tree of the boxes against itself, are
+ever tested, and pairs already known to be in the same island are skipped, so
+grouping takes near-linear time on boards of even density.
+
+``find_shorts()`` groups the copper of a base layer and the art of its extra
+layer together, and reports art which joins islands which were separate in
+the base layer: each of those is usually a short between two nets.
+"""
+import math
+import re
+from array import array
+
+from .clipping import flatten
+from .geometry import plane_polygons, primitive_polygons
+from .gerber.arcs import arc_points, default_tolerance
+from .gerber.coordinates import UNITS_PER_MM
+from .gerber.plane import DRAW, ARC, FLASH, DARK, CLOCKWISE
+from .gerber.rtree import PackedRTree
+
+# Gerber file extensions of copper layers.
+copper_extensions = ('.cmp', '.sol', '.gtl', '.gbl')
+
+# Longest piece a track is cut into. Long tracks, which are often diagonal,
+# would otherwise have bounding boxes covering much of the board.
+max_piece_length = 2 * UNITS_PER_MM
+
+# Inner copper layers, like Eagle's .ly2 to .ly15 and KiCad's .g2.
+inner_copper_re = re.compile(r'\.(ly|g)\d+$', re.IGNORECASE)
+
+
+def is_copper(name):
+    """
+    Return True if the layer file ``name`` holds copper, judging by its
+    extension.
+    """
+    name = name.lower()
+    return name.endswith(copper_extensions) or \
+        inner_copper_re.search(name) is not None
+
+
+class UnionFind(object):
+    """
+    Disjoint sets of the integers ``0`` up to ``count``, with union by size
+    and path halving.
+    """
+    def __init__(self, count):
+        self.parent = array('q', range(count))
+        self.size = array('q', [1]) * count
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = item = parent[parent[item]]
+        return item
+
+    def union(self, a, b):
+        """
+        Merge the sets holding ``a`` and ``b``, and return the root of the
+        merged set.
+        """
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+
+class Shape(object):
+    """
+    The material within ``radius`` of the polyline ``(xs, ys)``, and, if it
+    is ``closed``, inside it. A closed polyline repeats its first vertex at
+    the end.
+    """
+    __slots__ = ('xs', 'ys', 'radius', 'closed', 'box')
+
+    def __init__(self, xs, ys, radius=0, closed=False):
+        self.xs = xs
+        self.ys = ys
+        self.radius = radius
+        self.closed = closed
+        self.box = (min(xs) - radius, min(ys) - radius,
+                    max(xs) + radius, max(ys) + radius)
+
+    @classmethod
+    def contour(cls, points):
+        """
+        Return the shape of the polygon ``points``.
+        """
+        xs = [x for x, y in points]
+        ys = [y for x, y in points]
+        xs.append(xs[0])
+        ys.append(ys[0])
+        return cls(xs, ys, closed=True)
+
+    def moved(self, dx, dy):
+        """
+        Return the shape moved by ``(dx, dy)``.
+        """
+        if not dx and not dy:
+            return self
+        return Shape([x + dx for x in self.xs], [y + dy for y in self.ys],
+                     self.radius, self.closed)
+
+    def edges(self, xmin, ymin, xmax, ymax):
+        """
+        Return the edges whose material may reach into the given box, as
+        ``(x0, y0, x1, y1, xmin, ymin, xmax, ymax)`` tuples, where the box of
+        each edge includes the radius. A single point is an edge of no
+        length.
+        """
+        xs, ys, r = self.xs, self.ys, self.radius
+        if len(xs) == 1:
+            x, y = xs[0], ys[0]
+            return [(x, y, x, y, x - r, y - r, x + r, y + r)]
+        edges = []
+        for i in range(1, len(xs)):
+            xa, ya, xb, yb = xs[i - 1], ys[i - 1], xs[i], ys[i]
+            exmin, exmax = (xa - r, xb + r) if xa < xb else (xb - r, xa + r)
+            eymin, eymax = (ya - r, yb + r) if ya < yb else (yb - r, ya + r)
+            if exmin > xmax or exmax < xmin or eymin > ymax or eymax < ymin:
+                continue
+            edges.append((xa, ya, xb, yb, exmin, eymin, exmax, eymax))
+        return edges
+
+    def contains(self, x, y):
+        """
+        Return True if ``(x, y)`` is inside the closed polyline, by the
+        even-odd rule.
+        """
+        xs, ys = self.xs, self.ys
+        inside = False
+        for i in range(1, len(xs)):
+            xa, ya, xb, yb = xs[i - 1], ys[i - 1], xs[i], ys[i]
+            if (ya > y) != (yb > y):
+                # The point is left of the crossing; compared without
+                # dividing.
+                side = (x - xa) * (yb - ya) - (xb - xa) * (y - ya)
+                if (side < 0) == (yb > ya):
+                    inside = not inside
+        return inside
+
+
+def orientation(ax, ay, bx, by, cx, cy):
+    d = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+    return (d > 0) - (d < 0)
+
+
+def on_segment(x0, y0, x1, y1, x, y):
+    """
+    Return True if ``(x, y)``, which is collinear with the segment, lies on
+    it.
+    """
+    return min(x0, x1) <= x <= max(x0, x1) and min(y0, y1) <= y <= max(y0, y1)
+
+
+def segments_touch(ax0, ay0, ax1, ay1, bx0, by0, bx1, by1):
+    """
+    Return True if the closed segments ``a`` and ``b`` share any point.
+    """
+    d1 = orientation(bx0, by0, bx1, by1, ax0, ay0)
+    d2 = orientation(bx0, by0, bx1, by1, ax1, ay1)
+    d3 = orientation(ax0, ay0, ax1, ay1, bx0, by0)
+    d4 = orientation(ax0, ay0, ax1, ay1, bx1, by1)
+    if d1 * d2 < 0 and d3 * d4 < 0:
+        return True
+    # Otherwise they only meet where an endpoint of one lies on the other,
+    # which also covers collinear segments which overlap.
+    return (not d1 and on_segment(bx0, by0, bx1, by1, ax0, ay0)) or \
+        (not d2 and on_segment(bx0, by0, bx1, by1, ax1, ay1)) or \
+        (not d3 and on_segment(ax0, ay0, ax1, ay1, bx0, by0)) or \
+        (not d4 and on_segment(ax0, ay0, ax1, ay1, bx1, by1))
+
+
+def point_segment_distance2(px, py, x0, y0, x1, y1):
+    """
+    Return the squared distance from ``(px, py)`` to the segment.
+    """
+    dx = x1 - x0
+    dy = y1 - y0
+    length2 = dx * dx + dy * dy
+    if length2:
+        t = ((px - x0) * dx + (py - y0) * dy) / length2
+        if t >= 1:
+            x0, y0 = x1, y1
+        elif t > 0:
+            x0 += t * dx
+            y0 += t * dy
+    return (px - x0) ** 2 + (py - y0) ** 2
+
+
+def segment_distance2(ax0, ay0, ax1, ay1, bx0, by0, bx1, by1):
+    """
+    Return the squared distance between the segments ``a`` and ``b``.
+    """
+    if segments_touch(ax0, ay0, ax1, ay1, bx0, by0, bx1, by1):
+        return 0
+    return min(point_segment_distance2(ax0, ay0, bx0, by0, bx1, by1),
+               point_segment_distance2(ax1, ay1, bx0, by0, bx1, by1),
+               point_segment_distance2(bx0, by0, ax0, ay0, ax1, ay1),
+               point_segment_distance2(bx1, by1, ax0, ay0, ax1, ay1))
+
+
+def shapes_touch(a, b):
+    """
+    Return True if the material of shapes ``a`` and ``b`` shares any point.
+    """
+    a_box = a.box
+    b_box = b.box
+    xmin = max(a_box[0], b_box[0])
+    ymin = max(a_box[1], b_box[1])
+    xmax = min(a_box[2], b_box[2])
+    ymax = min(a_box[3], b_box[3])
+    if xmin > xmax or ymin > ymax:
+        return False
+    reach = a.radius + b.radius
+    reach2 = reach * reach
+    b_edges = b.edges(xmin, ymin, xmax, ymax)
+    for ax0, ay0, ax1, ay1, axmin, aymin, axmax, aymax in \
+            a.edges(xmin, ymin, xmax, ymax):
+        for bx0, by0, bx1, by1, bxmin, bymin, bxmax, bymax in b_edges:
+            if bxmin > axmax or bxmax < axmin or \
+                    bymin > aymax or bymax < aymin:
+                continue
+            if reach:
+                if segment_distance2(ax0, ay0, ax1, ay1,
+                                     bx0, by0, bx1, by1) <= reach2:
+                    return True
+            elif segments_touch(ax0, ay0, ax1, ay1, bx0, by0, bx1, by1):
+                return True
+    return (a.closed and a.contains(b.xs[0], b.ys[0])) or \
+        (b.closed and b.contains(a.xs[0], a.ys[0]))
+
+
+def split_segment(x0, y0, x1, y1, length=max_piece_length):
+    """
+    Return the segment cut into pieces of at most ``length``, as ``(x0, y0,
+    x1, y1)`` tuples.
+    """
+    count = max(int(math.ceil(math.hypot(x1 - x0, y1 - y0) / length)), 1)
+    if count == 1:
+        return [(x0, y0, x1, y1)]
+    xs = [x0 + (x1 - x0) * k // count for k in range(count)] + [x1]
+    ys = [y0 + (y1 - y0) * k // count for k in range(count)] + [y1]
+    return [(xs[k], ys[k], xs[k + 1], ys[k + 1]) for k in range(count)]
+
+
+def primitive_shapes(plane, index, tolerance=default_tolerance):
+    """
+    Return the shapes of the dark material of the primitive at ``index``.
+    """
+    kind = plane.kinds[index]
+    if kind in (DRAW, ARC, FLASH):
+        aperture = plane.apertures[plane.aperture_numbers[index]]
+        diameter = aperture.diameter
+        if diameter is not None and len(aperture.shapes) == 1:
+            radius = diameter // 2
+            x0, y0 = plane.x0[index], plane.y0[index]
+            x1, y1 = plane.x1[index], plane.y1[index]
+            if kind == FLASH:
+                return [Shape([x0], [y0], radius)]
+            elif kind == DRAW:
+                points = [(x0, y0), (x1, y1)]
+            else:
+                points = arc_points(x0, y0, x1, y1, plane.cx[index],
+                                    plane.cy[index],
+                                    plane.flags[index] & CLOCKWISE,
+                                    tolerance)
+            return [Shape([px0, px1], [py0, py1], radius)
+                    for (xa, ya), (xb, yb) in zip(points, points[1:])
+                    for px0, py0, px1, py1 in split_segment(xa, ya, xb, yb)]
+
+    # Flashes come with the aperture's holes already cut out of them.
+    return [Shape.contour(points) for dark, points
+            in primitive_polygons(plane, index, tolerance)
+            if len(points) >= 3]
+
+
+def copper_shapes(plane, tolerance=default_tolerance):
+    """
+    Return the dark material of ``plane`` as a list of shapes, which may
+    overlap. Only a plane with clear objects, which may cut any earlier
+    object, has to be flattened as a whole, which is much slower.
+    """
+    if plane is None:
+        return []
+    if not all(flags & DARK for flags in plane.flags):
+        return [Shape(xs, ys, closed=True)
+                for xs, ys in flatten(plane_polygons(plane, tolerance))]
+    shapes = []
+    for start, stop, offsets in plane.segments():
+        for index in range(start, stop):
+            primitive = primitive_shapes(plane, index, tolerance)
+            for dx, dy in offsets:
+                shapes.extend(shape.moved(dx, dy) for shape in primitive)
+    return shapes
+
+
+def union_box(boxes):
+    return (min(box[0] for box in boxes), min(box[1] for box in boxes),
+            max(box[2] for box in boxes), max(box[3] for box in boxes))
+
+
+def shape_tree(shapes):
+    """
+    Return a ``PackedRTree`` of the boxes of ``shapes``.
+    """
+    boxes = [shape.box for shape in shapes]
+    return PackedRTree([box[0] for box in boxes], [box[1] for box in boxes],
+                       [box[2] for box in boxes], [box[3] for box in boxes])
+
+
+def join_touching(sets, shapes, pairs):
+    """
+    Merge the sets of each pair of shapes in ``pairs`` which touch. Pairs
+    already in the same set are not tested, which skips most of the pairs
+    within a dense island.
+    """
+    find = sets.find
+    for a, b in pairs:
+        if find(a) != find(b) and shapes_touch(shapes[a], shapes[b]):
+            sets.union(a, b)
+
+
+def islands(plane):
+    """
+    Return the copper islands of ``plane`` as a list of lists of shapes.
+    """
+    shapes = copper_shapes(plane)
+    sets = UnionFind(len(shapes))
+    join_touching(sets, shapes, shape_tree(shapes).overlapping_pairs())
+    groups = {}
+    for n, shape in enumerate(shapes):
+        groups.setdefault(sets.find(n), []).append(shape)
+    return list(groups.values())
+
+
+class Short(object):
+    """
+    Art which joins several islands of a base layer: ``art_box`` is the
+    bounding box of the art, and ``island_boxes`` those of the islands it
+    joins.
+    """
+    __slots__ = ('art_box', 'island_boxes')
+
+    def __init__(self, art_box, island_boxes):
+        self.art_box = art_box
+        self.island_boxes = island_boxes
+
+    def __repr__(self):
+        return 'Short(%r, %r)' % (self.art_box, self.island_boxes)
+
+
+def join_layers(base_shapes, art_shapes):
+    """
+    Group ``base_shapes`` followed by ``art_shapes`` into islands. Return the
+    ``UnionFind`` of the islands, numbering the art shapes after the base
+    shapes, and the root of each base shape's island before any art was
+    added.
+    """
+    shapes = base_shapes + art_shapes
+    n_base = len(base_shapes)
+
+    # Group the base on its own first, so its islands are known before the
+    # art is added.
+    sets = UnionFind(len(shapes))
+    base_tree = shape_tree(base_shapes)
+    join_touching(sets, shapes, base_tree.overlapping_pairs())
+    island_of = [sets.find(n) for n in range(n_base)]
+    join_touching(sets, shapes,
+                  ((n_base + a, n_base + b) for a, b
+                   in shape_tree(art_shapes).overlapping_pairs()))
+    join_touching(sets, shapes,
+                  ((a, n_base + n) for n, shape in enumerate(art_shapes)
+                   for a in base_tree.query(*shape.box)))
+    return sets, island_of
+
+
+def find_shorts(base, extra):
+    """
+    Return a ``Short`` for each group of islands of the ``base`` plane which
+    the art in the ``extra`` plane joins together.
+
+    Clear objects in the art are only applied to the art itself, not to the
+    base copper. They can only cut copper apart, so this may report a short
+    which a clear object in the art then cuts, but never misses one.
+    """
+    base_shapes = copper_shapes(base)
+    art_shapes = copper_shapes(extra)
+    if not base_shapes or not art_shapes:
+        return []
+    sets, island_of = join_layers(base_shapes, art_shapes)
+    n_base = len(base_shapes)
+
+    groups = {}
+    for n, island in enumerate(island_of):
+        groups.setdefault(sets.find(n), {}).setdefault(island, []).append(
+            base_shapes[n].box)
+    art = {}
+    for n, shape in enumerate(art_shapes):
+        art.setdefault(sets.find(n_base + n), []).append(shape.box)
+
+    shorts = []
+    for root, group in groups.items():
+        if len(group) > 1:
+            shorts.append(Short(union_box(art[root]),
+                                sorted(union_box(island_boxes)
+                                       for island_boxes in group.values())))
+    return shorts
@@ -0,0 +1,472 @@
+"""
+Design rule checks of the art in extra layers.
+
+Two rules can be set for each layer: the least ``clearance`` between art and
+the base layer's geometry which it is not connected to, and the least
+``width`` of the art's own features. By default copper layers are checked
+for clearance, and silkscreen and soldermask layers for width.
+
+Both layers are described as the shapes of ``connectivity``, and every edge
+of those shapes as a segment with a radius. Pairs of segments which may be
+close enough to matter are found by binning their bounding boxes into a
+uniform grid, and their distances are computed in bulk, so millions of pairs
+are handled by a few array operations rather than one Python loop each.
+
+Art which touches base geometry is connected to it, and is not checked for
+clearance against anything in the same island; art which joins islands is
+reported by ``connectivity.find_shorts()`` instead. The width of each shape
+is checked on its own, so a narrow gap left between two overlapping shapes
+is not found.
+
+This module requires NumPy.
+"""
+import os.path
+
+import numpy as np
+
+from .connectivity import copper_shapes, is_copper, join_layers
+from .gerber.coordinates import UNITS_PER_MM, parse_decimal
+
+# Most pairs of grid entries expanded at once.
+chunk_entries = 1 << 16
+
+
+class Rule(object):
+    """
+    The least ``clearance`` and ``width`` allowed in a layer, in picometres,
+    or ``None`` for a rule which is not checked.
+    """
+    __slots__ = ('clearance', 'width')
+
+    def __init__(self, clearance=None, width=None):
+        self.clearance = clearance
+        self.width = width
+
+    def __repr__(self):
+        return 'Rule(clearance=%r, width=%r)' % (self.clearance, self.width)
+
+    def updated(self, **kwargs):
+        """
+        Return a copy of the rule with the given values replaced.
+        """
+        values = dict(clearance=self.clearance, width=self.width)
+        values.update(kwargs)
+        return Rule(**values)
+
+
+copper_rule = Rule(clearance=150 * UNITS_PER_MM // 1000)
+
+# Rules by layer file extension.
+default_rules = {
+    '.plc': Rule(width=150 * UNITS_PER_MM // 1000),
+    '.pls': Rule(width=150 * UNITS_PER_MM // 1000),
+    '.stc': Rule(width=100 * UNITS_PER_MM // 1000),
+    '.sts': Rule(width=100 * UNITS_PER_MM // 1000),
+}
+
+
+def parse_rule(s, rules=None):
+    """
+    Parse a rule given on the command line, like ``'.cmp:clearance=0.2'`` or
+    ``'board.plc:width=0.2,clearance=0.1'``, in millimetres, into a layer
+    name or extension and a ``Rule``. The rule starts from the one in
+    ``rules``, or the default, for that layer or extension.
+    """
+    key, sep, settings = s.partition(':')
+    if not sep or not key:
+        raise ValueError('rule %r should look like LAYER:NAME=MM' % s)
+    values = {}
+    for setting in settings.split(','):
+        name, sep, value = setting.partition('=')
+        name = name.strip()
+        if name not in Rule.__slots__ or not sep:
+            raise ValueError('unknown rule setting %r' % setting)
+        value = value.strip()
+        values[name] = parse_decimal(value, 'MM') if value else None
+    return key, rule_for(key, rules).updated(**values)
+
+
+def rule_for(name, rules=None):
+    """
+    Return the ``Rule`` for layer ``name``, looking for its name and then
+    its extension in ``rules``, then in the defaults.
+    """
+    extension = os.path.splitext(name)[1].lower() or name.lower()
+    for table in (rules or {}), default_rules:
+        if name in table:
+            return table[name]
+        if extension in table:
+            return table[extension]
+    if is_copper(name):
+        return copper_rule
+    return Rule()
+
+
+class Violation(object):
+    """
+    A place where art breaks a rule of ``layer``: its ``kind``, either
+    ``'clearance'`` or ``'width'``, the ``distance`` found and the ``limit``
+    it should have been, and the two closest points ``(x0, y0)`` and ``(x1,
+    y1)`` across the gap or feature. A feature drawn too narrow by its
+    aperture has both points at one place.
+    """
+    __slots__ = ('layer', 'kind', 'distance', 'limit', 'x0', 'y0', 'x1',
+                 'y1')
+
+    def __init__(self, layer, kind, distance, limit, x0, y0, x1, y1):
+        self.layer = layer
+        self.kind = kind
+        self.distance = distance
+        self.limit = limit
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+
+    def __repr__(self):
+        return '<Violation %s %s %d < %d at (%d, %d)>' % (
+            self.layer, self.kind, self.distance, self.limit, self.x0,
+            self.y0)
+
+    def describe(self):
+        return '%s: %s %.4f mm < %.4f mm at (%.4f, %.4f) mm' % (
+            self.layer, self.kind, self.distance / UNITS_PER_MM,
+            self.limit / UNITS_PER_MM, self.x0 / UNITS_PER_MM,
+            self.y0 / UNITS_PER_MM)
+
+
+class Segments(object):
+    """
+    The edges of a list of shapes, as arrays: end points, radius, the number
+    of the shape, the position of the edge in its shape and that of the
+    shape's last edge. ``ccw`` is +1 for edges of counterclockwise closed
+    shapes, -1 for clockwise ones and 0 for open ones. Shapes are numbered
+    from ``offset``.
+    """
+    def __init__(self, shapes, offset=0):
+        x0 = []
+        y0 = []
+        x1 = []
+        y1 = []
+        radius = []
+        shape = []
+        position = []
+        last = []
+        ccw = []
+        for n, s in enumerate(shapes):
+            xs, ys = s.xs, s.ys
+            if len(xs) == 1:
+                # A single point is an edge of no length.
+                count = 1
+                x0.append(xs[0])
+                y0.append(ys[0])
+                x1.append(xs[0])
+                y1.append(ys[0])
+            else:
+                count = len(xs) - 1
+                x0.extend(xs[:-1])
+                y0.extend(ys[:-1])
+                x1.extend(xs[1:])
+                y1.extend(ys[1:])
+            sign = 0
+            if s.closed:
+                area2 = sum(xs[i - 1] * ys[i] - xs[i] * ys[i - 1]
+                            for i in range(1, len(xs)))
+                sign = 1 if area2 > 0 else -1
+            radius.extend([s.radius] * count)
+            shape.extend([offset + n] * count)
+            position.extend(range(count))
+            last.extend([count - 1] * count)
+            ccw.extend([sign] * count)
+        self.x0 = np.array(x0, dtype=np.float64)
+        self.y0 = np.array(y0, dtype=np.float64)
+        self.x1 = np.array(x1, dtype=np.float64)
+        self.y1 = np.array(y1, dtype=np.float64)
+        self.radius = np.array(radius, dtype=np.float64)
+        self.shape = np.array(shape, dtype=np.int64)
+        self.position = np.array(position, dtype=np.int64)
+        self.last = np.array(last, dtype=np.int64)
+        self.ccw = np.array(ccw, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.x0)
+
+    def boxes(self, margin=0):
+        """
+        Return the ``(xmin, ymin, xmax, ymax)`` arrays of the material of
+        each segment, grown by ``margin``.
+        """
+        grow = self.radius + margin
+        return (np.minimum(self.x0, self.x1) - grow,
+                np.minimum(self.y0, self.y1) - grow,
+                np.maximum(self.x0, self.x1) + grow,
+                np.maximum(self.y0, self.y1) + grow)
+
+
+def grid_pairs(a_boxes, b_boxes, same=False):
+    """
+    Yield arrays ``(i, j)`` of the pairs of a box from ``a_boxes`` and one
+    from ``b_boxes`` which overlap, each pair once, in chunks. If ``same``
+    is set, both are the same boxes, and only pairs with ``i < j`` are
+    given.
+
+    The boxes are binned into a uniform grid of cells about the size of the
+    typical box. Pairs are found by matching the grid entries of ``a`` with
+    the sorted entries of ``b`` in the same cell, and a pair which shares
+    several cells is only kept in the cell holding the corner of the boxes'
+    overlap.
+    """
+    if not len(a_boxes[0]) or not len(b_boxes[0]):
+        return
+    xmin = min(a_boxes[0].min(), b_boxes[0].min())
+    ymin = min(a_boxes[1].min(), b_boxes[1].min())
+    extents = np.concatenate([a_boxes[2] - a_boxes[0], a_boxes[3] - a_boxes[1],
+                              b_boxes[2] - b_boxes[0],
+                              b_boxes[3] - b_boxes[1]])
+    cell = max(float(np.median(extents)) * 2, 1.0)
+    ymax = max(a_boxes[3].max(), b_boxes[3].max())
+    rows = int((ymax - ymin) // cell) + 1
+
+    def cells(boxes):
+        i0 = ((boxes[0] - xmin) // cell).astype(np.int64)
+        j0 = ((boxes[1] - ymin) // cell).astype(np.int64)
+        i1 = ((boxes[2] - xmin) // cell).astype(np.int64)
+        j1 = ((boxes[3] - ymin) // cell).astype(np.int64)
+        width = j1 - j0 + 1
+        counts = (i1 - i0 + 1) * width
+        item = np.repeat(np.arange(len(counts)), counts)
+        k = np.arange(len(item)) - np.repeat(np.cumsum(counts) - counts,
+                                             counts)
+        return (i0[item] + k // width[item]) * rows + \
+            j0[item] + k % width[item], item
+
+    a_keys, a_items = cells(a_boxes)
+    b_keys, b_items = cells(b_boxes)
+    order = np.argsort(b_keys, kind='stable')
+    b_keys = b_keys[order]
+    b_items = b_items[order]
+    lo = np.searchsorted(b_keys, a_keys, 'left')
+    hi = np.searchsorted(b_keys, a_keys, 'right')
+
+    for start in range(0, len(a_keys), chunk_entries):
+        stop = start + chunk_entries
+        counts = hi[start:stop] - lo[start:stop]
+        entry = np.repeat(np.arange(start, min(stop, len(a_keys))), counts)
+        if not len(entry):
+            continue
+        k = np.arange(len(entry)) - np.repeat(np.cumsum(counts) - counts,
+                                              counts)
+        i = a_items[entry]
+        j = b_items[lo[entry] + k]
+        keep = (a_boxes[0][i] <= b_boxes[2][j]) & \
+            (b_boxes[0][j] <= a_boxes[2][i]) & \
+            (a_boxes[1][i] <= b_boxes[3][j]) & \
+            (b_boxes[1][j] <= a_boxes[3][i])
+        if same:
+            keep &= i < j
+        i = i[keep]
+        j = j[keep]
+        key = a_keys[entry[keep]]
+        corner = (((np.maximum(a_boxes[0][i], b_boxes[0][j]) - xmin) //
+                   cell).astype(np.int64) * rows +
+                  ((np.maximum(a_boxes[1][i], b_boxes[1][j]) - ymin) //
+                   cell).astype(np.int64))
+        keep = corner == key
+        yield i[keep], j[keep]
+
+
+def closest_on_segment(px, py, x0, y0, x1, y1):
+    """
+    Return the points of the segments nearest to the points ``(px, py)``.
+    """
+    dx = x1 - x0
+    dy = y1 - y0
+    length2 = dx * dx + dy * dy
+    t = np.divide((px - x0) * dx + (py - y0) * dy, length2,
+                  out=np.zeros_like(length2), where=length2 > 0)
+    t = np.clip(t, 0, 1)
+    return x0 + t * dx, y0 + t * dy
+
+
+def segment_distances(ax0, ay0, ax1, ay1, bx0, by0, bx1, by1):
+    """
+    Return the distances between the segments ``a`` and ``b``, and the
+    closest points ``(px, py)`` on ``a`` and ``(qx, qy)`` on ``b``.
+    """
+    # The closest points include an end point of one of the segments,
+    # unless they cross.
+    candidates = []
+    for px, py in ((ax0, ay0), (ax1, ay1)):
+        qx, qy = closest_on_segment(px, py, bx0, by0, bx1, by1)
+        candidates.append((px, py, qx, qy))
+    for qx, qy in ((bx0, by0), (bx1, by1)):
+        px, py = closest_on_segment(qx, qy, ax0, ay0, ax1, ay1)
+        candidates.append((px, py, qx, qy))
+    px, py, qx, qy = [np.stack(column) for column in zip(*candidates)]
+    d2 = (px - qx) ** 2 + (py - qy) ** 2
+    best = np.argmin(d2, axis=0)
+    columns = np.arange(len(best))
+    px = px[best, columns]
+    py = py[best, columns]
+    qx = qx[best, columns]
+    qy = qy[best, columns]
+    distance = np.sqrt(d2[best, columns])
+
+    adx = ax1 - ax0
+    ady = ay1 - ay0
+    bdx = bx1 - bx0
+    bdy = by1 - by0
+    denominator = adx * bdy - ady * bdx
+    d1 = bdx * (ay0 - by0) - bdy * (ax0 - bx0)
+    d2 = bdx * (ay1 - by0) - bdy * (ax1 - bx0)
+    d3 = adx * (by0 - ay0) - ady * (bx0 - ax0)
+    d4 = adx * (by1 - ay0) - ady * (bx1 - ax0)
+    crossing = (d1 * d2 < 0) & (d3 * d4 < 0)
+    if crossing.any():
+        t = ((bx0 - ax0) * bdy - (by0 - ay0) * bdx)[crossing] / \
+            denominator[crossing]
+        px[crossing] = qx[crossing] = ax0[crossing] + t * adx[crossing]
+        py[crossing] = qy[crossing] = ay0[crossing] + t * ady[crossing]
+        distance[crossing] = 0
+    return distance, px, py, qx, qy
+
+
+class Closest(object):
+    """
+    The nearest pair of points found so far for each key, out of batches of
+    candidate pairs.
+    """
+    def __init__(self):
+        self.best = {}
+
+    def add(self, keys, distance, px, py, qx, qy):
+        if not len(keys):
+            return
+        # Sort by key, then distance, and take the first of each key.
+        order = np.lexsort((distance, keys))
+        keys = keys[order]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        best = self.best
+        for key, n in zip(keys[first].tolist(), order[first].tolist()):
+            d = float(distance[n])
+            if key not in best or d < best[key][0]:
+                best[key] = (d, float(px[n]), float(py[n]), float(qx[n]),
+                             float(qy[n]))
+
+    def violations(self, layer, kind, limit):
+        return [Violation(layer, kind, int(round(d)), limit,
+                          int(round(px)), int(round(py)), int(round(qx)),
+                          int(round(qy)))
+                for d, px, py, qx, qy in sorted(self.best.values())]
+
+
+def pair_key(a, b, count):
+    return a * count + b
+
+
+def check_clearance(name, art, base, roots, limit):
+    """
+    Return the clearance violations between the ``Segments`` of the art and
+    of the base, with ``roots`` giving the island of each shape. Each pair
+    of islands is reported once, where they come closest.
+    """
+    closest = Closest()
+    count = len(roots)
+    for i, j in grid_pairs(art.boxes(limit), base.boxes()):
+        a_shape = art.shape[i]
+        b_shape = base.shape[j]
+        a_root = roots[a_shape]
+        b_root = roots[b_shape]
+        apart = a_root != b_root
+        i = i[apart]
+        j = j[apart]
+        distance, px, py, qx, qy = segment_distances(
+            art.x0[i], art.y0[i], art.x1[i], art.y1[i],
+            base.x0[j], base.y0[j], base.x1[j], base.y1[j])
+        # Move the points out from the centre lines to the edges of the
+        # material.
+        length = np.maximum(distance, 1)
+        ux = (qx - px) / length
+        uy = (qy - py) / length
+        px += ux * art.radius[i]
+        py += uy * art.radius[i]
+        qx -= ux * base.radius[j]
+        qy -= uy * base.radius[j]
+        distance -= art.radius[i] + base.radius[j]
+        close = distance < limit
+        closest.add(pair_key(a_root[apart][close], b_root[apart][close],
+                             count),
+                    distance[close], px[close], py[close], qx[close],
+                    qy[close])
+    return closest.violations(name, 'clearance', limit)
+
+
+def check_width(name, art, roots, limit):
+    """
+    Return the width violations of the ``Segments`` of the art, with
+    ``roots`` giving the island of each shape. Each island is reported
+    once, at its narrowest point.
+
+    Draws and flashes are as wide as their aperture. A closed shape is too
+    narrow where two of its edges which face each other across its inside
+    come closer than ``limit``.
+    """
+    closest = Closest()
+    drawn = (art.radius > 0) & (2 * art.radius < limit)
+    closest.add(roots[art.shape[drawn]], 2 * art.radius[drawn],
+                art.x0[drawn], art.y0[drawn], art.x0[drawn], art.y0[drawn])
+
+    closed = np.nonzero(art.ccw != 0)[0]
+    boxes = tuple(column[closed] for column in art.boxes(limit / 2.0))
+    for i, j in grid_pairs(boxes, boxes, same=True):
+        i = closed[i]
+        j = closed[j]
+        # Only edges of the same shape, which are not neighbours.
+        keep = art.shape[i] == art.shape[j]
+        gap = np.abs(art.position[i] - art.position[j])
+        keep &= (gap > 1) & (gap != art.last[i])
+        i = i[keep]
+        j = j[keep]
+        distance, px, py, qx, qy = segment_distances(
+            art.x0[i], art.y0[i], art.x1[i], art.y1[i],
+            art.x0[j], art.y0[j], art.x1[j], art.y1[j])
+        # The edges face each other across the inside if each is on the
+        # inner side of the other, which is the left of a counterclockwise
+        # shape.
+        adx = art.x1[i] - art.x0[i]
+        ady = art.y1[i] - art.y0[i]
+        bdx = art.x1[j] - art.x0[j]
+        bdy = art.y1[j] - art.y0[j]
+        ccw = art.ccw[i]
+        facing = (ccw * (adx * (qy - py) - ady * (qx - px)) > 0) & \
+            (ccw * (bdx * (py - qy) - bdy * (px - qx)) > 0)
+        narrow = facing & (distance > 0) & (distance < limit)
+        closest.add(roots[art.shape[i[narrow]]], distance[narrow],
+                    px[narrow], py[narrow], qx[narrow], qy[narrow])
+    return closest.violations(name, 'width', limit)
+
+
+def check_layer(name, base, extra, rule):
+    """
+    Return the violations of ``rule`` by the art in the ``extra`` plane of
+    layer ``name`` over its ``base`` plane.
+    """
+    if extra is None or (rule.clearance is None and rule.width is None):
+        return []
+    base_shapes = copper_shapes(base)
+    art_shapes = copper_shapes(extra)
+    if not art_shapes:
+        return []
+    sets, island_of = join_layers(base_shapes, art_shapes)
+    roots = np.array([sets.find(n)
+                      for n in range(len(base_shapes) + len(art_shapes))],
+                     dtype=np.int64)
+    art = Segments(art_shapes, len(base_shapes))
+    violations = []
+    if rule.clearance is not None and base_shapes:
+        violations.extend(check_clearance(name, art, Segments(base_shapes),
+                                          roots, rule.clearance))
+    if rule.width is not None:
+        violations.extend(check_width(name, art, roots, rule.width))
+    return violations
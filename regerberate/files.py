@@ -0,0 +1,23 @@
+"""
+Helpers for replacing files atomically.
+"""
+import os
+import stat
+
+
+def replace_file(tmp_path, filename):
+    """
+    Move the finished temporary file ``tmp_path`` over ``filename``.
+
+    ``tempfile.mkstemp()`` creates files readable only by their owner, so
+    the permissions of the file being replaced are copied first, or for a
+    new file, the usual ``0666`` less the process umask.
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(filename).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    os.chmod(tmp_path, mode)
+    os.replace(tmp_path, filename)
@@ -0,0 +1,162 @@
+"""
+Conversion of ``GraphicsPlane`` primitives into polygons.
+
+Each primitive becomes one or more ``(dark, points)`` pairs, where ``points``
+is a closed contour (without a repeated final vertex) of integer picometre
+coordinates. Applying them in order, dark adding and clear removing, gives
+the image of the plane.
+"""
+import weakref
+
+from .clipping import flatten
+from .gerber.arcs import arc_points, default_tolerance
+from .gerber.plane import DRAW, ARC, FLASH, REGION, DARK, CLOCKWISE
+
+
+def convex_hull(points):
+    """
+    Return the convex hull of ``points`` counterclockwise, by Andrew's
+    monotone chain.
+    """
+    points = sorted(set(points))
+    if len(points) < 3:
+        return points
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower = []
+    for p in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    upper = []
+    for p in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+
+def sweep_convex(points, dx, dy):
+    """
+    Return the polygon swept by moving the convex polygon ``points`` by
+    ``(dx, dy)``, in linear time. The part of the outline facing the
+    direction of travel comes from the polygon at its end, and the rest
+    from the polygon at its start.
+    """
+    n = len(points)
+    area2 = sum(points[i - 1][0] * points[i][1] - points[i][0] *
+                points[i - 1][1] for i in range(n))
+    if area2 < 0:
+        points = points[::-1]
+    if not dx and not dy:
+        return points
+    # Extreme vertices to the left and right of the direction of travel.
+    side = [dx * y - dy * x for x, y in points]
+    left = side.index(max(side))
+    right = side.index(min(side))
+    front = []
+    i = right
+    while True:
+        x, y = points[i]
+        front.append((x + dx, y + dy))
+        if i == left:
+            break
+        i = (i + 1) % n
+    back = []
+    while True:
+        back.append(points[i])
+        if i == right:
+            break
+        i = (i + 1) % n
+    return front + back
+
+
+def stroke(aperture, x0, y0, x1, y1):
+    """
+    Return the polygon swept by moving ``aperture`` from ``(x0, y0)`` to
+    ``(x1, y1)``. Draws may only use circle and rectangle apertures, which
+    are convex, so this is the hull of the aperture at both ends.
+    """
+    shapes = [shape for dark, shape in aperture.shapes if dark]
+    if len(shapes) == 1 and len(shapes[0]) >= 3:
+        return sweep_convex([(x0 + x, y0 + y) for x, y in shapes[0]],
+                            x1 - x0, y1 - y0)
+    points = [p for shape in shapes for p in shape]
+    if not points:
+        return []
+    return convex_hull([(x0 + x, y0 + y) for x, y in points] +
+                       [(x1 + x, y1 + y) for x, y in points])
+
+
+# Dark outlines of apertures with holes, flattened once per aperture.
+_outlines = weakref.WeakKeyDictionary()
+
+
+def aperture_outlines(aperture):
+    """
+    Return the dark outlines of ``aperture`` as a list of contours. The clear
+    shapes of an aperture, such as the hole of a standard aperture or the
+    exposure off primitives of a macro, only cut the aperture itself, so an
+    aperture which has any is flattened on its own first.
+    """
+    if all(dark for dark, points in aperture.shapes):
+        return [points for dark, points in aperture.shapes]
+    outlines = _outlines.get(aperture)
+    if outlines is None:
+        outlines = [list(zip(xs[:-1], ys[:-1]))
+                    for xs, ys in flatten([(dark, points) for dark, points
+                                           in aperture.shapes
+                                           if len(points) >= 3])]
+        _outlines[aperture] = outlines
+    return outlines
+
+
+def primitive_polygons(plane, index, tolerance=default_tolerance):
+    """
+    Return the ``(dark, points)`` polygons for the primitive at ``index``.
+    Arcs are flattened with a chord error of at most ``tolerance``.
+    """
+    kind = plane.kinds[index]
+    flags = plane.flags[index]
+    dark = bool(flags & DARK)
+    if kind == REGION:
+        points = plane[index].vertices
+        if len(points) > 1 and points[0] == points[-1]:
+            points.pop()
+        return [(dark, points)]
+
+    aperture = plane.apertures[plane.aperture_numbers[index]]
+    x0, y0 = plane.x0[index], plane.y0[index]
+    x1, y1 = plane.x1[index], plane.y1[index]
+    if kind == FLASH:
+        # A clear flash removes the dark parts of its aperture; the holes of
+        # the aperture are then left as they were.
+        return [(dark, [(x0 + x, y0 + y) for x, y in points])
+                for points in aperture_outlines(aperture)]
+    elif kind == DRAW:
+        return [(dark, stroke(aperture, x0, y0, x1, y1))]
+    elif kind == ARC:
+        points = arc_points(x0, y0, x1, y1, plane.cx[index], plane.cy[index],
+                            flags & CLOCKWISE, tolerance)
+        return [(dark, stroke(aperture, xa, ya, xb, yb))
+                for (xa, ya), (xb, yb) in zip(points, points[1:])]
+    raise ValueError('unknown primitive kind %r' % kind)
+
+
+def plane_polygons(plane, tolerance=default_tolerance):
+    """
+    Yield the ``(dark, points)`` polygons of every primitive in ``plane``, in
+    order, with step and repeat blocks written out copy by copy.
+    """
+    for start, stop, offsets in plane.segments():
+        for dx, dy in offsets:
+            for index in range(start, stop):
+                for dark, points in primitive_polygons(plane, index,
+                                                       tolerance):
+                    if len(points) < 3:
+                        continue
+                    if dx or dy:
+                        points = [(x + dx, y + dy) for x, y in points]
+                    yield dark, points
@@ -0,0 +1,505 @@
+"""
+Standard apertures and aperture macros.
+
+Aperture shapes are compiled once, when the aperture is defined, into a list
+of ``(dark, points)`` polygons in picometres relative to the flash point.
+Later shapes are drawn over earlier ones, so a clear shape cuts a hole in the
+dark shapes before it.
+
+Aperture macro expressions are compiled into closures, so that each macro
+is parsed once no matter how many apertures are instantiated from it.
+"""
+import math
+import operator
+import re
+
+from .coordinates import unit_scales
+
+circle_segments = 64
+
+
+def parse_modifiers(s):
+    """
+    Parse an aperture definition's modifiers, like ``'0.0600X0.0400'``,
+    into a list of floats.
+    """
+    if not s:
+        return []
+    return [float(value) for value in s.split('X')]
+
+
+# -- Macro expressions -------------------------------------------------------
+
+expression_token_re = re.compile(
+    r'\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)'
+    r'|\$(\d+)|([-+xX/()]))')
+
+binary_operators = {
+    '+': operator.add,
+    '-': operator.sub,
+    'x': operator.mul,
+    'X': operator.mul,
+    '/': operator.truediv,
+}
+
+
+def tokenize_expression(s):
+    tokens = []
+    pos = 0
+    s = s.strip()
+    while pos < len(s):
+        m = expression_token_re.match(s, pos)
+        if m is None:
+            raise ValueError('invalid macro expression %r' % s)
+        number, variable, symbol = m.groups()
+        if number is not None:
+            tokens.append(('number', float(number)))
+        elif variable is not None:
+            tokens.append(('variable', int(variable)))
+        else:
+            tokens.append(('symbol', symbol))
+        pos = m.end()
+    return tokens
+
+
+def constant(value):
+    def evaluate(variables):
+        return value
+    evaluate.constant = value
+    return evaluate
+
+
+def variable(n):
+    def evaluate(variables):
+        # Undefined variables evaluate to zero.
+        return variables.get(n, 0.0)
+    return evaluate
+
+
+def binary(op, left, right):
+    if hasattr(left, 'constant') and hasattr(right, 'constant'):
+        return constant(op(left.constant, right.constant))
+
+    def evaluate(variables):
+        return op(left(variables), right(variables))
+    return evaluate
+
+
+def negate(operand):
+    if hasattr(operand, 'constant'):
+        return constant(-operand.constant)
+
+    def evaluate(variables):
+        return -operand(variables)
+    return evaluate
+
+
+class ExpressionCompiler(object):
+    """
+    Compile an aperture macro arithmetic expression into a function of a
+    dict of variable values.
+
+    Grammar (Section 4.13.5, p121)::
+
+        expression = term {('+' | '-') term}
+        term = factor {('x' | 'X' | '/') factor}
+        factor = ['+' | '-'] factor | number | '$' n | '(' expression ')'
+    """
+    def __init__(self, s):
+        self.s = s
+        self.tokens = tokenize_expression(s)
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None, None
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def compile(self):
+        if not self.tokens:
+            raise ValueError('empty macro expression')
+        f = self.expression()
+        if self.pos != len(self.tokens):
+            raise ValueError('invalid macro expression %r' % self.s)
+        return f
+
+    def expression(self):
+        f = self.term()
+        while self.peek() in (('symbol', '+'), ('symbol', '-')):
+            op = binary_operators[self.take()[1]]
+            f = binary(op, f, self.term())
+        return f
+
+    def term(self):
+        f = self.factor()
+        while self.peek() in (('symbol', 'x'), ('symbol', 'X'),
+                              ('symbol', '/')):
+            op = binary_operators[self.take()[1]]
+            f = binary(op, f, self.factor())
+        return f
+
+    def factor(self):
+        kind, value = self.take()
+        if kind == 'number':
+            return constant(value)
+        elif kind == 'variable':
+            return variable(value)
+        elif value == '-':
+            return negate(self.factor())
+        elif value == '+':
+            return self.factor()
+        elif value == '(':
+            f = self.expression()
+            if self.take() != ('symbol', ')'):
+                raise ValueError('unbalanced parentheses in %r' % self.s)
+            return f
+        raise ValueError('invalid macro expression %r' % self.s)
+
+
+def compile_expression(s):
+    return ExpressionCompiler(s).compile()
+
+
+# -- Shape construction ------------------------------------------------------
+
+def rotate(points, degrees):
+    if not degrees:
+        return points
+    theta = math.radians(degrees)
+    c = math.cos(theta)
+    s = math.sin(theta)
+    return [(x * c - y * s, x * s + y * c) for x, y in points]
+
+
+def circle(cx, cy, diameter):
+    r = diameter / 2.0
+    step = 2 * math.pi / circle_segments
+    return [(cx + r * math.cos(n * step), cy + r * math.sin(n * step))
+            for n in range(circle_segments)]
+
+
+def rectangle(cx, cy, width, height):
+    w = width / 2.0
+    h = height / 2.0
+    return [(cx - w, cy - h), (cx + w, cy - h), (cx + w, cy + h),
+            (cx - w, cy + h)]
+
+
+def obround(cx, cy, width, height):
+    if width == height:
+        return circle(cx, cy, width)
+    half = circle_segments // 2
+    step = math.pi / half
+    if width > height:
+        r = height / 2.0
+        d = width / 2.0 - r
+        right = [(cx + d + r * math.cos(-math.pi / 2 + n * step),
+                  cy + r * math.sin(-math.pi / 2 + n * step))
+                 for n in range(half + 1)]
+        left = [(2 * cx - x, 2 * cy - y) for x, y in right]
+    else:
+        r = width / 2.0
+        d = height / 2.0 - r
+        right = [(cx + r * math.cos(n * step),
+                  cy + d + r * math.sin(n * step))
+                 for n in range(half + 1)]
+        left = [(2 * cx - x, 2 * cy - y) for x, y in right]
+    return right + left
+
+
+def regular_polygon(cx, cy, diameter, vertices, degrees=0):
+    r = diameter / 2.0
+    step = 2 * math.pi / vertices
+    theta = math.radians(degrees)
+    return [(cx + r * math.cos(theta + n * step),
+             cy + r * math.sin(theta + n * step))
+            for n in range(int(vertices))]
+
+
+def arc(cx, cy, radius, start, end):
+    """
+    Return points along the circle from angle ``start`` to ``end``, in
+    radians, counterclockwise if ``end`` is the greater, including both ends.
+    """
+    steps = max(int(math.ceil(abs(end - start) / (2 * math.pi) *
+                              circle_segments)), 1)
+    step = (end - start) / steps
+    return [(cx + radius * math.cos(start + n * step),
+             cy + radius * math.sin(start + n * step))
+            for n in range(steps + 1)]
+
+
+def vector_line(width, sx, sy, ex, ey):
+    dx = ex - sx
+    dy = ey - sy
+    length = math.hypot(dx, dy)
+    if not length:
+        return []
+    nx = -dy / length * width / 2.0
+    ny = dx / length * width / 2.0
+    return [(sx + nx, sy + ny), (sx - nx, sy - ny), (ex - nx, ey - ny),
+            (ex + nx, ey + ny)]
+
+
+# -- Aperture macros ---------------------------------------------------------
+
+def macro_circle(exposure, diameter, cx, cy, degrees=0):
+    return [(exposure, rotate(circle(cx, cy, diameter), degrees))]
+
+
+def macro_vector_line(exposure, width, sx, sy, ex, ey, degrees=0):
+    return [(exposure, rotate(vector_line(width, sx, sy, ex, ey), degrees))]
+
+
+def macro_center_line(exposure, width, height, cx, cy, degrees=0):
+    return [(exposure, rotate(rectangle(cx, cy, width, height), degrees))]
+
+
+def macro_lower_left_line(exposure, width, height, x, y, degrees=0):
+    return [(exposure, rotate(rectangle(x + width / 2.0, y + height / 2.0,
+                                        width, height), degrees))]
+
+
+def macro_outline(exposure, count, *args):
+    count = int(count)
+    coordinates = args[:2 * (count + 1)]
+    degrees = args[2 * (count + 1)] if len(args) > 2 * (count + 1) else 0
+    points = list(zip(coordinates[0::2], coordinates[1::2]))
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    return [(exposure, rotate(points, degrees))]
+
+
+def macro_polygon(exposure, vertices, cx, cy, diameter, degrees=0):
+    return [(exposure, rotate(regular_polygon(cx, cy, diameter, vertices),
+                              degrees))]
+
+
+def macro_moire(cx, cy, outer_diameter, thickness, gap, max_rings,
+                crosshair_thickness, crosshair_length, degrees=0):
+    # Each ring is made of two dark halves rather than cut with a clear
+    # circle, which would also clear the primitives before it.
+    shapes = []
+    diameter = outer_diameter
+    for n in range(int(max_rings)):
+        if diameter <= 0:
+            break
+        inner = diameter - 2 * thickness
+        if inner > 0:
+            for start, end in ((0, math.pi), (math.pi, 2 * math.pi)):
+                shapes.append((True, arc(cx, cy, diameter / 2.0, start, end) +
+                               arc(cx, cy, inner / 2.0, end, start)))
+        else:
+            shapes.append((True, circle(cx, cy, diameter)))
+        diameter = inner - 2 * gap
+    shapes.append((True, rectangle(cx, cy, crosshair_length,
+                                   crosshair_thickness)))
+    shapes.append((True, rectangle(cx, cy, crosshair_thickness,
+                                   crosshair_length)))
+    return [(dark, rotate(points, degrees)) for dark, points in shapes]
+
+
+def macro_thermal(cx, cy, outer_diameter, inner_diameter, gap, degrees=0):
+    # The gaps cut the ring into four dark pieces, built one per quadrant
+    # so that the gaps do not clear the primitives before the thermal.
+    outer = outer_diameter / 2.0
+    inner = inner_diameter / 2.0
+    half_gap = gap / 2.0
+    if outer * outer <= 2 * half_gap * half_gap:
+        return []
+    start = math.asin(half_gap / outer)
+    points = arc(0, 0, outer, start, math.pi / 2 - start)
+    if inner * inner > 2 * half_gap * half_gap:
+        start = math.asin(half_gap / inner)
+        points.extend(arc(0, 0, inner, math.pi / 2 - start, start))
+    else:
+        # The gaps are wide enough to meet inside the inner circle.
+        points.append((half_gap, half_gap))
+    shapes = [(True, [(cx + x, cy + y) for x, y in rotate(points, 90 * k)])
+              for k in range(4)]
+    return [(dark, rotate(points, degrees)) for dark, points in shapes]
+
+
+# Primitive code -> (function, whether the first modifier is an exposure).
+macro_primitives = {
+    1: (macro_circle, True),
+    2: (macro_vector_line, True),
+    20: (macro_vector_line, True),
+    21: (macro_center_line, True),
+    22: (macro_lower_left_line, True),
+    4: (macro_outline, True),
+    5: (macro_polygon, True),
+    6: (macro_moire, False),
+    7: (macro_thermal, False),
+}
+
+
+class MacroTemplate(object):
+    """
+    A compiled aperture macro (Section 4.13, p106).
+
+    The macro body is split into statements and each expression compiled
+    once. ``evaluate()`` then only runs the compiled closures.
+    """
+    def __init__(self, name, body):
+        self.name = name
+        self.body = body
+        self.statements = []
+        for statement in body.split('*'):
+            statement = statement.strip()
+            if not statement or statement.startswith('0'):
+                # Empty, or a comment primitive.
+                continue
+            if statement.startswith('$'):
+                target, expression = statement[1:].split('=', 1)
+                self.statements.append(
+                    ('assign', int(target), compile_expression(expression)))
+            else:
+                fields = statement.split(',')
+                code = int(fields[0])
+                if code not in macro_primitives:
+                    raise ValueError('unknown macro primitive %d in %r' %
+                                     (code, name))
+                self.statements.append(
+                    ('primitive', code,
+                     [compile_expression(field) for field in fields[1:]]))
+
+    def evaluate(self, args):
+        """
+        Evaluate the macro with the given arguments, returning a list of
+        ``(dark, points)`` polygons in the file unit.
+        """
+        variables = dict((n + 1, value) for n, value in enumerate(args))
+        shapes = []
+        for kind, target, expressions in self.statements:
+            if kind == 'assign':
+                variables[target] = expressions(variables)
+                continue
+            function, has_exposure = macro_primitives[target]
+            values = [f(variables) for f in expressions]
+            if has_exposure:
+                exposure = values.pop(0)
+                shapes.extend((bool(exposure), points)
+                              for dark, points in function(exposure, *values))
+            else:
+                shapes.extend(function(*values))
+        return shapes
+
+
+# -- Apertures ---------------------------------------------------------------
+
+def standard_circle(diameter):
+    return circle(0, 0, diameter)
+
+
+def standard_rectangle(width, height):
+    return rectangle(0, 0, width, height)
+
+
+def standard_obround(width, height):
+    return obround(0, 0, width, height)
+
+
+def standard_polygon(diameter, vertices, degrees=0):
+    return regular_polygon(0, 0, diameter, vertices, degrees)
+
+
+# Template name -> (function, required modifiers, index of hole diameter).
+standard_templates = {
+    'C': (standard_circle, 1, 1),
+    'R': (standard_rectangle, 2, 2),
+    'O': (standard_obround, 2, 2),
+    'P': (standard_polygon, 2, 3),
+}
+
+
+class Aperture(object):
+    """
+    An aperture defined by an AD command (Section 4.11, p99), either from a
+    standard template (C, R, O, P) or from an aperture macro.
+
+    ``shapes`` is computed when the aperture is defined and reused by every
+    flash and draw which references it. ``unit`` is the unit the modifiers
+    are given in. ``macro`` is the body of the aperture macro the aperture
+    was defined from, as written in the AM command, or ``None`` for standard
+    templates.
+    """
+    def __init__(self, number, template_name, modifiers, shapes, unit='MM',
+                 macro=None):
+        self.number = number
+        self.template_name = template_name
+        self.modifiers = modifiers
+        self.shapes = shapes
+        self.unit = unit
+        self.macro = macro
+        xs = [x for dark, points in shapes if dark for x, y in points]
+        ys = [y for dark, points in shapes if dark for x, y in points]
+        if xs:
+            self.bbox = min(xs), min(ys), max(xs), max(ys)
+        else:
+            self.bbox = 0, 0, 0, 0
+
+    def __repr__(self):
+        return '<Aperture D%d %s %r>' % (self.number, self.template_name,
+                                         self.modifiers)
+
+    def to_record(self):
+        """
+        Return the aperture as plain lists, strings and numbers, for
+        ``from_record()``. Each shape's points are flattened to ``[x0, y0,
+        x1, y1, ...]``.
+        """
+        return [self.number, self.template_name, self.modifiers, self.unit,
+                self.macro, [[dark, [c for point in points for c in point]]
+                             for dark, points in self.shapes]]
+
+    @classmethod
+    def from_record(cls, record):
+        number, template_name, modifiers, unit, macro, shapes = record
+        return cls(number, template_name, modifiers,
+                   [(dark, list(zip(coords[::2], coords[1::2])))
+                    for dark, coords in shapes], unit, macro)
+
+    @property
+    def diameter(self):
+        """
+        Diameter of a circular aperture, in picometres, or ``None``.
+        """
+        if self.template_name == 'C':
+            return self.bbox[2] - self.bbox[0]
+        return None
+
+    @classmethod
+    def define(cls, number, template_name, modifiers, unit, templates):
+        """
+        Build an aperture, looking up macro templates in ``templates``.
+        """
+        args = parse_modifiers(modifiers)
+        macro = None
+        if template_name in standard_templates:
+            function, required, hole_index = \
+                standard_templates[template_name]
+            assert len(args) >= required, \
+                "aperture D%d needs %d modifiers" % (number, required)
+            raw_shapes = [(True, function(*args[:hole_index]))]
+            if len(args) > hole_index and args[hole_index]:
+                # Holes are recorded as clear shapes within the aperture.
+                raw_shapes.append((False, circle(0, 0, args[hole_index])))
+        else:
+            template = templates.get(template_name)
+            assert template is not None, \
+                "aperture D%d uses undefined macro %r" % (number,
+                                                          template_name)
+            raw_shapes = template.evaluate(args)
+            macro = template.body
+
+        scale = unit_scales[unit]
+        shapes = [(dark, [(int(round(x * scale)), int(round(y * scale)))
+                          for x, y in points])
+                  for dark, points in raw_shapes if points]
+        return cls(number, template_name, modifiers, shapes, unit, macro)
@@ -0,0 +1,99 @@
+"""
+Circular interpolation.
+
+Arcs are resolved to an explicit centre when they are parsed, and flattened
+to straight segments on demand. Flattening uses as few segments as keep the
+chord error within ``tolerance``, and is memoized on the arc's shape relative
+to its centre, so repeated arcs, like the rounded corners of every pad of a
+footprint, are only computed once.
+"""
+import math
+from functools import lru_cache
+
+# Default maximum distance between an arc and its flattened chords, in
+# picometres.
+default_tolerance = 1000000
+
+two_pi = 2 * math.pi
+
+
+def arc_sweep(x0, y0, x1, y1, cx, cy, clockwise):
+    """
+    Return the signed angle swept from ``(x0, y0)`` to ``(x1, y1)`` around
+    ``(cx, cy)``: negative for clockwise arcs and positive otherwise.
+    Coincident end points give a full circle.
+    """
+    sweep = math.atan2(y1 - cy, x1 - cx) - math.atan2(y0 - cy, x0 - cx)
+    if clockwise:
+        if sweep >= 0:
+            sweep -= two_pi
+    elif sweep <= 0:
+        sweep += two_pi
+    return sweep
+
+
+def single_quadrant_center(x0, y0, x1, y1, i, j, clockwise):
+    """
+    Return the centre of a single quadrant (G74) arc. The offsets ``i`` and
+    ``j`` are unsigned, so of the four candidate centres, the one giving an
+    arc of at most 90 degrees with the most nearly equal radii at each end
+    is chosen (Section 4.5.8, p73).
+    """
+    best = None
+    for cx, cy in ((x0 + i, y0 + j), (x0 - i, y0 + j), (x0 + i, y0 - j),
+                   (x0 - i, y0 - j)):
+        sweep = abs(arc_sweep(x0, y0, x1, y1, cx, cy, clockwise))
+        if sweep > math.pi / 2 + 1e-6:
+            continue
+        error = abs(math.hypot(x0 - cx, y0 - cy) -
+                    math.hypot(x1 - cx, y1 - cy))
+        if best is None or error < best[0]:
+            best = error, cx, cy
+    assert best is not None, "no valid centre for single quadrant arc"
+    return best[1], best[2]
+
+
+def segment_count(radius, sweep, tolerance):
+    """
+    Return the number of chords needed to flatten an arc of ``radius`` and
+    ``sweep`` radians with a chord error of at most ``tolerance``.
+    """
+    if radius <= tolerance:
+        return 1
+    step = 2 * math.acos(1 - tolerance / radius)
+    return max(1, int(math.ceil(abs(sweep) / step)))
+
+
+@lru_cache(maxsize=4096)
+def arc_offsets(dx0, dy0, dx1, dy1, clockwise, tolerance):
+    """
+    Return the intermediate points of an arc from ``(dx0, dy0)`` to
+    ``(dx1, dy1)`` around the origin, as a tuple of integer ``(x, y)``
+    offsets. The radius is interpolated if the two ends differ.
+    """
+    r0 = math.hypot(dx0, dy0)
+    r1 = math.hypot(dx1, dy1)
+    a0 = math.atan2(dy0, dx0)
+    sweep = arc_sweep(dx0, dy0, dx1, dy1, 0, 0, clockwise)
+    n = segment_count(max(r0, r1), sweep, tolerance)
+    points = []
+    for k in range(1, n):
+        t = k / n
+        r = r0 + (r1 - r0) * t
+        a = a0 + sweep * t
+        points.append((int(round(r * math.cos(a))),
+                       int(round(r * math.sin(a)))))
+    return tuple(points)
+
+
+def arc_points(x0, y0, x1, y1, cx, cy, clockwise,
+               tolerance=default_tolerance):
+    """
+    Flatten an arc into a list of points from its start to its end.
+    """
+    offsets = arc_offsets(x0 - cx, y0 - cy, x1 - cx, y1 - cy,
+                          bool(clockwise), tolerance)
+    points = [(x0, y0)]
+    points.extend([(cx + dx, cy + dy) for dx, dy in offsets])
+    points.append((x1, y1))
+    return points
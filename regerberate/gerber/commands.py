@@ -2,45 +2,130 @@
 Table of command codes is in Section 4.1, page 58.
 """
 import re
-from decimal import Decimal
 
 
 def parse_command(s):
-    if s[0] == '%':
-        # Extended commands, identify by first 3 chars
-        code = s[1:3]
-        cls = extended_commands[code]
+    """
+    Parse a single command string, as yielded by ``GerberTokenizer``, into a
+    ``Command`` instance.
+
+    Commands are dispatched on their first character, and each kind is
+    classified and has its fields extracted by a single precompiled match.
+    """
+    c = s[0]
+    if c == 'X':
+        # Fast path for the overwhelmingly common XnnnYnnnDnn* form.
+        m = match_simple_operation(s)
+        if m is not None:
+            x, y, d = m.groups()
+            return operation_commands[d[-1]](x, y, code_string=d)
+    elif c == '%':
+        # Extended commands, identify by first 2 chars after the %
+        cls = extended_commands.get(s[1:3])
+        if cls is None:
+            raise ValueError('unsupported extended command %r' % s)
         return cls.from_string(s)
     else:
-        # For normal commands, identify by end
-        code = s[-4:-1]
-        if code in normal_commands:
-            cls = normal_commands[code]
-            return cls.from_string(s)
-        else:
-            # If not in the map it's a set aperture command
-            return SetApertureCommand.from_string(s)
+        cmd = bare_commands.get(s)
+        if cmd is not None:
+            return cmd
+    parser = command_parsers.get(c)
+    if parser is None:
+        raise ValueError('invalid command %r' % s)
+    return parser(s)
+
+
+def parse_operation(s):
+    m = match_operation(s)
+    if m is None:
+        raise ValueError('invalid command %r' % s)
+    mode, x, y, i, j, d = m.groups()
+    return operation_commands[d and d[-1]](
+        x, y, i, j, mode and 'G0' + mode[-1], mode, d)
+
+
+def parse_d_code(s):
+    m = match_d_code(s)
+    if m is None:
+        raise ValueError('invalid command %r' % s)
+    number = int(m.group(1))
+    if number < 10:
+        return parse_operation(s)
+    return SetApertureCommand(number)
+
+
+def parse_code(s):
+    m = match_code(s)
+    if m is None:
+        if match_comment(s):
+            return CommentCommand.from_string(s)
+        if s.startswith('G54D'):
+            return parse_d_code(s[3:])
+        return parse_operation(s)
+    letter, code = m.groups()
+    name = letter + code.zfill(2)
+    cls = normal_commands.get(name)
+    if cls is None:
+        raise ValueError('unsupported command %r' % s)
+    if cls is CommentCommand:
+        return cls.from_string(s)
+    # Shared instances are kept for each spelling, like G1 for G01.
+    return cls(None if s[:-1] == name else s[:-1])
 
 
 class Command(object):
     """
     Base class for Gerber commands.
     """
+    __slots__ = ()
     deprecated = False
 
     def __repr__(self):
-        return '<%s %r>' % (self.__class__.__name__, self.__dict__)
+        fields = dict((name, getattr(self, name))
+                      for cls in reversed(self.__class__.__mro__)
+                      for name in getattr(cls, '__slots__', ()))
+        return '<%s %r>' % (self.__class__.__name__, fields)
 
     @classmethod
     def from_string(cls, s):
         return cls()
 
 
+class StatelessCommand(Command):
+    """
+    Base class for commands without arguments. These carry no state but the
+    spelling of their code, so a single shared instance of each is used for
+    every occurrence written the same way.
+
+    ``code_string`` is the code as it was parsed, if it was not written in
+    the canonical form ``code``, so ``to_string()`` gives back the original
+    text.
+    """
+    __slots__ = ('code_string',)
+    code = ''
+
+    def __new__(cls, code_string=None):
+        instances = cls.__dict__.get('instances')
+        if instances is None:
+            instances = cls.instances = {}
+        instance = instances.get(code_string)
+        if instance is None:
+            instance = super(StatelessCommand, cls).__new__(cls)
+            instance.code_string = code_string
+            instances[code_string] = instance
+        return instance
+
+    def to_string(self):
+        return (self.code_string or self.code) + '*'
+
+
 class UnitCommand(Command):
     """
     Command Code MO - Extended
     Section 4.10, p98
     """
+    __slots__ = ('unit',)
+
     def __init__(self, unit):
         self.unit = unit
 
@@ -61,27 +146,42 @@ class CoordinateFormatCommand(Command):
     """
     Command Code FS - Extended
     Section 4.9, p96
+    Syntax is like %FSLAX25Y25*%
+
+    L or T selects omission of leading or trailing zeros, A or I selects
+    absolute or incremental notation.
     """
-    def __init__(self, integer_digits, fractional_digits):
+    __slots__ = ('integer_digits', 'fractional_digits', 'zero_omission',
+                 'notation')
+
+    def __init__(self, integer_digits, fractional_digits, zero_omission='L',
+                 notation='A'):
         self.integer_digits = integer_digits
         self.fractional_digits = fractional_digits
+        self.zero_omission = zero_omission
+        self.notation = notation
 
     @classmethod
     def from_string(cls, s):
-        assert s.startswith('%FSLAX')
-        xformat = s[6:8]
-        yformat = s[9:11]
+        m = coordinate_format_re.match(s)
+        assert m, "invalid coordinate format %r" % s
+        zero_omission, notation, xformat, yformat = m.groups()
         assert xformat == yformat
         return cls(integer_digits=int(xformat[0]),
-                   fractional_digits=int(xformat[1]))
+                   fractional_digits=int(xformat[1]),
+                   zero_omission=zero_omission,
+                   notation=notation)
 
     def to_string(self):
         format = '%d%d' % (self.integer_digits, self.fractional_digits)
-        return '%FSLAX' + format + 'Y' + format + '*%'
+        return ('%FS' + self.zero_omission + self.notation +
+                'X' + format + 'Y' + format + '*%')
 
     def execute(self, state, plane):
         state.set_coordinate_format(integer_digits=self.integer_digits,
-                                    fractional_digits=self.fractional_digits)
+                                    fractional_digits=self.fractional_digits,
+                                    zero_omission=self.zero_omission,
+                                    notation=self.notation)
 
 
 class OffsetCommand(Command):
@@ -90,6 +190,7 @@ class OffsetCommand(Command):
     Section 7.1.7, p163
     Syntax is like %OFA1.2B-1.0*%
     """
+    __slots__ = ('offset_a', 'offset_b')
     deprecated = True
 
     def __init__(self, offset_a, offset_b):
@@ -100,17 +201,14 @@ class OffsetCommand(Command):
     def from_string(cls, s):
         assert s.startswith('%OFA')
         format = s[4:-2]
-        raw_a, raw_b = format.split('B')
-        offset_a = Decimal(raw_a)
-        offset_b = Decimal(raw_b)
+        offset_a, offset_b = format.split('B')
         return cls(offset_a=offset_a, offset_b=offset_b)
 
     def to_string(self):
-        return '%OFA' + str(self.offset_a) + 'B' + str(self.offset_b) + '*%'
+        return '%OFA' + self.offset_a + 'B' + self.offset_b + '*%'
 
     def execute(self, state, plane):
-        # XXX
-        pass
+        state.set_offset(self.offset_a, self.offset_b)
 
 
 class ImagePolarityCommand(Command):
@@ -118,6 +216,7 @@ class ImagePolarityCommand(Command):
     Command Code IP - Extended, Deprecated
     Section 7.1.3, p160
     """
+    __slots__ = ('polarity',)
     deprecated = True
 
     def __init__(self, polarity):
@@ -145,6 +244,8 @@ class LevelPolarityCommand(Command):
     C = clear
     D = dark
     """
+    __slots__ = ('polarity',)
+
     def __init__(self, polarity):
         self.polarity = polarity
 
@@ -161,13 +262,52 @@ class LevelPolarityCommand(Command):
         state.set_level_polarity('dark' if self.polarity == 'D' else 'clear')
 
 
+class StepAndRepeatCommand(Command):
+    """
+    Command Code SR - Extended
+    Section 4.14, p129
+    Syntax is like %SRX3Y2I5.0J4.0*% to open a block, or %SR*% to close it
+
+    X and Y are the number of copies in each direction, and I and J the
+    distance between them.
+    """
+    __slots__ = ('x_count', 'y_count', 'x_step', 'y_step')
+
+    def __init__(self, x_count=1, y_count=1, x_step=None, y_step=None):
+        self.x_count = x_count
+        self.y_count = y_count
+        self.x_step = x_step
+        self.y_step = y_step
+
+    @classmethod
+    def from_string(cls, s):
+        m = step_and_repeat_re.match(s)
+        assert m, "invalid step and repeat %r" % s
+        x_count, y_count, x_step, y_step = m.groups()
+        if x_count is None:
+            return cls()
+        return cls(x_count=int(x_count), y_count=int(y_count),
+                   x_step=x_step, y_step=y_step)
+
+    def to_string(self):
+        if self.x_step is None:
+            return '%SR*%'
+        return '%%SRX%dY%dI%sJ%s*%%' % (
+            self.x_count, self.y_count, self.x_step, self.y_step)
+
+    def execute(self, state, plane):
+        state.set_step_and_repeat(plane, self.x_count, self.y_count,
+                                  self.x_step, self.y_step)
+
+
 class MacroApertureCommand(Command):
     """
     Command Code AM - Extended
     Section 4.13.1 - p106
-    Syntax is complex, return to this later
+    Syntax is like %AMOC8*5,1,8,0,0,1.08239X$1,22.5*%
     """
-    # XXX This is missing a lot of stuff
+    __slots__ = ('template_name', 's')
+
     def __init__(self, template_name, s):
         self.template_name = template_name
         self.s = s
@@ -179,46 +319,54 @@ class MacroApertureCommand(Command):
         return cls(template_name=template_name,
                    s=s)
 
+    @property
+    def body(self):
+        """
+        The macro content following the name, without the closing ``*%``.
+        """
+        return self.s[4 + len(self.template_name):-2]
+
     def to_string(self):
         return self.s
 
     def execute(self, state, plane):
-        # XXX
-        pass
+        state.define_template(self.template_name, self.body)
 
 
 class ApertureDefinitionCommand(Command):
     """
     Comamnd Code AD - Extended
     Section 4.11.1 p p99
-    Syntax is complex, return to this later
+    Syntax is like %ADD10C,0.0100*% or %ADD11OC8,0.0600*%
 
     Aperture definitions can either include relevant information directly, or
     can reference a named aperture macro created by a MacroApertureCommand.
     """
-    # XXX This is missing a lot of stuff
-    def __init__(self, aperture_number, template_name, s):
+    __slots__ = ('aperture_number', 'template_name', 'modifiers', 's')
+
+    def __init__(self, aperture_number, template_name, s, modifiers=None):
         self.aperture_number = aperture_number
         self.template_name = template_name
+        self.modifiers = modifiers
         self.s = s
 
     @classmethod
     def from_string(cls, s):
-        assert s.startswith('%ADD')
-        content = s[4:-2]
-        m = re.match('^(\d+)([a-zA-Z_.]+)', content)
+        m = aperture_definition_re.match(s)
+        assert m, "invalid aperture definition %r" % s
         aperture_number = int(m.group(1))
         template_name = m.group(2)
         return cls(aperture_number=aperture_number,
                    template_name=template_name,
+                   modifiers=m.group(3),
                    s=s)
 
     def to_string(self):
         return self.s
 
     def execute(self, state, plane):
-        # XXX
-        pass
+        state.define_aperture(plane, self.aperture_number,
+                              self.template_name, self.modifiers)
 
 
 class SetApertureCommand(Command):
@@ -227,6 +375,8 @@ class SetApertureCommand(Command):
     Section 4.3.1, p64
     Syntax is like Dnnn*
     """
+    __slots__ = ('aperture_number',)
+
     def __init__(self, aperture_number):
         assert aperture_number >= 10
         self.aperture_number = aperture_number
@@ -243,187 +393,213 @@ class SetApertureCommand(Command):
         state.set_current_aperture(self.aperture_number)
 
 
-class InterpolateCommand(Command):
+class OperationCommand(Command):
     """
-    Command Code D01
-    Section 4.2.2, p61
-    Syntax is like XnnnYnnnInnnJnnnD01* in circular interpolation modes
-    Syntax is like XnnnYnnnD01* in linear interpolation mode
+    Base class for the D01, D02 and D03 operations.
 
-    XnnnYnnn indicates the end point
-    InnnJnnn indicates the center point offsets in circular modes
+    Any of the coordinates may be omitted, in which case the current point
+    is used. The block may also be prefixed with an interpolation mode
+    (G01, G02 or G03), which is stored in ``mode``.
+
+    Codes may be written with or without their leading zero, like ``G1`` or
+    ``D01``. ``mode_string`` and ``code_string`` keep the spelling they were
+    parsed from, so ``to_string()`` gives back the original text.
     """
-    def __init__(self, x_string, y_string, i_string=None, j_string=None):
+    __slots__ = ('x_string', 'y_string', 'i_string', 'j_string', 'mode',
+                 'mode_string', 'code_string')
+    code = ''
+
+    def __init__(self, x_string=None, y_string=None, i_string=None,
+                 j_string=None, mode=None, mode_string=None,
+                 code_string=None):
         self.x_string = x_string
         self.y_string = y_string
         self.i_string = i_string
         self.j_string = j_string
+        self.mode = mode
+        self.mode_string = mode_string
+        self.code_string = code_string
 
     @classmethod
     def from_string(cls, s):
-        if 'I' in s:
-            m = re.match('X(\d+)Y(\d+)I(\d+)J(\d+)', s)
-            x_string = m.group(1)
-            y_string = m.group(2)
-            i_string = m.group(3)
-            j_string = m.group(4)
-            return cls(x_string=x_string, y_string=y_string,
-                       i_string=i_string, j_string=j_string)
-        else:
-            m = re.match('X(\d+)Y(\d+)', s)
-            x_string = m.group(1)
-            y_string = m.group(2)
-            return cls(x_string=x_string, y_string=y_string)
+        cmd = parse_operation(s)
+        assert isinstance(cmd, cls), "invalid %s %r" % (cls.__name__, s)
+        return cmd
 
     def to_string(self):
-        if self.i_string:
-            return 'X%sY%sI%sJ%sD01*' % (self.x_string, self.y_string,
-                                         self.i_string, self.j_string)
-        else:
-            return 'X%sY%sD01*' % (self.x_string, self.y_string)
+        s = self.mode_string or self.mode or ''
+        if self.x_string is not None:
+            s += 'X' + self.x_string
+        if self.y_string is not None:
+            s += 'Y' + self.y_string
+        if self.i_string is not None:
+            s += 'I' + self.i_string
+        if self.j_string is not None:
+            s += 'J' + self.j_string
+        return s + (self.code_string or self.code) + '*'
 
     def execute(self, state, plane):
-        # XXX
-        pass
+        if self.mode:
+            normal_commands[self.mode]().execute(state, plane)
+        state.last_operation = self.__class__
+        self.operate(state, plane)
+
+    def operate(self, state, plane):
+        raise NotImplementedError
+
+
+class InterpolateCommand(OperationCommand):
+    """
+    Command Code D01
+    Section 4.2.2, p61
+    Syntax is like XnnnYnnnInnnJnnnD01* in circular interpolation modes
+    Syntax is like XnnnYnnnD01* in linear interpolation mode
+
+    XnnnYnnn indicates the end point
+    InnnJnnn indicates the center point offsets in circular modes
+    """
+    __slots__ = ()
+    code = 'D01'
 
+    def operate(self, state, plane):
+        state.interpolate(plane, self.x_string, self.y_string,
+                          self.i_string, self.j_string)
 
-class MoveCommand(Command):
+
+class MoveCommand(OperationCommand):
     """
     Command Code D02
     Section 4.2.3, p62
     Syntax is like XnnnYnnnD02*
     """
-    def __init__(self, x_string, y_string):
-        self.x_string = x_string
-        self.y_string = y_string
+    __slots__ = ()
+    code = 'D02'
 
-    @classmethod
-    def from_string(cls, s):
-        raw = s[1:-4]
-        x_string, y_string = raw.split('Y')
-        return cls(x_string=x_string, y_string=y_string)
+    def operate(self, state, plane):
+        state.move(plane, self.x_string, self.y_string)
 
-    def to_string(self):
-        return 'X' + self.x_string + 'Y' + self.y_string + 'D02*'
 
-    def execute(self, state, plane):
-        # XXX
-        pass
-
-
-class FlashCommand(Command):
+class FlashCommand(OperationCommand):
     """
     Command Code D03
     Section 4.2.4, p62
     Syntax is like XnnnYnnnD03*
     """
-    def __init__(self, x_string, y_string):
-        self.x_string = x_string
-        self.y_string = y_string
+    __slots__ = ()
+    code = 'D03'
 
-    @classmethod
-    def from_string(cls, s):
-        raw = s[1:-4]
-        x_string, y_string = raw.split('Y')
-        return cls(x_string=x_string, y_string=y_string)
+    def operate(self, state, plane):
+        state.flash(plane, self.x_string, self.y_string)
 
-    def to_string(self):
-        return 'X' + self.x_string + 'Y' + self.y_string + 'D03*'
+
+class ModalOperationCommand(OperationCommand):
+    """
+    Coordinate data without an operation code, like XnnnYnnn*
+    Section 7.2, p165 (deprecated)
+
+    Repeats the most recent D01, D02 or D03 operation.
+    """
+    __slots__ = ()
+    deprecated = True
 
     def execute(self, state, plane):
-        # XXX
-        pass
+        if self.mode:
+            normal_commands[self.mode]().execute(state, plane)
+        operation = state.last_operation
+        assert operation is not None, \
+            "coordinate data without a preceding operation"
+        operation.operate(self, state, plane)
 
 
-class LinearInterpolationModeCommand(Command):
+class LinearInterpolationModeCommand(StatelessCommand):
     """
     Command Code G01
     Section 4.4.1, p65
     No args
     """
-    def to_string(self):
-        return 'G01*'
+    __slots__ = ()
+    code = 'G01'
 
     def execute(self, state, plane):
         state.set_interpolation_mode('linear')
 
 
-class CWCircularInterpolationModeCommand(Command):
+class CWCircularInterpolationModeCommand(StatelessCommand):
     """
     Command Code G02
     Section 4.5.3, p68
     No args
     """
-    def to_string(self):
-        return 'G02*'
+    __slots__ = ()
+    code = 'G02'
 
     def execute(self, state, plane):
-        state.set_interpolation_mode('clockwie-circular')
+        state.set_interpolation_mode('clockwise-circular')
 
 
-class CCWCircularInterpolationModeCommand(Command):
+class CCWCircularInterpolationModeCommand(StatelessCommand):
     """
     Command Code G03
     Section 4.5.4, p68
     No args
     """
-    def to_string(self):
-        return 'G03*'
+    __slots__ = ()
+    code = 'G03'
 
     def execute(self, state, plane):
         state.set_interpolation_mode('counterclockwise-circular')
 
 
-class SingleQuadrantCommand(Command):
+class SingleQuadrantCommand(StatelessCommand):
     """
     Command Code G74
     Section 4.5.5, p68
     No args
     """
-    def to_string(self):
-        return 'G74*'
+    __slots__ = ()
+    code = 'G74'
 
     def execute(self, state, plane):
         state.set_quadrant_mode('single')
 
 
-class MultiQuadrantCommand(Command):
+class MultiQuadrantCommand(StatelessCommand):
     """
     Command Code G75
     Section 4.5.6, p68
     No args
     """
-    def to_string(self):
-        return 'G75*'
+    __slots__ = ()
+    code = 'G75'
 
     def execute(self, state, plane):
         state.set_quadrant_mode('multi')
 
 
-class EnableRegionModeCommand(Command):
+class EnableRegionModeCommand(StatelessCommand):
     """
     Command Code G36
     Section 4.6.2, p76
     No args
     """
-    def to_string(self):
-        return 'G36*'
+    __slots__ = ()
+    code = 'G36'
 
     def execute(self, state, plane):
-        state.set_region_mode('on')
+        state.set_region_mode('on', plane)
 
 
-class DisableRegionModeCommand(Command):
+class DisableRegionModeCommand(StatelessCommand):
     """
     Command Code G37
     Section 4.6.3, p76
     No args
     """
-    def to_string(self):
-        return 'G37*'
+    __slots__ = ()
+    code = 'G37'
 
     def execute(self, state, plane):
-        state.set_region_mode('off')
+        state.set_region_mode('off', plane)
 
 
 class CommentCommand(Command):
@@ -431,31 +607,36 @@ class CommentCommand(Command):
     Command Code G04
     Section 4.7, p94
     """
-    def __init__(self, comment):
+    __slots__ = ('comment', 'code_string')
+
+    def __init__(self, comment, code_string=None):
         self.comment = comment
+        self.code_string = code_string
 
     @classmethod
     def from_string(cls, s):
-        comment = s[3:-1]
-        return cls(comment=comment)
+        m = match_comment(s)
+        assert m is not None, "invalid %s %r" % (cls.__name__, s)
+        code, comment = m.groups()
+        return cls(comment, None if code == 'G04' else code)
 
     def to_string(self):
-        return 'G04' + self.comment + '*'
+        return (self.code_string or 'G04') + self.comment + '*'
 
     def execute(self, state, plane):
         pass
 
 
-class EOFCommand(Command):
+class EOFCommand(StatelessCommand):
     """
     Command Code M02
     No args
     """
-    def to_string(self):
-        return 'M02*'
+    __slots__ = ()
+    code = 'M02'
 
     def execute(self, state, plane):
-        pass
+        state.end_step_and_repeat(plane)
 
 
 extended_commands = {
@@ -466,13 +647,11 @@ extended_commands = {
     'LP': LevelPolarityCommand,
     'AM': MacroApertureCommand,
     'AD': ApertureDefinitionCommand,
+    'SR': StepAndRepeatCommand,
 }
 
 
 normal_commands = {
-    'D01': InterpolateCommand,
-    'D02': MoveCommand,
-    'D03': FlashCommand,
     'G01': LinearInterpolationModeCommand,
     'G02': CWCircularInterpolationModeCommand,
     'G03': CCWCircularInterpolationModeCommand,
@@ -483,3 +662,67 @@ normal_commands = {
     'G04': CommentCommand,
     'M02': EOFCommand,
 }
+
+
+# Shared instances of commands without arguments, keyed by their text.
+bare_commands = dict((code + '*', cls())
+                     for code, cls in normal_commands.items()
+                     if issubclass(cls, StatelessCommand))
+
+
+operation_commands = {
+    None: ModalOperationCommand,
+    '1': InterpolateCommand,
+    '2': MoveCommand,
+    '3': FlashCommand,
+}
+
+
+coordinate_format_re = re.compile(
+    r'%FS([LT])([AI])X(\d\d)Y(\d\d)\*%$')
+
+
+step_and_repeat_re = re.compile(
+    r'%SR(?:X(\d+)Y(\d+)I(\d*\.?\d*)J(\d*\.?\d*))?\*%$')
+
+
+aperture_definition_re = re.compile(
+    r'%ADD(\d+)([a-zA-Z_.$][a-zA-Z_.0-9]*)(?:,([^*]*))?\*%$')
+
+
+operation_re = re.compile(r"""
+    (?:(G0?[123])(?=[XYIJD]))?
+    (?:X([+-]?\d+))?
+    (?:Y([+-]?\d+))?
+    (?:I([+-]?\d+))?
+    (?:J([+-]?\d+))?
+    (?:(D0*[123]))?
+    (?<=\d)\*
+""", re.VERBOSE)
+
+simple_operation_re = re.compile(r'X([+-]?\d+)Y([+-]?\d+)(D0?[123])\*')
+
+d_code_re = re.compile(r'D(\d+)\*')
+
+code_re = re.compile(r'([GM])(\d+)\*')
+
+# G04 may be written G4, but only if the comment does not start with a digit.
+comment_re = re.compile(r'(G04|G4(?!\d))(.*)\*', re.DOTALL)
+
+
+match_operation = operation_re.fullmatch
+match_simple_operation = simple_operation_re.fullmatch
+match_d_code = d_code_re.fullmatch
+match_code = code_re.fullmatch
+match_comment = comment_re.fullmatch
+
+
+command_parsers = {
+    'X': parse_operation,
+    'Y': parse_operation,
+    'I': parse_operation,
+    'J': parse_operation,
+    'D': parse_d_code,
+    'G': parse_code,
+    'M': parse_code,
+}
@@ -1,3 +0,0 @@
-class Context(object):
-    def __init__(self):
-        self.objects = []
@@ -0,0 +1,57 @@
+"""
+Fixed-point coordinate decoding.
+
+All geometry is stored as integers in picometres. Every coordinate format
+allowed by the spec (up to 6 fractional digits, in inches or millimetres)
+maps onto an exact whole number of picometres, so decoded coordinates can be
+compared and combined without rounding.
+"""
+
+UNITS_PER_MM = 10 ** 9
+
+unit_scales = {
+    'MM': UNITS_PER_MM,
+    'IN': 254 * UNITS_PER_MM // 10,
+}
+
+
+def make_decoder(integer_digits, fractional_digits, zero_omission, unit):
+    """
+    Return a function which decodes a coordinate string like ``'-0012345'``
+    into an integer number of picometres, for the given coordinate format
+    and unit.
+    """
+    step, remainder = divmod(unit_scales[unit], 10 ** fractional_digits)
+    assert remainder == 0, \
+        "unsupported coordinate resolution %d.%d %s" % (
+            integer_digits, fractional_digits, unit)
+    if zero_omission == 'L':
+        def decode(s):
+            return int(s) * step
+    else:
+        assert zero_omission == 'T', \
+            "invalid zero omission %r" % zero_omission
+        total_digits = integer_digits + fractional_digits
+
+        def decode(s):
+            if s[0] in '+-':
+                value = int(s[1:].ljust(total_digits, '0')) * step
+                return -value if s[0] == '-' else value
+            return int(s.ljust(total_digits, '0')) * step
+
+    return decode
+
+
+def parse_decimal(s, unit):
+    """
+    Parse a decimal number string like ``'-1.08239'`` in the given unit into
+    an integer number of picometres, rounding to the nearest picometre.
+    """
+    scale = unit_scales[unit]
+    negative = s.startswith('-')
+    whole, _, fraction = s.lstrip('+-').partition('.')
+    value = int(whole or '0') * scale
+    if fraction:
+        denominator = 10 ** len(fraction)
+        value += (int(fraction) * scale * 2 + denominator) // (denominator * 2)
+    return -value if negative else value
@@ -1,39 +1,83 @@
+import re
+from array import array
+
+from .apertures import Aperture, MacroTemplate
+from .arcs import arc_points, single_quadrant_center
 from .commands import parse_command
+from .coordinates import make_decoder, parse_decimal
+from .plane import GraphicsPlane
+
+delimiter_re = re.compile(r'[*%]')
 
 default_sentinel = object()
 
+circular_modes = ('clockwise-circular', 'counterclockwise-circular')
+
 
 class GerberTokenizer(object):
     """
     Yield each command in the Gerber file, as a tuple including the line
     number it is on. E.g. ``(103, 'D10*')``.
+
+    The file is consumed in blocks of ``block_size`` characters, and commands
+    are located by scanning for delimiters rather than character by
+    character.
     """
-    # XXX This should probably rename to become the GerberTokenizer
-    def __init__(self, f):
+    block_size = 1 << 16
+
+    def __init__(self, f, block_size=None):
         self.f = f
         self.inside_extended = False
-        self.current_command = ''
         self.line_no = 1
+        if block_size:
+            self.block_size = block_size
 
     def __iter__(self):
+        read = self.f.read
+        block_size = self.block_size
+        find_delimiter = delimiter_re.search
+        inside_extended = self.inside_extended
+        line_no = self.line_no
+        buf = ''
+        # ``start`` is the beginning of the current command in ``buf``, and
+        # ``pos`` is where the next delimiter search begins.
+        start = pos = 0
         while True:
-            c = self.f.read(1)
-            if not c:
+            block = read(block_size)
+            if not block:
                 break
-            if c == '\n':
-                self.line_no += 1
+            if start:
+                buf = buf[start:] + block
+                pos -= start
+                start = 0
             else:
-                self.current_command += c
-            if c == '%':
-                if self.inside_extended:
-                    yield self.line_no, self.current_command
-                    self.current_command = ''
-                    self.inside_extended = False
+                buf = buf + block if buf else block
+            while True:
+                if inside_extended:
+                    end = buf.find('%', pos)
+                    if end < 0:
+                        break
+                    inside_extended = False
                 else:
-                    self.inside_extended = True
-            elif (c == '*') and (not self.inside_extended):
-                yield self.line_no, self.current_command
-                self.current_command = ''
+                    m = find_delimiter(buf, pos)
+                    if m is None:
+                        break
+                    end = m.start()
+                    if m.group() == '%':
+                        inside_extended = True
+                        pos = end + 1
+                        continue
+                pos = end + 1
+                raw = buf[start:pos]
+                if '\n' in raw:
+                    line_no += raw.count('\n')
+                    raw = raw.replace('\n', '')
+                start = pos
+                yield line_no, raw
+            pos = len(buf)
+
+        self.inside_extended = inside_extended
+        self.line_no = line_no + buf.count('\n', start)
 
 
 class GraphicsState(object):
@@ -57,21 +101,78 @@ class GraphicsState(object):
         self.step_and_repeat = (1, 1, 0, 0)
         self.level_polarity = 'dark'
         self.region_mode = 'off'
+        self.notation = 'A'
+        self.offset = (0, 0)
+
+        # Coordinate decoder, built once both the unit and the coordinate
+        # format are known.
+        self.decode_coordinate = None
+
+        # Vertices of the contour being built in region mode. These are
+        # reused from one contour to the next.
+        self.contour_x = array('q')
+        self.contour_y = array('q')
+
+        # Operation repeated by coordinate data without a D code.
+        self.last_operation = None
+
+        # Index of the first primitive of the open step and repeat block.
+        self.repeat_start = 0
 
     def set_unit(self, unit):
         assert self.unit == default_sentinel, "unit can only be set once"
         self.unit = unit
+        self.update_decoder()
 
-    def set_coordinate_format(self, integer_digits, fractional_digits):
+    def set_coordinate_format(self, integer_digits, fractional_digits,
+                              zero_omission='L', notation='A'):
         assert self.coordinate_format == default_sentinel, \
             "coordinate format can only be set once"
-        self.coordinate_format = integer_digits, fractional_digits
+        self.coordinate_format = (integer_digits, fractional_digits,
+                                  zero_omission)
+        self.notation = notation
+        self.update_decoder()
+
+    def update_decoder(self):
+        if ((self.unit != default_sentinel) and
+                (self.coordinate_format != default_sentinel)):
+            self.decode_coordinate = make_decoder(*self.coordinate_format,
+                                                  unit=self.unit)
+
+    def set_offset(self, offset_a, offset_b):
+        assert self.unit != default_sentinel, "offset requires a unit"
+        self.offset = (parse_decimal(offset_a, self.unit),
+                       parse_decimal(offset_b, self.unit))
 
     def evaluate_coordinate(self, s):
         """
-        Evaluate a coordinate string in the current coordinate format.
+        Evaluate a coordinate string in the current coordinate format,
+        returning an integer number of picometres.
+        """
+        assert self.decode_coordinate, \
+            "coordinate format and unit must be set before coordinates"
+        return self.decode_coordinate(s)
+
+    def evaluate_point(self, x_string, y_string):
+        """
+        Evaluate the coordinates of an operation, returning the new point.
+        Omitted coordinates keep their value from the current point.
         """
-        # XXX
+        decode = self.decode_coordinate
+        assert decode, \
+            "coordinate format and unit must be set before coordinates"
+        x, y = self.current_point
+        if self.notation == 'A':
+            if x_string is not None:
+                x = decode(x_string)
+            if y_string is not None:
+                y = decode(y_string)
+        else:
+            if x_string is not None:
+                x += decode(x_string)
+            if y_string is not None:
+                y += decode(y_string)
+        return x, y
 
     def set_interpolation_mode(self, mode):
         self.interpolation_mode = mode
@@ -79,37 +180,182 @@ class GraphicsState(object):
     def set_quadrant_mode(self, mode):
         self.quadrant_mode = mode
 
-    def set_region_mode(self, mode):
+    def set_region_mode(self, mode, plane):
+        if mode == 'off':
+            self.end_contour(plane)
         self.region_mode = mode
 
+    def set_step_and_repeat(self, plane, x_count, y_count, x_step, y_step):
+        """
+        Close the current step and repeat block, and open a new one. A block
+        of one copy is no block at all, which is how ``%SR*%`` closes one.
+        """
+        self.end_step_and_repeat(plane)
+        if x_step is None:
+            x_step = y_step = 0
+        else:
+            assert self.unit != default_sentinel, \
+                "step and repeat requires a unit"
+            x_step = parse_decimal(x_step, self.unit)
+            y_step = parse_decimal(y_step, self.unit)
+        self.step_and_repeat = (x_count, y_count, x_step, y_step)
+        self.repeat_start = len(plane)
+
+    def end_step_and_repeat(self, plane):
+        x_count, y_count, x_step, y_step = self.step_and_repeat
+        plane.add_repeat(self.repeat_start, len(plane), x_count, y_count,
+                         x_step, y_step)
+        self.step_and_repeat = (1, 1, 0, 0)
+        self.repeat_start = len(plane)
+
     def set_level_polarity(self, polarity):
         self.level_polarity = polarity
 
+    def define_template(self, name, body):
+        self.aperture_templates[name] = MacroTemplate(name, body)
+
+    def define_aperture(self, plane, number, template_name, modifiers):
+        assert self.unit != default_sentinel, "aperture requires a unit"
+        assert number not in self.apertures, \
+            "aperture D%d can only be defined once" % number
+        aperture = Aperture.define(number, template_name, modifiers,
+                                   self.unit, self.aperture_templates)
+        self.apertures[number] = aperture
+        plane.apertures[number] = aperture
+
     def set_current_aperture(self, aperture_number):
-        # XXX
-        pass
+        assert aperture_number in self.apertures, \
+            "aperture D%d is not defined" % aperture_number
+        self.current_aperture = aperture_number
 
+    def interpolate(self, plane, x_string, y_string, i_string, j_string):
+        """
+        Perform a D01 operation: draw from the current point to the new one,
+        or extend the current contour in region mode.
+        """
+        x0, y0 = self.current_point
+        x, y = self.evaluate_point(x_string, y_string)
+        self.current_point = x, y
+        circular = self.interpolation_mode in circular_modes
+        if circular:
+            clockwise = self.interpolation_mode == 'clockwise-circular'
+            cx, cy = self.arc_center(x0, y0, x, y, i_string, j_string,
+                                     clockwise)
+            if cx is None:
+                circular = False
+        if self.region_mode == 'on':
+            contour_x = self.contour_x
+            contour_y = self.contour_y
+            if not contour_x:
+                contour_x.append(x0)
+                contour_y.append(y0)
+            if circular:
+                points = arc_points(x0, y0, x, y, cx, cy, clockwise)[1:]
+                contour_x.extend([px for px, py in points])
+                contour_y.extend([py for px, py in points])
+            else:
+                contour_x.append(x)
+                contour_y.append(y)
+            return
+
+        # Files which never set a mode, like Eagle's, expect linear.
+        assert self.current_aperture != default_sentinel, \
+            "draw without a current aperture"
+        ox, oy = self.offset
+        if circular:
+            plane.add_arc(x0 + ox, y0 + oy, x + ox, y + oy, cx + ox, cy + oy,
+                          self.current_aperture, clockwise,
+                          self.level_polarity == 'dark')
+        else:
+            plane.add_draw(x0 + ox, y0 + oy, x + ox, y + oy,
+                           self.current_aperture,
+                           self.level_polarity == 'dark')
+
+    def arc_center(self, x0, y0, x, y, i_string, j_string, clockwise):
+        """
+        Return the centre of a circular interpolation from ``(x0, y0)`` to
+        ``(x, y)``, or ``(None, None)`` for a single quadrant arc with
+        coincident end points, which is drawn as a line (Section 4.5.8, p73).
+        """
+        decode = self.decode_coordinate
+        i = decode(i_string) if i_string is not None else 0
+        j = decode(j_string) if j_string is not None else 0
+        if self.quadrant_mode == 'multi':
+            return x0 + i, y0 + j
+        # Single quadrant mode is the default in older files.
+        if (x0, y0) == (x, y):
+            return None, None
+        return single_quadrant_center(x0, y0, x, y, abs(i), abs(j),
+                                      clockwise)
+
+    def move(self, plane, x_string, y_string):
+        """
+        Perform a D02 operation: move the current point, closing the current
+        contour in region mode.
+        """
+        if self.region_mode == 'on':
+            self.end_contour(plane)
+        self.current_point = self.evaluate_point(x_string, y_string)
+
+    def flash(self, plane, x_string, y_string):
+        """
+        Perform a D03 operation: flash the current aperture at the new point.
+        """
+        assert self.region_mode == 'off', "flash not allowed in region mode"
+        assert self.current_aperture != default_sentinel, \
+            "flash without a current aperture"
+        x, y = self.evaluate_point(x_string, y_string)
+        self.current_point = x, y
+        ox, oy = self.offset
+        plane.add_flash(x + ox, y + oy, self.current_aperture,
+                        self.level_polarity == 'dark')
 
-class GraphicsPlane(object):
-    pass
+    def end_contour(self, plane):
+        """
+        Add the contour built in region mode, if any, to the plane as a
+        region.
+        """
+        xs = self.contour_x
+        if not xs:
+            return
+        ys = self.contour_y
+        n = len(xs)
+        assert n >= 4 and xs[0] == xs[n - 1] and ys[0] == ys[n - 1], \
+            "region contour is not closed"
+        ox, oy = self.offset
+        if ox:
+            xs = array('q', map(ox.__add__, xs))
+        if oy:
+            ys = array('q', map(oy.__add__, ys))
+        plane.add_region(xs, ys, self.level_polarity == 'dark')
+        del self.contour_x[:]
+        del self.contour_y[:]
 
 
 class GerberParser(object):
+    """
+    Parse a Gerber file, executing each command against a ``GraphicsState``
+    and drawing into a ``GraphicsPlane``.
+
+    Iterating over the parser yields ``(line_no, raw, command)`` tuples as
+    each command is executed. ``parse()`` runs the whole file silently and
+    returns the plane.
+    """
     def __init__(self, filename):
         self.filename = filename
+        self.state = GraphicsState()
+        self.plane = GraphicsPlane()
 
-    def parse(self):
-        plane = GraphicsPlane()
-        state = GraphicsState()
-
-        with open(self.filename, 'rU') as f:
-            raw_width = 36
-            print('Line\t%s\tResult' % "Raw".ljust(raw_width))
-            print('----\t%s\t-----------' % ('-' * raw_width))
+    def __iter__(self):
+        state = self.state
+        plane = self.plane
+        with open(self.filename, 'r') as f:
             for line_no, s in GerberTokenizer(f):
                 cmd = parse_command(s)
-                assert cmd.to_string() == s
-                print("%04d\t%s\t%r" % (line_no, s.ljust(raw_width), cmd))
                 cmd.execute(state, plane)
+                yield line_no, s, cmd
 
-        return plane
+    def parse(self):
+        for _ in self:
+            pass
+        return self.plane
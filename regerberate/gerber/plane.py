@@ -0,0 +1,612 @@
+"""
+Columnar storage for the graphics objects produced by a Gerber file.
+"""
+import hashlib
+import json
+import math
+import struct
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .apertures import Aperture
+from .rtree import PackedRTree
+
+# Primitive kinds.
+DRAW = 0
+ARC = 1
+FLASH = 2
+REGION = 3
+
+# Primitive flag bits.
+DARK = 1
+CLOCKWISE = 2
+
+# Serialized form: magic, format version, and the number of items in each
+# column, followed by the aperture table and step and repeat blocks as UTF-8
+# JSON, and then each column's raw bytes, every section padded to a multiple
+# of 8 bytes.
+file_magic = b'RGPL'
+file_version = 3
+file_header = struct.Struct('<4sI%dQ' % 13)
+
+column_names = ('kinds', 'flags', 'aperture_numbers', 'x0', 'y0', 'x1', 'y1',
+                'cx', 'cy', 'region_offsets', 'region_x', 'region_y')
+
+# Coordinates further than this from the origin may overflow 64 bits when
+# scaled or moved by NumPy, which wraps rather than raising.
+numpy_scale_limit = 1 << 62
+
+kind_names = {
+    DRAW: 'draw',
+    ARC: 'arc',
+    FLASH: 'flash',
+    REGION: 'region',
+}
+
+
+class Primitive(object):
+    """
+    Lightweight view of a single primitive stored in a ``GraphicsPlane``.
+    """
+    __slots__ = ('plane', 'index')
+
+    def __init__(self, plane, index):
+        self.plane = plane
+        self.index = index
+
+    def __repr__(self):
+        return '<Primitive %d %s aperture=%r %s-%s>' % (
+            self.index, kind_names[self.kind], self.aperture, self.start,
+            self.end)
+
+    @property
+    def kind(self):
+        return self.plane.kinds[self.index]
+
+    @property
+    def dark(self):
+        return bool(self.plane.flags[self.index] & DARK)
+
+    @property
+    def clockwise(self):
+        return bool(self.plane.flags[self.index] & CLOCKWISE)
+
+    @property
+    def aperture(self):
+        """
+        Aperture number of a draw, arc or flash, or ``None`` for a region.
+        """
+        if self.kind == REGION:
+            return None
+        return self.plane.aperture_numbers[self.index]
+
+    @property
+    def start(self):
+        """
+        Start point of a draw or arc, the location of a flash, or the lower
+        left corner of a region's bounding box.
+        """
+        return self.plane.x0[self.index], self.plane.y0[self.index]
+
+    @property
+    def end(self):
+        """
+        End point of a draw or arc, the location of a flash, or the upper
+        right corner of a region's bounding box.
+        """
+        return self.plane.x1[self.index], self.plane.y1[self.index]
+
+    @property
+    def center(self):
+        """
+        Centre point of an arc.
+        """
+        return self.plane.cx[self.index], self.plane.cy[self.index]
+
+    @property
+    def vertices(self):
+        """
+        Contour vertices of a region, as a list of ``(x, y)`` tuples.
+        """
+        assert self.kind == REGION
+        plane = self.plane
+        n = plane.aperture_numbers[self.index]
+        start, end = plane.region_offsets[n], plane.region_offsets[n + 1]
+        return list(zip(plane.region_x[start:end], plane.region_y[start:end]))
+
+
+class GraphicsPlane(object):
+    """
+    The graphics objects produced by executing a Gerber file, in order.
+
+    Primitives are stored in parallel typed arrays rather than as individual
+    objects. For each primitive there is a kind, flags (polarity and arc
+    direction), an aperture number, start and end points and an arc centre.
+    For regions, the aperture column instead holds the index of the region's
+    contour, whose vertices are stored in ``region_x`` and ``region_y``
+    between consecutive ``region_offsets``, and the start and end points hold
+    its bounding box.
+
+    ``apertures`` maps the aperture numbers used by primitives to their
+    ``Aperture`` definitions. All coordinates are integers in picometres.
+
+    ``repeats`` lists step and repeat blocks as ``(start, stop, x_count,
+    y_count, x_step, y_step)`` tuples. The primitives from ``start`` up to
+    ``stop`` are stored once, in the first copy, and stand for a grid of
+    ``x_count`` by ``y_count`` copies, ``x_step`` and ``y_step`` apart. Use
+    ``segments()`` to visit every copy, or ``flattened()`` for a plane with
+    the copies written out.
+    """
+    column_types = {
+        'kinds': 'B',
+        'flags': 'B',
+        'aperture_numbers': 'i',
+        'x0': 'q',
+        'y0': 'q',
+        'x1': 'q',
+        'y1': 'q',
+        'cx': 'q',
+        'cy': 'q',
+        'region_offsets': 'q',
+        'region_x': 'q',
+        'region_y': 'q',
+    }
+
+    def __init__(self):
+        self.apertures = {}
+        self.repeats = []
+
+        for name in column_names:
+            setattr(self, name, array(self.column_types[name]))
+        self.region_offsets.append(0)
+
+        # Set when the columns are read-only views of a mapped buffer.
+        self.mapped = False
+
+        # Spatial index, built on first use.
+        self._spatial_index = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.mapped:
+            for name in column_names:
+                column = state[name]
+                state[name] = array(column.format, column)
+            state['mapped'] = False
+        state['_spatial_index'] = None
+        return state
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('primitive index out of range')
+        return Primitive(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield Primitive(self, index)
+
+    def _append(self, kind, flags, aperture, x0, y0, x1, y1, cx=0, cy=0):
+        if self.mapped:
+            self.make_writable()
+        self._spatial_index = None
+        self.kinds.append(kind)
+        self.flags.append(flags)
+        self.aperture_numbers.append(aperture)
+        self.x0.append(x0)
+        self.y0.append(y0)
+        self.x1.append(x1)
+        self.y1.append(y1)
+        self.cx.append(cx)
+        self.cy.append(cy)
+
+    def add_draw(self, x0, y0, x1, y1, aperture, dark=True):
+        self._append(DRAW, DARK if dark else 0, aperture, x0, y0, x1, y1)
+
+    def add_arc(self, x0, y0, x1, y1, cx, cy, aperture, clockwise,
+                dark=True):
+        flags = (DARK if dark else 0) | (CLOCKWISE if clockwise else 0)
+        self._append(ARC, flags, aperture, x0, y0, x1, y1, cx, cy)
+
+    def add_flash(self, x, y, aperture, dark=True):
+        self._append(FLASH, DARK if dark else 0, aperture, x, y, x, y)
+
+    def add_region(self, xs, ys, dark=True):
+        """
+        Add a region bounded by the closed contour with vertices ``xs`` and
+        ``ys``.
+        """
+        if self.mapped:
+            self.make_writable()
+        self.region_x.extend(xs)
+        self.region_y.extend(ys)
+        n = len(self.region_offsets) - 1
+        self.region_offsets.append(len(self.region_x))
+        self._append(REGION, DARK if dark else 0, n,
+                     min(xs), min(ys), max(xs), max(ys))
+
+    def add_repeat(self, start, stop, x_count, y_count, x_step, y_step):
+        """
+        Repeat the primitives from ``start`` up to ``stop`` in a grid of
+        ``x_count`` by ``y_count`` copies.
+        """
+        assert not self.repeats or self.repeats[-1][1] <= start, \
+            "step and repeat blocks must not overlap"
+        if stop > start and (x_count, y_count) != (1, 1):
+            self.repeats.append((start, stop, x_count, y_count, x_step,
+                                 y_step))
+            self._spatial_index = None
+
+    def segments(self):
+        """
+        Yield ``(start, stop, offsets)`` for consecutive ranges of primitives
+        covering the whole plane, in order, where ``offsets`` lists the
+        ``(dx, dy)`` of every copy of the range.
+        """
+        pos = 0
+        for start, stop, x_count, y_count, x_step, y_step in self.repeats:
+            if start > pos:
+                yield pos, start, [(0, 0)]
+            yield start, stop, [(i * x_step, j * y_step)
+                                for j in range(y_count)
+                                for i in range(x_count)]
+            pos = stop
+        if len(self) > pos:
+            yield pos, len(self), [(0, 0)]
+
+    def column_view(self, name):
+        """
+        Return a read-only NumPy view of the coordinate column ``name``,
+        sharing its memory.
+        """
+        return np.frombuffer(getattr(self, name), dtype=np.int64)
+
+    def _extent(self, start, stop):
+        if np is not None:
+            x0, y0, x1, y1 = [self.column_view(name)[start:stop]
+                              for name in ('x0', 'y0', 'x1', 'y1')]
+            xmin = int(min(x0.min(), x1.min()))
+            ymin = int(min(y0.min(), y1.min()))
+            xmax = int(max(x0.max(), x1.max()))
+            ymax = int(max(y0.max(), y1.max()))
+        else:
+            xmin = min(min(self.x0[start:stop]), min(self.x1[start:stop]))
+            ymin = min(min(self.y0[start:stop]), min(self.y1[start:stop]))
+            xmax = max(max(self.x0[start:stop]), max(self.x1[start:stop]))
+            ymax = max(max(self.y0[start:stop]), max(self.y1[start:stop]))
+        # Arcs can bulge past their end points. Few primitives are arcs, so
+        # extend conservatively by each one's full circle.
+        kinds = self.kinds[start:stop]
+        if ARC in kinds:
+            for index, kind in enumerate(kinds, start):
+                if kind == ARC:
+                    cx, cy = self.cx[index], self.cy[index]
+                    r = int(math.hypot(self.x0[index] - cx,
+                                       self.y0[index] - cy)) + 1
+                    xmin = min(xmin, cx - r)
+                    ymin = min(ymin, cy - r)
+                    xmax = max(xmax, cx + r)
+                    ymax = max(ymax, cy + r)
+        return xmin, ymin, xmax, ymax
+
+    def bounding_box(self):
+        """
+        Return the ``(xmin, ymin, xmax, ymax)`` extent of all primitive
+        coordinates, or ``None`` if the plane is empty.
+        """
+        if not len(self):
+            return None
+        xmin, ymin, xmax, ymax = self._extent(0, len(self))
+        for start, stop, x_count, y_count, x_step, y_step in self.repeats:
+            bxmin, bymin, bxmax, bymax = self._extent(start, stop)
+            dx = (x_count - 1) * x_step
+            dy = (y_count - 1) * y_step
+            xmin = min(xmin, bxmin + min(dx, 0))
+            ymin = min(ymin, bymin + min(dy, 0))
+            xmax = max(xmax, bxmax + max(dx, 0))
+            ymax = max(ymax, bymax + max(dy, 0))
+        # Grow by the largest aperture extent, so the box covers the
+        # material drawn around each coordinate.
+        if self.apertures:
+            margin = max(max(-a.bbox[0], -a.bbox[1], a.bbox[2], a.bbox[3])
+                         for a in self.apertures.values())
+            xmin -= margin
+            ymin -= margin
+            xmax += margin
+            ymax += margin
+        return xmin, ymin, xmax, ymax
+
+    def primitive_boxes(self, start=0, stop=None):
+        """
+        Return ``(xmin, ymin, xmax, ymax)`` arrays with the bounding box of
+        each primitive from ``start`` up to ``stop``, including the material
+        drawn by its aperture. Arcs are given the box of their full circle.
+        """
+        if stop is None:
+            stop = len(self)
+        kinds = self.kinds
+        x0s, y0s, x1s, y1s = self.x0, self.y0, self.x1, self.y1
+        numbers = self.aperture_numbers
+        aperture_boxes = dict((number, aperture.bbox) for number, aperture
+                              in self.apertures.items())
+        xmin = array('q')
+        ymin = array('q')
+        xmax = array('q')
+        ymax = array('q')
+        for index in range(start, stop):
+            kind = kinds[index]
+            if kind == REGION:
+                # Regions store their own bounding box.
+                xmin.append(x0s[index])
+                ymin.append(y0s[index])
+                xmax.append(x1s[index])
+                ymax.append(y1s[index])
+                continue
+            ax0, ay0, ax1, ay1 = aperture_boxes[numbers[index]]
+            x0, y0, x1, y1 = x0s[index], y0s[index], x1s[index], y1s[index]
+            if kind == ARC:
+                cx, cy = self.cx[index], self.cy[index]
+                r = int(math.hypot(x0 - cx, y0 - cy)) + 1
+                x0, y0, x1, y1 = cx - r, cy - r, cx + r, cy + r
+            else:
+                if x0 > x1:
+                    x0, x1 = x1, x0
+                if y0 > y1:
+                    y0, y1 = y1, y0
+            xmin.append(x0 + ax0)
+            ymin.append(y0 + ay0)
+            xmax.append(x1 + ax1)
+            ymax.append(y1 + ay1)
+        return xmin, ymin, xmax, ymax
+
+    def spatial_index(self):
+        """
+        Return the ``PlaneIndex`` of the plane, building it if the plane has
+        changed since it was last built.
+        """
+        if self._spatial_index is None:
+            self._spatial_index = PlaneIndex(self)
+        return self._spatial_index
+
+    def query(self, bbox):
+        """
+        Return ``(index, dx, dy)`` for every primitive whose bounding box
+        overlaps ``bbox``, where ``(dx, dy)`` is the offset of the copy
+        which does, for primitives in step and repeat blocks.
+        """
+        return self.spatial_index().query(bbox)
+
+    def nearest(self, x, y, count=1, max_distance=None):
+        """
+        Return ``(index, dx, dy)`` for up to ``count`` primitives, nearest
+        first by the distance from ``(x, y)`` to their bounding boxes.
+        """
+        return self.spatial_index().nearest(x, y, count, max_distance)
+
+    def translate(self, dx, dy):
+        """
+        Move every primitive by ``(dx, dy)``. Each column is replaced by a
+        new array, computed by NumPy when it is installed and the sums
+        cannot overflow.
+        """
+        self._spatial_index = None
+        for name, delta in (('x0', dx), ('x1', dx), ('cx', dx),
+                            ('region_x', dx), ('y0', dy), ('y1', dy),
+                            ('cy', dy), ('region_y', dy)):
+            if not delta:
+                continue
+            if np is not None and isinstance(delta, int) and \
+                    abs(delta) < numpy_scale_limit:
+                view = self.column_view(name)
+                extent = max(-int(view.min()), int(view.max()), 1) \
+                    if len(view) else 1
+                if extent + abs(delta) < numpy_scale_limit:
+                    setattr(self, name, array('q', (view + delta).tobytes()))
+                    continue
+            column = array('q', map(delta.__add__, getattr(self, name)))
+            setattr(self, name, column)
+
+    def scale(self, numerator, denominator=1):
+        """
+        Scale every coordinate about the origin by ``numerator /
+        denominator``, rounding down to whole picometres. NumPy is used when
+        it is installed and the products cannot overflow.
+        """
+        self._spatial_index = None
+        self.repeats = [(start, stop, x_count, y_count,
+                         x_step * numerator // denominator,
+                         y_step * numerator // denominator)
+                        for start, stop, x_count, y_count, x_step, y_step
+                        in self.repeats]
+        for name in ('x0', 'y0', 'x1', 'y1', 'cx', 'cy', 'region_x',
+                     'region_y'):
+            if np is not None and isinstance(numerator, int) and \
+                    abs(denominator) < numpy_scale_limit:
+                view = self.column_view(name)
+                extent = max(-int(view.min()), int(view.max()), 1) \
+                    if len(view) else 1
+                if extent * abs(numerator) < numpy_scale_limit:
+                    column = view * numerator
+                    if denominator != 1:
+                        column //= denominator
+                    setattr(self, name, array('q', column.tobytes()))
+                    continue
+            column = map(numerator.__mul__, getattr(self, name))
+            if denominator != 1:
+                column = map(denominator.__rfloordiv__, column)
+            setattr(self, name, array('q', column))
+
+    def extend(self, plane, start, stop, dx=0, dy=0):
+        """
+        Append copies of the primitives of ``plane`` from ``start`` up to
+        ``stop``, moved by ``(dx, dy)``. Apertures are not copied.
+        """
+        for index in range(start, stop):
+            kind = plane.kinds[index]
+            if kind == REGION:
+                n = plane.aperture_numbers[index]
+                first = plane.region_offsets[n]
+                last = plane.region_offsets[n + 1]
+                self.add_region([x + dx for x in plane.region_x[first:last]],
+                                [y + dy for y in plane.region_y[first:last]],
+                                plane.flags[index] & DARK)
+                continue
+            self._append(kind, plane.flags[index],
+                         plane.aperture_numbers[index],
+                         plane.x0[index] + dx, plane.y0[index] + dy,
+                         plane.x1[index] + dx, plane.y1[index] + dy,
+                         plane.cx[index] + dx, plane.cy[index] + dy)
+
+    def flattened(self):
+        """
+        Return a copy of the plane with every step and repeat block written
+        out as separate primitives.
+        """
+        plane = GraphicsPlane()
+        plane.apertures = dict(self.apertures)
+        for start, stop, offsets in self.segments():
+            for dx, dy in offsets:
+                plane.extend(self, start, stop, dx, dy)
+        return plane
+
+    def repeated(self, x_count, y_count, x_step, y_step):
+        """
+        Return a copy of the plane with all of its content in a single step
+        and repeat block. Existing blocks are flattened first, since blocks
+        cannot be nested.
+        """
+        plane = self.flattened()
+        plane.add_repeat(0, len(plane), x_count, y_count, x_step, y_step)
+        return plane
+
+    def make_writable(self):
+        """
+        Copy any columns which are views of a mapped buffer into arrays, so
+        the plane can be modified.
+        """
+        for name in column_names:
+            column = getattr(self, name)
+            if not isinstance(column, array):
+                setattr(self, name, array(column.format, column))
+        self.mapped = False
+
+    def digest(self):
+        """
+        Return a hex digest of the plane's content, which is equal for planes
+        with equal primitives, apertures and step and repeat blocks.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.table_bytes())
+        for name in column_names:
+            column = getattr(self, name)
+            h.update(struct.pack('<Q', len(column)))
+            h.update(memoryview(column).cast('B'))
+        return h.hexdigest()
+
+    def table_bytes(self):
+        """
+        Encode the aperture table and step and repeat blocks as JSON, with
+        apertures in number order so that equal planes encode equally.
+        """
+        table = {
+            'apertures': [self.apertures[number].to_record()
+                          for number in sorted(self.apertures)],
+            'repeats': [list(repeat) for repeat in self.repeats],
+        }
+        return json.dumps(table, separators=(',', ':')).encode('utf-8')
+
+    def dump(self, f):
+        """
+        Write the plane to the binary file ``f`` in a form which ``load()``
+        can map without copying.
+        """
+        apertures = self.table_bytes()
+        columns = [getattr(self, name) for name in column_names]
+        f.write(file_header.pack(file_magic, file_version, len(apertures),
+                                 *[len(column) for column in columns]))
+        for data in [apertures] + [memoryview(column).cast('B')
+                                   for column in columns]:
+            f.write(data)
+            f.write(b'\0' * (-len(data) % 8))
+
+    @classmethod
+    def load(cls, buf):
+        """
+        Load a plane written by ``dump()`` from a bytes-like object, such as
+        an ``mmap``. The columns of the returned plane are views into
+        ``buf``; they are only copied if the plane is modified.
+        """
+        fields = file_header.unpack_from(buf)
+        magic, version, aperture_size = fields[:3]
+        if magic != file_magic or version != file_version:
+            raise ValueError('not a plane file, or an unsupported version')
+        view = memoryview(buf)
+        offset = file_header.size + (-file_header.size % 8)
+        plane = cls.__new__(cls)
+        table = json.loads(
+            bytes(view[offset:offset + aperture_size]).decode('utf-8'))
+        plane.apertures = {}
+        for record in table['apertures']:
+            aperture = Aperture.from_record(record)
+            plane.apertures[aperture.number] = aperture
+        plane.repeats = [tuple(repeat) for repeat in table['repeats']]
+        offset += aperture_size + (-aperture_size % 8)
+        for name, count in zip(column_names, fields[3:]):
+            typecode = cls.column_types[name]
+            size = count * array(typecode).itemsize
+            setattr(plane, name, view[offset:offset + size].cast(typecode))
+            offset += size + (-size % 8)
+        plane.mapped = True
+        plane._spatial_index = None
+        return plane
+
+
+class PlaneIndex(object):
+    """
+    A ``PackedRTree`` over the primitives of a ``GraphicsPlane``, with an
+    entry for every copy of the primitives in step and repeat blocks.
+    """
+    def __init__(self, plane):
+        xmin = array('q')
+        ymin = array('q')
+        xmax = array('q')
+        ymax = array('q')
+        self.indices = array('q')
+        self.dx = array('q')
+        self.dy = array('q')
+        for start, stop, offsets in plane.segments():
+            boxes = plane.primitive_boxes(start, stop)
+            for dx, dy in offsets:
+                for column, box_column, delta in ((xmin, boxes[0], dx),
+                                                  (ymin, boxes[1], dy),
+                                                  (xmax, boxes[2], dx),
+                                                  (ymax, boxes[3], dy)):
+                    if delta:
+                        column.extend(map(delta.__add__, box_column))
+                    else:
+                        column.extend(box_column)
+                self.indices.extend(range(start, stop))
+                self.dx.extend([dx] * (stop - start))
+                self.dy.extend([dy] * (stop - start))
+        self.tree = PackedRTree(xmin, ymin, xmax, ymax)
+
+    def __len__(self):
+        return len(self.tree)
+
+    def entry(self, item):
+        return self.indices[item], self.dx[item], self.dy[item]
+
+    def query(self, bbox):
+        return [self.entry(item) for item in self.tree.query(*bbox)]
+
+    def nearest(self, x, y, count=1, max_distance=None):
+        return [self.entry(item)
+                for item in self.tree.nearest(x, y, count, max_distance)]
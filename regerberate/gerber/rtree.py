@@ -0,0 +1,251 @@
+"""
+Packed R-trees over integer bounding boxes.
+
+The boxes are sorted along a Hilbert curve through their centres, then
+packed bottom up into nodes of ``node_size`` children each, so building a
+tree takes O(n log n) and the tree is only a few flat arrays. Positions
+``0`` up to ``count`` hold the items' boxes in sorted order, followed by each
+level of nodes up to the single root. For an item, ``indices`` holds its
+item number; for a node, the position of its first child, with ``ends``
+holding the position after its last child.
+"""
+import heapq
+from array import array
+from functools import lru_cache
+
+default_node_size = 16
+
+# Resolution of the Hilbert curve along each axis.
+hilbert_max = (1 << 16) - 1
+
+
+def hilbert(x, y):
+    """
+    Return the distance along a Hilbert curve of order 16 of the point
+    ``(x, y)``, where ``0 <= x, y < 65536``, using the branch free method of
+    Rawlins' Flatbush.
+    """
+    a = x ^ y
+    b = 0xFFFF ^ a
+    c = 0xFFFF ^ (x | y)
+    d = x & (y ^ 0xFFFF)
+
+    A = a | (b >> 1)
+    B = (a >> 1) ^ a
+    C = ((c >> 1) ^ (b & (d >> 1))) ^ c
+    D = ((a & (c >> 1)) ^ (d >> 1)) ^ d
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 2)) ^ (b & (b >> 2))
+    B = (a & (b >> 2)) ^ (b & ((a ^ b) >> 2))
+    C ^= (a & (c >> 2)) ^ (b & (d >> 2))
+    D ^= (b & (c >> 2)) ^ ((a ^ b) & (d >> 2))
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 4)) ^ (b & (b >> 4))
+    B = (a & (b >> 4)) ^ (b & ((a ^ b) >> 4))
+    C ^= (a & (c >> 4)) ^ (b & (d >> 4))
+    D ^= (b & (c >> 4)) ^ ((a ^ b) & (d >> 4))
+
+    a, b, c, d = A, B, C, D
+    C ^= (a & (c >> 8)) ^ (b & (d >> 8))
+    D ^= (b & (c >> 8)) ^ ((a ^ b) & (d >> 8))
+
+    a = C ^ (C >> 1)
+    b = D ^ (D >> 1)
+
+    i0 = x ^ y
+    i1 = b | (0xFFFF ^ (i0 | a))
+
+    i0 = (i0 | (i0 << 8)) & 0x00FF00FF
+    i0 = (i0 | (i0 << 4)) & 0x0F0F0F0F
+    i0 = (i0 | (i0 << 2)) & 0x33333333
+    i0 = (i0 | (i0 << 1)) & 0x55555555
+
+    i1 = (i1 | (i1 << 8)) & 0x00FF00FF
+    i1 = (i1 | (i1 << 4)) & 0x0F0F0F0F
+    i1 = (i1 | (i1 << 2)) & 0x33333333
+    i1 = (i1 | (i1 << 1)) & 0x55555555
+
+    return (i1 << 1) | i0
+
+
+@lru_cache(maxsize=None)
+def hilbert_table():
+    """
+    Return the Hilbert distances of a 256 by 256 grid, indexed by
+    ``x << 8 | y``.
+    """
+    return array('L', [hilbert(x << 8, y << 8) >> 16
+                       for x in range(256) for y in range(256)])
+
+
+def hilbert_keys(xs, ys):
+    """
+    Return sort keys which order the points ``(xs[i], ys[i])``, given in
+    the range 0 to 65535, along a Hilbert curve. Points are ordered by the
+    cell of a 256 by 256 grid they fall in, then along a curve within the
+    cell. This is much faster in Python than evaluating ``hilbert()``, and
+    only differs in where the curve enters and leaves each cell.
+    """
+    table = hilbert_table()
+    return [table[(x >> 8) << 8 | y >> 8] << 16
+            | table[(x & 255) << 8 | y & 255]
+            for x, y in zip(xs, ys)]
+
+
+class PackedRTree(object):
+    """
+    A static R-tree over the boxes ``(xmin[i], ymin[i], xmax[i], ymax[i])``,
+    whose items are the box numbers ``i``. Boxes are closed, so boxes which
+    only share an edge or corner overlap.
+    """
+    def __init__(self, xmin, ymin, xmax, ymax, node_size=default_node_size):
+        n = len(xmin)
+        self.count = n
+        self.node_size = node_size
+        if not n:
+            self.xmin = self.ymin = self.xmax = self.ymax = array('q')
+            self.indices = self.ends = array('q')
+            self.level_bounds = [0]
+            return
+
+        left = min(xmin)
+        bottom = min(ymin)
+        width = max(max(xmax) - left, 1)
+        height = max(max(ymax) - bottom, 1)
+        keys = hilbert_keys(
+            [(x0 + x1 - 2 * left) * hilbert_max // (2 * width)
+             for x0, x1 in zip(xmin, xmax)],
+            [(y0 + y1 - 2 * bottom) * hilbert_max // (2 * height)
+             for y0, y1 in zip(ymin, ymax)])
+        order = sorted(range(n), key=keys.__getitem__)
+        del keys
+
+        self.xmin = array('q', [xmin[i] for i in order])
+        self.ymin = array('q', [ymin[i] for i in order])
+        self.xmax = array('q', [xmax[i] for i in order])
+        self.ymax = array('q', [ymax[i] for i in order])
+        self.indices = array('q', order)
+        self.ends = array('q', bytes(8 * n))
+        self.level_bounds = [n]
+
+        start = 0
+        end = n
+        while end - start > 1:
+            for first in range(start, end, node_size):
+                last = min(first + node_size, end)
+                self.xmin.append(min(self.xmin[first:last]))
+                self.ymin.append(min(self.ymin[first:last]))
+                self.xmax.append(max(self.xmax[first:last]))
+                self.ymax.append(max(self.ymax[first:last]))
+                self.indices.append(first)
+                self.ends.append(last)
+            start = end
+            end = len(self.xmin)
+            self.level_bounds.append(end)
+
+    def __len__(self):
+        return self.count
+
+    def root(self):
+        """
+        Return the range of positions of the top level: the root node, or
+        the single item of a tree of one.
+        """
+        bounds = self.level_bounds
+        return (bounds[-2] if len(bounds) > 1 else 0), bounds[-1]
+
+    def query(self, xmin, ymin, xmax, ymax):
+        """
+        Return a list of the items whose boxes overlap the given box.
+        """
+        if not self.count:
+            return []
+        n = self.count
+        xmins, ymins, xmaxs, ymaxs = self.xmin, self.ymin, self.xmax, \
+            self.ymax
+        indices = self.indices
+        ends = self.ends
+        result = []
+        stack = [self.root()]
+        while stack:
+            start, end = stack.pop()
+            leaf = start < n
+            for p in range(start, end):
+                if xmins[p] > xmax or xmaxs[p] < xmin or \
+                        ymins[p] > ymax or ymaxs[p] < ymin:
+                    continue
+                if leaf:
+                    result.append(indices[p])
+                else:
+                    stack.append((indices[p], ends[p]))
+        return result
+
+    def nearest(self, x, y, count=1, max_distance=None):
+        """
+        Return up to ``count`` items, nearest first, by the distance from
+        ``(x, y)`` to their boxes. Items further than ``max_distance`` are
+        not returned.
+        """
+        if not self.count:
+            return []
+        n = self.count
+        xmins, ymins, xmaxs, ymaxs = self.xmin, self.ymin, self.xmax, \
+            self.ymax
+        indices = self.indices
+        ends = self.ends
+        limit = None if max_distance is None else max_distance ** 2
+
+        def push(start, end):
+            for p in range(start, end):
+                dx = max(xmins[p] - x, 0, x - xmaxs[p])
+                dy = max(ymins[p] - y, 0, y - ymaxs[p])
+                d = dx * dx + dy * dy
+                if limit is None or d <= limit:
+                    heapq.heappush(heap, (d, p))
+
+        heap = []
+        result = []
+        push(*self.root())
+        while heap and len(result) < count:
+            d, p = heapq.heappop(heap)
+            if p < n:
+                result.append(indices[p])
+            else:
+                push(indices[p], ends[p])
+        return result
+
+    def overlapping_pairs(self):
+        """
+        Yield each pair of items ``(a, b)`` whose boxes overlap, once, by
+        descending the tree against itself.
+        """
+        n = self.count
+        xmins, ymins, xmaxs, ymaxs = self.xmin, self.ymin, self.xmax, \
+            self.ymax
+        indices = self.indices
+        ends = self.ends
+        start, end = self.root()
+        # Pairs of positions on the same level, whose boxes overlap.
+        stack = [(p, p) for p in range(start, end)]
+        while stack:
+            a, b = stack.pop()
+            if a < n:
+                if a != b:
+                    yield indices[a], indices[b]
+                continue
+            a_end = ends[a]
+            b_first = indices[b]
+            b_end = ends[b]
+            for i in range(indices[a], a_end):
+                ixmin = xmins[i]
+                iymin = ymins[i]
+                ixmax = xmaxs[i]
+                iymax = ymaxs[i]
+                # Within one node, only test each pair of children once.
+                for j in range(i if a == b else b_first, b_end):
+                    if xmins[j] > ixmax or xmaxs[j] < ixmin or \
+                            ymins[j] > iymax or ymaxs[j] < iymin:
+                        continue
+                    stack.append((i, j))
@@ -0,0 +1,280 @@
+"""
+RS-274X output for a ``GraphicsPlane``.
+
+Files are written in millimetres with 4 integer and 6 fractional digits, so
+every picometre coordinate is written to the nearest nanometre. Identical
+apertures are given a single D-code, and modal state (the current point,
+aperture, interpolation mode and polarity) is tracked so that only changes
+are written.
+"""
+import io
+import logging
+
+from .apertures import parse_modifiers
+from .commands import (UnitCommand, CoordinateFormatCommand,
+                       LevelPolarityCommand, MacroApertureCommand,
+                       ApertureDefinitionCommand, SetApertureCommand,
+                       StepAndRepeatCommand, CommentCommand, bare_commands)
+from .coordinates import UNITS_PER_MM, unit_scales
+from .plane import DRAW, ARC, FLASH, REGION, DARK, CLOCKWISE
+
+log = logging.getLogger(__name__)
+
+buffer_size = 1 << 20
+
+# Picometres per unit of the output coordinate format.
+coordinate_step = UNITS_PER_MM // 10 ** 6
+
+# Indices of the modifiers of each standard template which are lengths, and
+# so must be converted to the output unit.
+length_modifiers = {
+    'C': (0, 1),
+    'R': (0, 1, 2),
+    'O': (0, 1, 2),
+    'P': (0, 3),
+}
+
+first_aperture_number = 10
+
+
+def format_decimal(v):
+    s = '%.6f' % v
+    s = s.rstrip('0').rstrip('.')
+    return '0' if s == '-0' else s
+
+
+def to_step(v):
+    """
+    Convert picometres to output coordinate steps, rounding to nearest.
+    """
+    return (2 * v + coordinate_step) // (2 * coordinate_step)
+
+
+def aperture_definition(aperture):
+    """
+    Return ``(template, modifiers, macro_body)`` describing ``aperture`` in
+    millimetres. Standard apertures keep their template, with their lengths
+    converted. Macro apertures defined in millimetres keep their macro body
+    and modifiers exactly as they were read. Macro apertures in other units
+    cannot be rescaled in general, so they are redefined by an equivalent
+    macro of outline primitives built from their compiled shapes, and
+    ``template`` is ``None``.
+    """
+    template_name = aperture.template_name
+    if template_name in length_modifiers:
+        args = parse_modifiers(aperture.modifiers)
+        scale = unit_scales[aperture.unit] / UNITS_PER_MM
+        lengths = length_modifiers[template_name]
+        modifiers = 'X'.join(format_decimal(v * scale if n in lengths else v)
+                             for n, v in enumerate(args))
+        return template_name, modifiers, None
+    if aperture.macro is not None and aperture.unit == 'MM':
+        return template_name, aperture.modifiers, aperture.macro
+
+    statements = []
+    for dark, points in aperture.shapes:
+        if len(points) < 3:
+            continue
+        points = points + [points[0]]
+        fields = ['4', '1' if dark else '0', str(len(points) - 1)]
+        for x, y in points:
+            fields.append(format_decimal(x / UNITS_PER_MM))
+            fields.append(format_decimal(y / UNITS_PER_MM))
+        fields.append('0')
+        statements.append(','.join(fields))
+    return None, None, '*'.join(statements)
+
+
+class GerberWriter(object):
+    """
+    Write the primitives of a ``GraphicsPlane`` to the text file ``f``.
+    """
+    def __init__(self, f):
+        self.f = f
+        # Definition -> output D-code, and input aperture -> output D-code.
+        self.definitions = {}
+        self.numbers = {}
+        # (name, body) of each macro written -> its output name.
+        self.macros = {}
+        self.macro_names = set()
+
+        self.x = self.y = None
+        self.aperture = None
+        self.mode = None
+        self.dark = True
+
+    def write_command(self, cmd):
+        self.f.write(cmd.to_string() + '\n')
+
+    def write_header(self):
+        self.write_command(CommentCommand(' Generated by Regerberate'))
+        self.write_command(CoordinateFormatCommand(4, 6))
+        self.write_command(UnitCommand('MM'))
+        self.write_command(LevelPolarityCommand('D'))
+
+    def define_apertures(self, plane):
+        """
+        Write one AD command, preceded by any AM command it needs, for each
+        distinct aperture used in ``plane``.
+        """
+        used = set(number for kind, number
+                   in zip(plane.kinds, plane.aperture_numbers)
+                   if kind != REGION)
+        for number in sorted(used):
+            if number in self.numbers:
+                continue
+            template_name, modifiers, body = \
+                aperture_definition(plane.apertures[number])
+            if body is not None:
+                template_name = self.define_macro(template_name, body)
+            key = (template_name, modifiers or '')
+            new_number = self.definitions.get(key)
+            if new_number is None:
+                new_number = first_aperture_number + len(self.definitions)
+                self.definitions[key] = new_number
+                s = '%ADD' + str(new_number) + template_name
+                if modifiers:
+                    s += ',' + modifiers
+                s += '*%'
+                self.write_command(ApertureDefinitionCommand(
+                    new_number, template_name, s, modifiers))
+            self.numbers[number] = new_number
+
+    def define_macro(self, name, body):
+        """
+        Write an AM command for the macro ``body``, unless an identical one
+        has been written, and return its output name. ``name`` is kept
+        unless another macro already uses it, in which case a suffix like
+        ``_2`` is added; outline macros, with no name, are called ``SHAPE1``,
+        ``SHAPE2`` and so on.
+        """
+        key = (name, body)
+        output_name = self.macros.get(key)
+        if output_name is None:
+            pattern = name + '_%d' if name else 'SHAPE%d'
+            output_name = name
+            count = 2 if name else 1
+            while output_name is None or output_name in self.macro_names:
+                output_name = pattern % count
+                count += 1
+            self.macros[key] = output_name
+            self.macro_names.add(output_name)
+            self.write_command(MacroApertureCommand(
+                output_name, '%AM' + output_name + '*' + body + '*%'))
+        return output_name
+
+    def set_polarity(self, dark):
+        if dark != self.dark:
+            self.write_command(LevelPolarityCommand('D' if dark else 'C'))
+            self.dark = dark
+
+    def set_aperture(self, number):
+        number = self.numbers[number]
+        if number != self.aperture:
+            self.write_command(SetApertureCommand(number))
+            self.aperture = number
+
+    def set_mode(self, mode):
+        if mode != self.mode:
+            self.write_command(bare_commands[mode + '*'])
+            self.mode = mode
+
+    def operation(self, x, y, code, extra=''):
+        """
+        Write an operation to ``(x, y)``, in output steps, omitting whichever
+        coordinates are unchanged.
+        """
+        s = ''
+        if x != self.x:
+            s = 'X%d' % x
+            self.x = x
+        if y != self.y:
+            s += 'Y%d' % y
+            self.y = y
+        self.f.write(s + extra + code + '*\n')
+
+    def move(self, x, y):
+        if x != self.x or y != self.y:
+            self.operation(x, y, 'D02')
+
+    def write_plane(self, plane):
+        """
+        Write every primitive of ``plane``. Step and repeat blocks are kept
+        as SR blocks, so their content is written once.
+        """
+        self.define_apertures(plane)
+        if ARC in plane.kinds:
+            self.write_command(bare_commands['G75*'])
+        pos = 0
+        for start, stop, x_count, y_count, x_step, y_step in plane.repeats:
+            self.write_primitives(plane, pos, start)
+            self.write_command(StepAndRepeatCommand(
+                x_count, y_count, format_decimal(x_step / UNITS_PER_MM),
+                format_decimal(y_step / UNITS_PER_MM)))
+            self.write_primitives(plane, start, stop)
+            self.write_command(StepAndRepeatCommand())
+            pos = stop
+        self.write_primitives(plane, pos, len(plane))
+
+    def write_primitives(self, plane, start, stop):
+        kinds = plane.kinds
+        flags = plane.flags
+        aperture_numbers = plane.aperture_numbers
+        x0s, y0s, x1s, y1s = plane.x0, plane.y0, plane.x1, plane.y1
+        for index in range(start, stop):
+            kind = kinds[index]
+            self.set_polarity(bool(flags[index] & DARK))
+            if kind == REGION:
+                self.write_region(plane[index].vertices)
+                continue
+            self.set_aperture(aperture_numbers[index])
+            x1 = to_step(x1s[index])
+            y1 = to_step(y1s[index])
+            if kind == FLASH:
+                self.operation(x1, y1, 'D03')
+                continue
+            self.move(to_step(x0s[index]), to_step(y0s[index]))
+            if kind == DRAW:
+                self.set_mode('G01')
+                self.operation(x1, y1, 'D01')
+            else:
+                self.set_mode('G02' if flags[index] & CLOCKWISE else 'G03')
+                i = to_step(plane.cx[index]) - self.x
+                j = to_step(plane.cy[index]) - self.y
+                extra = ''
+                if i:
+                    extra += 'I%d' % i
+                if j:
+                    extra += 'J%d' % j
+                self.operation(x1, y1, 'D01', extra)
+
+    def write_region(self, vertices):
+        points = [(to_step(x), to_step(y)) for x, y in vertices]
+        if len(points) < 3:
+            return
+        if points[0] != points[-1]:
+            points.append(points[0])
+        self.write_command(bare_commands['G36*'])
+        self.set_mode('G01')
+        x, y = points[0]
+        self.operation(x, y, 'D02')
+        for x, y in points[1:]:
+            if x != self.x or y != self.y:
+                self.operation(x, y, 'D01')
+        self.write_command(bare_commands['G37*'])
+
+    def write_footer(self):
+        self.write_command(bare_commands['M02*'])
+
+
+def write_gerber(filename, plane):
+    """
+    Write ``plane`` to the Gerber file ``filename``.
+    """
+    log.debug('write_gerber(%s)', filename)
+    with io.open(filename, 'w', encoding='ascii', newline='\n',
+                 buffering=buffer_size) as f:
+        writer = GerberWriter(f)
+        writer.write_header()
+        writer.write_plane(plane)
+        writer.write_footer()
@@ -2,29 +2,154 @@ import logging
 
 import os.path
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
-from .gerber.context import Context
+from . import project, svg
+from .cache import file_key
+from .clipping import flatten
+from .connectivity import find_shorts, is_copper
+from .geometry import plane_polygons
+from .gerber.coordinates import UNITS_PER_MM
 from .gerber.parser import GerberParser
+from .gerber.plane import GraphicsPlane
+from .gerber.writer import write_gerber
 
 log = logging.getLogger(__name__)
 
 
+def read_gerber(filename):
+    """
+    Parse a Gerber file into a ``GraphicsPlane``. This is a module-level
+    function so it can be run in a worker process.
+    """
+    return GerberParser(filename).parse()
+
+
+def layer_name(filename):
+    """
+    The name of the layer read from the Gerber file ``filename``.
+    """
+    return os.path.basename(filename)
+
+
+def format_box(box):
+    return '(%.4f, %.4f) - (%.4f, %.4f) mm' % tuple(
+        v / UNITS_PER_MM for v in box)
+
+
 class LayerSet(object):
 
-    def __init__(self):
+    def __init__(self, cache=None):
         self.layers = OrderedDict()
+        self.cache = cache
+        # Layer name -> (Gerber filename, content key) for each base layer
+        # updated from a Gerber file.
+        self.sources = {}
 
     @classmethod
-    def load_svg(cls, filename):
+    def load_file(cls, filename, cache=None):
+        """
+        Load a layer set from a file saved by Regerberate, either a project
+        file or an SVG file.
+        """
+        if project.is_project(filename):
+            return cls.load_project(filename, cache)
+        return cls.load_svg(filename, cache)
+
+    @classmethod
+    def load_project(cls, filename, cache=None):
+        """
+        Open a project file. Layers are only read from it when they are
+        used.
+        """
+        log.debug('load_project(%s)', filename)
+        return project.load_project(filename, cls(cache))
+
+    @classmethod
+    def load_svg(cls, filename, cache=None):
         log.debug('load_svg(%s)', filename)
+        return svg.load_document(filename, cls(cache))
+
+    def write_project(self, filename):
+        log.debug('write_project(%s)', filename)
+        project.write_project(filename, self)
 
     def write_svg(self, filename):
         log.debug('write_svg(%s)', filename)
+        svg.write_document(filename, self)
+
+    def update_svg(self, filename):
+        """
+        Update an existing SVG file in place, regenerating only the base
+        layers whose Gerber content has changed and copying everything else
+        through untouched.
+        """
+        log.debug('update_svg(%s)', filename)
+        svg.update_document(filename, self)
 
     def update_from_gerber(self, filename):
         log.debug('update_from_gerber(%s)', filename)
-        new_base_layer = self.gerber_read(filename)
-        name = filename[:-4]
+        self.update_from_gerbers([filename])
+
+    def update_from_gerbers(self, filenames, jobs=1, unchanged=None):
+        """
+        Update from several Gerber files, parsing up to ``jobs`` of them at
+        once in worker processes. Layers are added in the order given,
+        regardless of which finishes parsing first. Files found in the parse
+        cache are not parsed at all.
+
+        ``unchanged`` maps layer names to the content keys of layers which
+        are already up to date elsewhere, such as in an SVG document about to
+        be updated. Files whose content still has that key are not parsed
+        or added as layers; only their sources are recorded.
+
+        Layers are named after the files' base names, so files in different
+        directories with the same base name raise ``ValueError`` rather than
+        replacing one another. A file given twice is read once.
+        """
+        log.debug('update_from_gerbers(%r, jobs=%d)', filenames, jobs)
+        paths = OrderedDict()
+        for filename in filenames:
+            name = layer_name(filename)
+            other = paths.setdefault(name, filename)
+            if os.path.abspath(other) != os.path.abspath(filename):
+                raise ValueError('%s and %s would both be layer %s; rename '
+                                 'one of them' % (other, filename, name))
+        filenames = list(paths.values())
+        planes = {}
+        keys = {}
+        missing = []
+        for filename in list(filenames):
+            keys[filename] = key = file_key(filename)
+            name = layer_name(filename)
+            if unchanged and unchanged.get(name) == key:
+                log.debug('%s is unchanged', filename)
+                self.sources[name] = filename, key
+                filenames.remove(filename)
+                continue
+            if self.cache:
+                plane = self.cache.get(key)
+                if plane is not None:
+                    log.debug('using cached parse of %s', filename)
+                    planes[filename] = plane
+                    continue
+            missing.append(filename)
+
+        if jobs == 1 or len(missing) < 2:
+            planes.update(zip(missing, map(read_gerber, missing)))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                planes.update(zip(missing,
+                                  executor.map(read_gerber, missing)))
+
+        for filename in filenames:
+            if self.cache and filename in missing:
+                self.cache.put(keys[filename], planes[filename])
+            self.set_base_layer(filename, planes[filename], keys[filename])
+
+    def set_base_layer(self, filename, new_base_layer, key=None):
+        name = layer_name(filename)
+        self.sources[name] = filename, key
 
         if name in self.layers:
             base_layer, extra_layer = self.layers[name]
@@ -32,20 +157,125 @@ class LayerSet(object):
         else:
             self.layers[name] = new_base_layer, None
 
-    def render_gerbers(self, output_path):
+    def panelize(self, columns, rows, gap=0):
+        """
+        Replace every base layer with a panel of ``columns`` by ``rows``
+        copies of it, ``gap`` picometres apart. The layers are stepped by the
+        size of their combined extent, so they stay aligned, and each is
+        stored as a single step and repeat block.
+        """
+        boxes = [base.bounding_box() for base, extra in self.layers.values()
+                 if base is not None]
+        boxes = [box for box in boxes if box]
+        if not boxes:
+            return
+        x_step = max(box[2] for box in boxes) - \
+            min(box[0] for box in boxes) + gap
+        y_step = max(box[3] for box in boxes) - \
+            min(box[1] for box in boxes) + gap
+        for name, (base, extra) in self.layers.items():
+            if base is not None:
+                base = base.repeated(columns, rows, x_step, y_step)
+            self.layers[name] = base, extra
+
+    def write_preview(self, filename, dpi=300, jobs=1):
+        """
+        Render a PNG preview of the composited layers. Requires NumPy.
+        """
+        log.debug('write_preview(%s, dpi=%d, jobs=%d)', filename, dpi, jobs)
+        from . import raster
+        raster.write_preview(filename, self, dpi, jobs)
+
+    def render_gerbers(self, output_path, names=None, rules=None):
+        """
+        Write the composited layers to Gerber files in ``output_path``, or
+        only the layers in ``names`` if it is given. If ``rules`` is given,
+        as a mapping of layer name or extension to ``drc.Rule``, which may
+        be empty to use the defaults, the art is also checked against design
+        rules, which requires NumPy.
+        """
         log.debug('render_gerbers(%s)', output_path)
-        for name, (base_layer, extra_layer) in self.layers.items():
+        if not os.path.isdir(output_path):
+            os.makedirs(output_path)
+        for name in names or list(self.layers):
+            base_layer, extra_layer = self.layers[name]
+            if extra_layer is not None and is_copper(name):
+                self.check_shorts(name)
+            if rules is not None:
+                self.check_rules([name], rules)
             layer = self.composite(base_layer, extra_layer)
-            filename = os.path.join(output_path, name + '.ger')
+            filename = os.path.join(output_path, name)
             self.gerber_write(layer, filename)
 
+    def check_shorts(self, name):
+        """
+        Log a warning for each place where the art in the extra layer of the
+        copper layer ``name`` joins copper islands of its base layer, and
+        return the list of ``Short`` objects.
+        """
+        base_layer, extra_layer = self.layers[name]
+        shorts = find_shorts(base_layer, extra_layer)
+        for short in shorts:
+            log.warning('%s: art at %s joins %d copper islands: %s', name,
+                        format_box(short.art_box), len(short.island_boxes),
+                        ', '.join(format_box(box)
+                                  for box in short.island_boxes))
+        return shorts
+
+    def check_rules(self, names=None, rules=None):
+        """
+        Check the art in each layer, or only the layers in ``names``,
+        against its design rules, looked up in ``rules`` and then the
+        defaults. Log a warning for each violation, and return an
+        ``OrderedDict`` of the list of violations of each layer. Requires
+        NumPy.
+        """
+        from . import drc
+        results = OrderedDict()
+        for name in names or list(self.layers):
+            base_layer, extra_layer = self.layers[name]
+            violations = drc.check_layer(name, base_layer, extra_layer,
+                                         drc.rule_for(name, rules))
+            for violation in violations:
+                log.warning('%s', violation.describe())
+            results[name] = violations
+        return results
+
+    def write_drc_overlay(self, filename, violations):
+        """
+        Mark ``violations``, as returned by ``check_rules()``, in a drc group
+        of each layer of the SVG file ``filename``, replacing any marked
+        before.
+        """
+        log.debug('write_drc_overlay(%s)', filename)
+        svg.write_drc_overlay(filename, violations)
+
     def composite(self, bottom, top):
-        pass
+        """
+        Merge the extra layer ``top`` over the base layer ``bottom``,
+        respecting the polarity of every object in both, and return a plane
+        of the resulting dark regions. A base layer without an extra layer
+        is returned as it is, keeping its apertures and step and repeat
+        blocks.
+        """
+        if top is None:
+            return bottom
+        layers = [layer for layer in (bottom, top) if layer is not None]
+        polygons = []
+        for layer in layers:
+            polygons.extend(plane_polygons(layer))
+        plane = GraphicsPlane()
+        for xs, ys in flatten(polygons):
+            plane.add_region(xs, ys)
+        return plane
 
     def gerber_read(self, filename):
-        context = Context()
-        GerberParser(filename, context).parse()
-        return context
+        if self.cache:
+            return self.cache.read_gerber(filename)
+        return read_gerber(filename)
 
     def gerber_write(self, layer, filename):
-        pass
+        if layer is None:
+            log.warning('nothing to write for %s', filename)
+            return
+        write_gerber(filename, layer)
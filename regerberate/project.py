@@ -0,0 +1,147 @@
+"""
+Binary project files for a ``LayerSet``.
+
+A project file is a header, the base and extra planes of every layer in the
+format written by ``GraphicsPlane.dump()``, and a table of layers giving the
+position of each plane in the file. Opening a project maps the file and
+reads only the table: each plane is loaded from the map, without copying its
+columns, the first time its layer is looked up.
+"""
+import json
+import logging
+import mmap
+import os
+import os.path
+import struct
+import tempfile
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from .files import replace_file
+from .gerber.plane import GraphicsPlane
+
+log = logging.getLogger(__name__)
+
+project_magic = b'RGPJ'
+project_version = 2
+# Magic, version, and the offset and size of the layer table.
+project_header = struct.Struct('<4sIQQ')
+
+project_extension = '.rgp'
+
+
+def is_project(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(project_magic)) == project_magic
+
+
+class ProjectLayers(MutableMapping):
+    """
+    The layers of a project file, as ``(base, extra)`` planes by name, in
+    the order they were saved. Layers are loaded on first access, and layers
+    which are replaced are never loaded at all.
+    """
+    def __init__(self, buf, entries):
+        self.buf = buf
+        # Layer name -> table entry, or None once the layer has been
+        # replaced.
+        self.entries = OrderedDict((entry['name'], entry)
+                                   for entry in entries)
+        self.loaded = {}
+
+    def load_plane(self, location):
+        if location is None:
+            return None
+        offset, size = location
+        return GraphicsPlane.load(memoryview(self.buf)[offset:offset + size])
+
+    def __getitem__(self, name):
+        layer = self.loaded.get(name)
+        if layer is None:
+            entry = self.entries[name]
+            log.debug('loading layer %s', name)
+            layer = self.loaded[name] = (self.load_plane(entry['base']),
+                                         self.load_plane(entry['extra']))
+        return layer
+
+    def __setitem__(self, name, layer):
+        if name not in self.entries:
+            self.entries[name] = None
+        self.loaded[name] = layer
+
+    def __delitem__(self, name):
+        del self.entries[name]
+        self.loaded.pop(name, None)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def load_project(filename, layers):
+    """
+    Open the project file ``filename`` as the layers of the ``LayerSet``
+    ``layers``.
+    """
+    with open(filename, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buf) < project_header.size:
+        raise ValueError('%s is not a project file' % filename)
+    magic, version, table_offset, table_size = \
+        project_header.unpack_from(buf)
+    if magic != project_magic or version != project_version:
+        raise ValueError('%s is not a project file, or an unsupported '
+                         'version' % filename)
+    table = json.loads(
+        buf[table_offset:table_offset + table_size].decode('utf-8'))
+    layers.layers = ProjectLayers(buf, table)
+    layers.sources = dict((entry['name'], tuple(entry['source']))
+                          for entry in table if entry['source'])
+    return layers
+
+
+def write_plane(f, plane):
+    """
+    Write ``plane`` at the next 8 byte boundary of ``f``, returning its
+    ``[offset, size]``, or ``None`` if there is no plane.
+    """
+    if plane is None:
+        return None
+    f.write(b'\0' * (-f.tell() % 8))
+    offset = f.tell()
+    plane.dump(f)
+    return [offset, f.tell() - offset]
+
+
+def write_project(filename, layers):
+    """
+    Write the layers of the ``LayerSet`` ``layers`` to the project file
+    ``filename``. The file is replaced atomically, so a project can be saved
+    over the file it was opened from.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'\0' * project_header.size)
+            table = []
+            for name, (base, extra) in layers.layers.items():
+                source = layers.sources.get(name)
+                table.append({
+                    'name': name,
+                    'source': list(source) if source else None,
+                    'base': write_plane(f, base),
+                    'extra': write_plane(f, extra),
+                })
+            data = json.dumps(table).encode('utf-8')
+            table_offset = f.tell()
+            f.write(data)
+            f.seek(0)
+            f.write(project_header.pack(project_magic, project_version,
+                                        table_offset, len(data)))
+        replace_file(tmp_path, filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
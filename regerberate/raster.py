@@ -0,0 +1,521 @@
+"""
+Raster previews of a ``LayerSet``.
+
+Each layer is converted once into arrays of polygon edges and flash
+positions in pixel coordinates. The image is then rendered in bands of rows,
+in parallel if requested, and each band is written to the PNG as soon as it
+and the bands above it are done, so memory use does not grow with the size
+of the image.
+
+Within a band, consecutive objects of the same polarity are filled together:
+every edge crossing a pixel row adds its winding to a difference array, whose
+running sum along the row is then non-zero inside. Flashes are drawn by
+copying a pre-rendered stamp of their aperture.
+
+This module requires NumPy.
+"""
+import hashlib
+import logging
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .geometry import primitive_polygons
+from .gerber.plane import FLASH, DARK
+from .svg import layer_color, document_bounds
+
+log = logging.getLogger(__name__)
+
+MM_PER_INCH = 25.4
+
+# Rows of pixels rendered at once by each worker.
+band_rows = 256
+
+background = (0, 0, 0)
+layer_alpha = 0.7
+
+# Most layers blended into one preview.
+max_layers = 16
+
+
+def signed_area(xs, ys):
+    return 0.5 * (np.dot(xs, np.roll(ys, -1)) - np.dot(ys, np.roll(xs, -1)))
+
+
+def fill(edges, r0, r1, width):
+    """
+    Return a boolean mask of the ``r1 - r0`` rows from ``r0`` and ``width``
+    columns, set inside the polygons whose edges are given as arrays ``(x0,
+    y0, x1, y1, winding)`` in pixel coordinates. A pixel is inside if the
+    winding number at its centre is non-zero.
+    """
+    x0, y0, x1, y1, winding = edges
+    # Pixel rows whose centres lie between each edge's end points.
+    first = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), r0, r1).astype(np.int64)
+    last = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), r0, r1).astype(np.int64)
+    counts = last - first
+    total = int(counts.sum())
+    diff = np.zeros((r1 - r0, width + 1), dtype=np.int16)
+    if total:
+        edge = np.repeat(np.arange(len(counts)), counts)
+        rows = np.arange(total) - np.repeat(np.cumsum(counts) - counts,
+                                            counts) + first[edge]
+        ea = x0[edge]
+        eb = y0[edge]
+        xs = ea + (rows + 0.5 - eb) * (x1[edge] - ea) / (y1[edge] - eb)
+        cols = np.clip(np.ceil(xs - 0.5), 0, width).astype(np.int64)
+        np.add.at(diff, (rows - r0, cols), winding[edge])
+    return np.cumsum(diff[:, :width], axis=1, dtype=np.int16) != 0
+
+
+class Stamp(object):
+    """
+    An aperture rendered to a mask, with the pixel offset of its top left
+    corner from the flash point.
+    """
+    def __init__(self, aperture, scale):
+        shapes = [(dark, np.array(points, dtype=np.float64) * scale)
+                  for dark, points in aperture.shapes if len(points) >= 3]
+        if not shapes:
+            self.mask = np.zeros((0, 0), dtype=bool)
+            self.left = self.top = 0
+            return
+        xmin = min(points[:, 0].min() for dark, points in shapes)
+        xmax = max(points[:, 0].max() for dark, points in shapes)
+        ymin = min(-points[:, 1].max() for dark, points in shapes)
+        ymax = max(-points[:, 1].min() for dark, points in shapes)
+        self.left = int(np.floor(xmin))
+        self.top = int(np.floor(ymin))
+        width = int(np.ceil(xmax)) - self.left
+        height = int(np.ceil(ymax)) - self.top
+        mask = np.zeros((height, width), dtype=bool)
+        for dark, points in shapes:
+            edges = polygon_edges(points[:, 0] - self.left,
+                                  -points[:, 1] - self.top)
+            shape = fill(edges, 0, height, width)
+            if dark:
+                mask |= shape
+            else:
+                mask &= ~shape
+        self.mask = mask
+
+    @property
+    def key(self):
+        """
+        A digest of the stamp, equal for stamps which draw the same pixels.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(struct.pack('<4q', self.left, self.top, *self.mask.shape))
+        h.update(np.packbits(self.mask).tobytes())
+        return h.digest()
+
+
+def polygon_edges(xs, ys):
+    """
+    Return the edges of a closed polygon as ``(x0, y0, x1, y1, winding)``
+    arrays, with the winding normalized so the inside is positive.
+    """
+    x1 = np.roll(xs, -1)
+    y1 = np.roll(ys, -1)
+    orientation = 1 if signed_area(xs, ys) >= 0 else -1
+    winding = np.where(y1 > ys, orientation, -orientation).astype(np.int16)
+    keep = ys != y1
+    return xs[keep], ys[keep], x1[keep], y1[keep], winding[keep]
+
+
+class LayerRaster(object):
+    """
+    The geometry of one layer in pixel coordinates, ready for rendering any
+    band of rows.
+
+    Objects are numbered into runs of consecutive objects of the same
+    polarity. Edges are held in flat arrays tagged with their run, and
+    flashes as positions tagged with their run and stamp.
+    """
+    def __init__(self, plane, color, origin, scale):
+        self.color = color
+        left, top = origin
+        # Flatten arcs to a fraction of a pixel.
+        tolerance = max(1, int(0.25 / scale))
+        self.run_dark = []
+        self.stamps = {}
+        edge_parts = []
+        flash_parts = []
+
+        for start, stop, offsets in plane.segments():
+            # Each block is converted once, and its copies are shifted.
+            run_dark, edges, flashes = self.convert(plane, start, stop,
+                                                    origin, scale, tolerance)
+            for dx, dy in offsets:
+                run_base = len(self.run_dark)
+                if self.run_dark and run_dark and \
+                        self.run_dark[-1] == run_dark[0]:
+                    # Continue the last run, rather than filling another.
+                    run_base -= 1
+                    self.run_dark.extend(run_dark[1:])
+                else:
+                    self.run_dark.extend(run_dark)
+                x0, y0, x1, y1, winding, runs = edges
+                edge_parts.append((x0 + dx * scale, y0 - dy * scale,
+                                   x1 + dx * scale, y1 - dy * scale, winding,
+                                   runs + run_base))
+                runs, numbers, xs, ys = flashes
+                flash_parts.append((runs + run_base, numbers,
+                                    xs + int(round(dx * scale)),
+                                    ys - int(round(dy * scale))))
+
+        self.edges = tuple(np.concatenate(column)
+                           for column in zip(*edge_parts))
+        self.edge_top = np.minimum(self.edges[1], self.edges[3])
+        self.edge_bottom = np.maximum(self.edges[1], self.edges[3])
+
+        (self.flash_runs, self.flash_stamps, self.flash_x,
+         self.flash_y) = (np.concatenate(column)
+                          for column in zip(*flash_parts))
+        tops = np.zeros(max(self.stamps, default=0) + 1, dtype=np.int64)
+        heights = np.zeros_like(tops)
+        for number, stamp in self.stamps.items():
+            tops[number] = stamp.top
+            heights[number] = stamp.mask.shape[0]
+        self.flash_top = self.flash_y + tops[self.flash_stamps]
+        self.flash_bottom = self.flash_top + heights[self.flash_stamps]
+        self.stamp_keys = dict((number, stamp.key)
+                               for number, stamp in self.stamps.items())
+
+    def convert(self, plane, start, stop, origin, scale, tolerance):
+        """
+        Convert the primitives from ``start`` up to ``stop`` into pixel
+        coordinates. Return the polarity of each run, the edge arrays
+        tagged with their run, and the flash arrays ``(runs, apertures, x,
+        y)``.
+        """
+        left, top = origin
+        run_dark = []
+        edge_parts = [(np.zeros(0),) * 4 + (np.zeros(0, dtype=np.int16),
+                                            np.zeros(0, dtype=np.int32))]
+        flash_runs = []
+        flash_stamps = []
+        flash_x = []
+        flash_y = []
+
+        def run_for(dark):
+            if not run_dark or run_dark[-1] != dark:
+                run_dark.append(dark)
+            return len(run_dark) - 1
+
+        for index in range(start, stop):
+            dark = bool(plane.flags[index] & DARK)
+            if plane.kinds[index] == FLASH:
+                number = plane.aperture_numbers[index]
+                if number not in self.stamps:
+                    self.stamps[number] = Stamp(plane.apertures[number],
+                                                scale)
+                flash_runs.append(run_for(dark))
+                flash_stamps.append(number)
+                flash_x.append((plane.x0[index] - left) * scale)
+                flash_y.append((top - plane.y0[index]) * scale)
+                continue
+            for shape_dark, points in primitive_polygons(plane, index,
+                                                         tolerance):
+                if len(points) < 3:
+                    continue
+                run = run_for(shape_dark)
+                points = np.array(points, dtype=np.float64)
+                edges = polygon_edges((points[:, 0] - left) * scale,
+                                      (top - points[:, 1]) * scale)
+                edge_parts.append(edges + (
+                    np.full(len(edges[0]), run, dtype=np.int32),))
+
+        edges = tuple(np.concatenate(column) for column in zip(*edge_parts))
+        flashes = (np.array(flash_runs, dtype=np.int32),
+                   np.array(flash_stamps, dtype=np.int64),
+                   np.rint(flash_x).astype(np.int64),
+                   np.rint(flash_y).astype(np.int64))
+        return run_dark, edges, flashes
+
+    def select(self, r0, r1):
+        """
+        Return the edges, and the indices of the flashes, which affect rows
+        ``r0`` up to ``r1``.
+        """
+        selected = (self.edge_bottom > r0) & (self.edge_top < r1)
+        edges = tuple(column[selected] for column in self.edges)
+        flashes = np.nonzero((self.flash_bottom > r0) &
+                             (self.flash_top < r1))[0]
+        return edges, flashes
+
+    def band_key(self, r0, r1):
+        """
+        Return a digest of everything which affects rows ``r0`` up to
+        ``r1``. Bands of two rasters with equal keys render identically,
+        whatever else differs in the layers.
+        """
+        edges, flashes = self.select(r0, r1)
+        flash_runs = self.flash_runs[flashes]
+        # Runs are renumbered from zero, so that differences before the
+        # band do not change its key.
+        runs, ranks = np.unique(np.concatenate([edges[5], flash_runs]),
+                                return_inverse=True)
+        h = hashlib.blake2b(digest_size=16)
+        h.update(np.array([self.run_dark[run] for run in runs],
+                          dtype=bool).tobytes())
+        h.update(ranks.astype(np.int32).tobytes())
+        for column in edges[:5]:
+            h.update(column.tobytes())
+        h.update(self.flash_x[flashes].tobytes())
+        h.update(self.flash_y[flashes].tobytes())
+        for n in self.flash_stamps[flashes]:
+            h.update(self.stamp_keys[n])
+        return h.digest()
+
+    def render(self, r0, r1, width):
+        """
+        Return the mask of dark pixels in rows ``r0`` up to ``r1``.
+        """
+        mask = np.zeros((r1 - r0, width), dtype=bool)
+        edges, flashes = self.select(r0, r1)
+        edge_runs = edges[5]
+        runs = np.union1d(edge_runs, self.flash_runs[flashes])
+        for run in runs:
+            in_run = edge_runs == run
+            if in_run.any():
+                run_mask = fill(tuple(column[in_run]
+                                      for column in edges[:5]),
+                                r0, r1, width)
+            else:
+                run_mask = np.zeros((r1 - r0, width), dtype=bool)
+            for n in flashes[self.flash_runs[flashes] == run]:
+                self.blit(run_mask, n, r0, r1, width)
+            if self.run_dark[run]:
+                mask |= run_mask
+            else:
+                mask &= ~run_mask
+        return mask
+
+    def blit(self, mask, n, r0, r1, width):
+        stamp = self.stamps[int(self.flash_stamps[n])]
+        top = int(self.flash_top[n])
+        left = int(self.flash_x[n]) + stamp.left
+        height, stamp_width = stamp.mask.shape
+        y0 = max(top, r0)
+        y1 = min(top + height, r1)
+        x0 = max(left, 0)
+        x1 = min(left + stamp_width, width)
+        if y0 < y1 and x0 < x1:
+            mask[y0 - r0:y1 - r0, x0:x1] |= \
+                stamp.mask[y0 - top:y1 - top, x0 - left:x1 - left]
+
+
+class PNGWriter(object):
+    """
+    Write an 8 bit RGB PNG to the binary file ``f``, a band of rows at a
+    time.
+    """
+    def __init__(self, f, width, height):
+        self.f = f
+        self.compressor = zlib.compressobj(6)
+        f.write(b'\x89PNG\r\n\x1a\n')
+        self.chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0,
+                                        0, 0))
+
+    def chunk(self, kind, data):
+        self.f.write(struct.pack('>I', len(data)) + kind + data +
+                     struct.pack('>I', zlib.crc32(kind + data)))
+
+    def write_rows(self, pixels):
+        rows = np.zeros((pixels.shape[0], pixels.shape[1] * 3 + 1),
+                        dtype=np.uint8)
+        rows[:, 1:] = pixels.reshape(pixels.shape[0], -1)
+        data = self.compressor.compress(rows.tobytes())
+        if data:
+            self.chunk(b'IDAT', data)
+
+    def close(self):
+        self.chunk(b'IDAT', self.compressor.flush())
+        self.chunk(b'IEND', b'')
+
+
+def layer_palette(colors):
+    """
+    Return the color of a pixel for every combination of the layers with
+    ``colors`` being present, indexed by a bit mask of the layers, with the
+    layers blended over the background in order.
+    """
+    palette = np.empty((1 << len(colors), 3), dtype=np.float64)
+    palette[:] = background
+    codes = np.arange(len(palette))
+    for n, color in enumerate(colors):
+        present = (codes >> n) & 1 == 1
+        palette[present] = (palette[present] * (1 - layer_alpha) +
+                            np.array(color) * layer_alpha)
+    return np.rint(palette).astype(np.uint8)
+
+
+def render_band(rasters, palette, r0, r1, width):
+    """
+    Return the RGB pixels of rows ``r0`` up to ``r1``, coloring each pixel
+    from ``palette`` by which of the layers in ``rasters`` cover it.
+    """
+    dtype = np.uint8 if len(rasters) <= 8 else np.uint16
+    codes = np.zeros((r1 - r0, width), dtype=dtype)
+    for n, raster in enumerate(rasters):
+        codes |= raster.render(r0, r1, width).astype(dtype) << n
+    return palette[codes]
+
+
+# Rasters held by each worker process, set once by ``init_worker()``.
+worker_rasters = None
+
+
+def init_worker(rasters, palette):
+    global worker_rasters
+    worker_rasters = rasters, palette
+
+
+def render_worker_band(r0, r1, width):
+    rasters, palette = worker_rasters
+    return render_band(rasters, palette, r0, r1, width)
+
+
+def parse_color(s):
+    return tuple(int(s[n:n + 2], 16) for n in (1, 3, 5))
+
+
+def write_preview(filename, layers, dpi=300, jobs=1):
+    """
+    Render the composited layers of the ``LayerSet`` ``layers`` to a PNG
+    image at ``dpi``, using up to ``jobs`` worker processes.
+    """
+    xmin, ymin, xmax, ymax = document_bounds(layers)
+    scale = dpi / (MM_PER_INCH * 10 ** 9)
+    width = max(1, int(np.ceil((xmax - xmin) * scale)))
+    height = max(1, int(np.ceil((ymax - ymin) * scale)))
+    log.debug('write_preview(%s): %dx%d pixels', filename, width, height)
+
+    rasters = []
+    for name, (base, extra) in layers.layers.items():
+        plane = layers.composite(base, extra)
+        if plane is not None and len(plane):
+            rasters.append(LayerRaster(plane, parse_color(layer_color(name)),
+                                       (xmin, ymax), scale))
+    # Pixels are colored by looking up the combination of layers covering
+    # them, which is only practical for so many layers.
+    if len(rasters) > max_layers:
+        log.warning('only previewing the first %d layers', max_layers)
+        del rasters[max_layers:]
+    palette = layer_palette([raster.color for raster in rasters])
+
+    bands = [(r0, min(r0 + band_rows, height))
+             for r0 in range(0, height, band_rows)]
+    with open(filename, 'wb') as f:
+        png = PNGWriter(f, width, height)
+        if jobs == 1 or len(bands) < 2:
+            for r0, r1 in bands:
+                png.write_rows(render_band(rasters, palette, r0, r1, width))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs,
+                                     initializer=init_worker,
+                                     initargs=(rasters, palette)) as executor:
+                # Keep only a few bands in flight, so finished bands do not
+                # pile up while an earlier one is still being rendered.
+                pending = deque()
+                for r0, r1 in bands:
+                    pending.append(executor.submit(render_worker_band, r0,
+                                                   r1, width))
+                    if len(pending) >= 2 * jobs:
+                        png.write_rows(pending.popleft().result())
+                while pending:
+                    png.write_rows(pending.popleft().result())
+        png.close()
+
+
+def changed_boxes(mask, r0):
+    """
+    Return ``(left, top, right, bottom)`` pixel boxes around each run of
+    columns containing changed pixels in ``mask``, whose first row is
+    ``r0``.
+    """
+    columns = np.flatnonzero(mask.any(axis=0))
+    if not len(columns):
+        return []
+    breaks = np.flatnonzero(np.diff(columns) > 1)
+    starts = np.concatenate([[columns[0]], columns[breaks + 1]])
+    ends = np.concatenate([columns[breaks], [columns[-1]]]) + 1
+    boxes = []
+    for c0, c1 in zip(starts, ends):
+        rows = np.flatnonzero(mask[:, c0:c1].any(axis=1))
+        boxes.append((int(c0), r0 + int(rows[0]), int(c1),
+                      r0 + int(rows[-1]) + 1))
+    return boxes
+
+
+def merge_boxes(boxes):
+    """
+    Merge boxes which overlap or touch, until none do.
+    """
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for n, other in enumerate(result):
+                if box[0] <= other[2] and other[0] <= box[2] and \
+                        box[1] <= other[3] and other[1] <= box[3]:
+                    result[n] = (min(box[0], other[0]), min(box[1], other[1]),
+                                 max(box[2], other[2]), max(box[3], other[3]))
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return boxes
+
+
+def diff_planes(a, b, dpi=1000):
+    """
+    Rasterize planes ``a`` and ``b`` at ``dpi`` and compare them. Return
+    ``(area, boxes)``: the area of the pixels which differ, in square
+    picometres, and ``(xmin, ymin, xmax, ymax)`` boxes in picometres around
+    each changed region.
+
+    Bands of rows which are affected by identical geometry in both planes
+    are skipped without being rendered.
+    """
+    boxes = [plane.bounding_box() for plane in (a, b)]
+    boxes = [box for box in boxes if box]
+    if not boxes:
+        return 0, []
+    xmin = min(box[0] for box in boxes)
+    ymin = min(box[1] for box in boxes)
+    xmax = max(box[2] for box in boxes)
+    ymax = max(box[3] for box in boxes)
+    scale = dpi / (MM_PER_INCH * 10 ** 9)
+    width = max(1, int(np.ceil((xmax - xmin) * scale)))
+    height = max(1, int(np.ceil((ymax - ymin) * scale)))
+    log.debug('diff_planes: %dx%d pixels', width, height)
+
+    rasters = [LayerRaster(plane, None, (xmin, ymax), scale)
+               for plane in (a, b)]
+    changed = 0
+    skipped = 0
+    pixel_boxes = []
+    for r0 in range(0, height, band_rows):
+        r1 = min(r0 + band_rows, height)
+        if rasters[0].band_key(r0, r1) == rasters[1].band_key(r0, r1):
+            skipped += 1
+            continue
+        mask = rasters[0].render(r0, r1, width) ^ \
+            rasters[1].render(r0, r1, width)
+        changed += int(np.count_nonzero(mask))
+        pixel_boxes.extend(changed_boxes(mask, r0))
+    log.debug('diff_planes: skipped %d identical bands of %d', skipped,
+              -(-height // band_rows))
+
+    pixel = 1 / scale
+    result = [(int(xmin + left * pixel), int(ymax - bottom * pixel),
+               int(xmin + right * pixel), int(ymax - top * pixel))
+              for left, top, right, bottom in merge_boxes(pixel_boxes)]
+    return int(changed * pixel * pixel), result
@@ -0,0 +1,749 @@
+"""
+SVG documents for a ``LayerSet``.
+
+Each layer is written as a pair of Inkscape layer groups: a *base* group with
+the geometry from the Gerber file, and an *extra* group for artwork. Base
+groups record the content key of the Gerber they were generated from, so that
+``update_document()`` can regenerate only the ones which changed. Design rule
+violations can be marked in a *drc* group per layer, which is replaced each
+time the rules are checked and ignored when the document is loaded.
+
+SVG user units are millimetres, with the y axis flipped relative to Gerber.
+"""
+import io
+import math
+import mmap
+import os
+import os.path
+import re
+import tempfile
+import logging
+import xml.etree.ElementTree as ET
+from itertools import compress
+from xml.sax.saxutils import escape, quoteattr
+
+from .files import replace_file
+from .gerber.apertures import Aperture
+from .gerber.coordinates import UNITS_PER_MM
+from .gerber.plane import (GraphicsPlane, DRAW, ARC, FLASH, REGION, DARK,
+                           CLOCKWISE)
+from .svgpath import (identity, multiply, parse_transform, transform_scale,
+                      shape_subpaths, length)
+
+log = logging.getLogger(__name__)
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+INKSCAPE_NS = 'http://www.inkscape.org/namespaces/inkscape'
+SODIPODI_NS = 'http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd'
+REGERBERATE_NS = 'http://github.com/storborg/regerberate'
+
+buffer_size = 1 << 20
+
+# Layer colors by Gerber file extension.
+layer_colors = {
+    '.cmp': '#c83737',
+    '.sol': '#3771c8',
+    '.plc': '#f2f2f2',
+    '.pls': '#f2f2f2',
+    '.stc': '#37c871',
+    '.sts': '#37c871',
+}
+
+default_color = '#808080'
+
+clear_color = '#ffffff'
+
+drc_color = '#ff00ff'
+
+# Radius of the circle marking a design rule violation, in picometres.
+drc_marker_radius = UNITS_PER_MM // 4
+
+# Fill or stroke colors which are read as clear polarity in extra layers.
+clear_colors = ('#fff', '#ffffff', 'white')
+
+shape_tags = ('path', 'rect', 'circle', 'ellipse', 'line', 'polygon',
+              'polyline')
+
+inherited_properties = ('fill', 'stroke', 'stroke-width')
+
+# A start tag for a base layer group, and any g start or end tag.
+base_group_re = re.compile(
+    br'<g\b[^>]*\bregerberate:role\s*=\s*["\']base["\'][^>]*>')
+drc_group_re = re.compile(
+    br'<g\b[^>]*\bregerberate:role\s*=\s*["\']drc["\'][^>]*>')
+group_tag_re = re.compile(br'<(/?)g\b[^>]*?(/?)>')
+attribute_re = re.compile(br'\b([\w:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+svg_end_re = re.compile(br'</svg\s*>\s*$')
+
+
+def format_mm(v):
+    """
+    Format a coordinate in picometres as millimetres, to 0.1 um.
+    """
+    s = '%.4f' % (v / UNITS_PER_MM)
+    s = s.rstrip('0').rstrip('.')
+    return '0' if s == '-0' else s
+
+
+def layer_id(role, name):
+    return role + '-' + re.sub(r'[^\w.-]', '_', name)
+
+
+def layer_color(name):
+    return layer_colors.get(os.path.splitext(name)[1].lower(), default_color)
+
+
+def document_bounds(layers):
+    """
+    Return the ``(xmin, ymin, xmax, ymax)`` extent of all base layers.
+    """
+    boxes = [base.bounding_box() for base, extra in layers.layers.values()
+             if base is not None]
+    boxes = [box for box in boxes if box]
+    if not boxes:
+        return 0, 0, 100 * UNITS_PER_MM, 100 * UNITS_PER_MM
+    return (min(box[0] for box in boxes), min(box[1] for box in boxes),
+            max(box[2] for box in boxes), max(box[3] for box in boxes))
+
+
+def write_header(f, layers):
+    xmin, ymin, xmax, ymax = document_bounds(layers)
+    width = format_mm(xmax - xmin)
+    height = format_mm(ymax - ymin)
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    f.write('<svg xmlns=%s xmlns:xlink=%s xmlns:inkscape=%s '
+            'xmlns:sodipodi=%s xmlns:regerberate=%s version="1.1" '
+            'width="%smm" height="%smm" viewBox="%s %s %s %s">\n' % (
+                quoteattr(SVG_NS), quoteattr(XLINK_NS),
+                quoteattr(INKSCAPE_NS), quoteattr(SODIPODI_NS),
+                quoteattr(REGERBERATE_NS), width, height, format_mm(xmin),
+                format_mm(-ymax), width, height))
+
+
+def polygon_d(points, dx=0, dy=0):
+    return 'M' + 'L'.join('%s %s' % (format_mm(x + dx), format_mm(-(y + dy)))
+                          for x, y in points) + 'Z'
+
+
+def stroke_width(aperture):
+    if aperture.diameter is not None:
+        return aperture.diameter
+    xmin, ymin, xmax, ymax = aperture.bbox
+    return min(xmax - xmin, ymax - ymin)
+
+
+def arc_d(x0, y0, x1, y1, cx, cy, clockwise):
+    """
+    Return SVG arc commands from the current point ``(x0, y0)`` to
+    ``(x1, y1)`` around ``(cx, cy)``.
+    """
+    r = math.hypot(x0 - cx, y0 - cy)
+    a0 = math.atan2(y0 - cy, x0 - cx)
+    a1 = math.atan2(y1 - cy, x1 - cx)
+    if clockwise:
+        sweep = (a0 - a1) % (2 * math.pi)
+    else:
+        sweep = (a1 - a0) % (2 * math.pi)
+    # The y axis is flipped, so counterclockwise in Gerber is the positive
+    # angle direction in SVG.
+    flag = 0 if clockwise else 1
+    radius = format_mm(r)
+    if (x0, y0) == (x1, y1):
+        # A full circle needs two half arcs.
+        mx = format_mm(2 * cx - x0)
+        my = format_mm(-(2 * cy - y0))
+        return 'A%s %s 0 0 %d %s %sA%s %s 0 0 %d %s %s' % (
+            radius, radius, flag, mx, my, radius, radius, flag,
+            format_mm(x1), format_mm(-y1))
+    return 'A%s %s 0 %d %d %s %s' % (radius, radius,
+                                     1 if sweep > math.pi else 0, flag,
+                                     format_mm(x1), format_mm(-y1))
+
+
+def write_symbols(f, plane, prefix):
+    """
+    Write a ``<symbol>`` for each aperture which is flashed in ``plane``.
+    """
+    flashed = set(compress(plane.aperture_numbers,
+                           [kind == FLASH for kind in plane.kinds]))
+    if not flashed:
+        return
+    f.write('<defs>\n')
+    for number in sorted(flashed):
+        f.write('<symbol id="%s-D%d" overflow="visible">' % (prefix, number))
+        for dark, points in plane.apertures[number].shapes:
+            if dark:
+                f.write('<path d="%s"/>' % polygon_d(points))
+            else:
+                f.write('<path d="%s" style="color:%s"/>' %
+                        (polygon_d(points), clear_color))
+        f.write('</symbol>\n')
+    f.write('</defs>\n')
+
+
+def write_base_geometry(f, plane, prefix):
+    """
+    Stream the primitives in ``plane`` to ``f``.
+
+    Each step and repeat block is written once, as a group, and its other
+    copies are ``<use>`` references to that group.
+    """
+    pos = 0
+    for n, (start, stop, x_count, y_count, x_step, y_step) in \
+            enumerate(plane.repeats):
+        write_primitives(f, plane, prefix, pos, start)
+        block_id = '%s-SR%d' % (prefix, n)
+        f.write('<g id="%s">\n' % block_id)
+        write_primitives(f, plane, prefix, start, stop)
+        f.write('</g>\n')
+        for j in range(y_count):
+            for i in range(x_count):
+                if i or j:
+                    f.write('<use xlink:href="#%s" x="%s" y="%s"/>\n' % (
+                        block_id, format_mm(i * x_step),
+                        format_mm(-j * y_step)))
+        pos = stop
+    write_primitives(f, plane, prefix, pos, len(plane))
+
+
+def write_primitives(f, plane, prefix, start, stop):
+    """
+    Stream the primitives in ``plane`` from ``start`` up to ``stop`` to
+    ``f``.
+
+    Runs of consecutive draws and arcs with the same aperture and polarity
+    are merged into a single ``<path>``, with colinear segments joined, and
+    flashes reference a shared ``<symbol>`` for their aperture.
+    """
+    write = f.write
+    apertures = plane.apertures
+    kinds = plane.kinds
+    flags = plane.flags
+    numbers = plane.aperture_numbers
+    x0s, y0s, x1s, y1s = plane.x0, plane.y0, plane.x1, plane.y1
+
+    run_key = None
+    parts = []
+    last_point = None
+    last_direction = None
+
+    def flush():
+        if parts:
+            aperture_number, dark = run_key
+            write('<path d="%s" style="fill:none;stroke:currentColor;'
+                  'stroke-width:%s%s"/>\n' % (
+                      ''.join(parts),
+                      format_mm(stroke_width(apertures[aperture_number])),
+                      '' if dark else ';color:' + clear_color))
+            del parts[:]
+
+    for index in range(start, stop):
+        kind = kinds[index]
+        dark = flags[index] & DARK
+        if kind == DRAW or kind == ARC:
+            key = numbers[index], dark
+            if key != run_key:
+                flush()
+                run_key = key
+                last_point = None
+            x0, y0, x1, y1 = x0s[index], y0s[index], x1s[index], y1s[index]
+            if (x0, y0) != last_point:
+                parts.append('M%s %s' % (format_mm(x0), format_mm(-y0)))
+                last_direction = None
+            if kind == DRAW:
+                dx = x1 - x0
+                dy = y1 - y0
+                segment = 'L%s %s' % (format_mm(x1), format_mm(-y1))
+                if (last_direction and
+                        dx * last_direction[1] == dy * last_direction[0] and
+                        dx * last_direction[0] + dy * last_direction[1] > 0):
+                    # Colinear continuation: extend the previous segment.
+                    parts[-1] = segment
+                else:
+                    parts.append(segment)
+                    last_direction = dx, dy
+            else:
+                parts.append(arc_d(x0, y0, x1, y1, plane.cx[index],
+                                   plane.cy[index],
+                                   flags[index] & CLOCKWISE))
+                last_direction = None
+            last_point = x1, y1
+            continue
+
+        flush()
+        run_key = None
+        style = '' if dark else ' style="color:%s"' % clear_color
+        if kind == FLASH:
+            write('<use xlink:href="#%s-D%d" x="%s" y="%s"%s/>\n' % (
+                prefix, numbers[index], format_mm(x0s[index]),
+                format_mm(-y0s[index]), style))
+        elif kind == REGION:
+            write('<path d="%s"%s/>\n' %
+                  (polygon_d(plane[index].vertices[:-1]), style))
+    flush()
+
+
+def write_base_group(f, name, plane, key=None, source=None):
+    prefix = layer_id('base', name)
+    attrs = ''
+    if key:
+        attrs += ' regerberate:hash=%s' % quoteattr(key)
+    if source:
+        attrs += ' regerberate:source=%s' % quoteattr(source)
+    f.write('<g id=%s inkscape:groupmode="layer" inkscape:label=%s '
+            'sodipodi:insensitive="true" regerberate:layer=%s '
+            'regerberate:role="base" style=%s%s>\n' % (
+                quoteattr(prefix), quoteattr(name + ' base'),
+                quoteattr(name),
+                quoteattr('color:%s;fill:currentColor;stroke:none;'
+                          'stroke-linecap:round;stroke-linejoin:round' %
+                          layer_color(name)),
+                attrs))
+    if plane is not None:
+        write_symbols(f, plane, prefix)
+        write_base_geometry(f, plane, prefix)
+    f.write('</g>\n')
+
+
+def write_extra_group(f, name):
+    f.write('<g id=%s inkscape:groupmode="layer" inkscape:label=%s '
+            'regerberate:layer=%s regerberate:role="extra" '
+            'style=%s>\n</g>\n' % (
+                quoteattr(layer_id('extra', name)),
+                quoteattr(name + ' extra'), quoteattr(name),
+                quoteattr('fill:%s' % layer_color(name))))
+
+
+def source_path(layers, name, filename):
+    """
+    Return the path of the Gerber for layer ``name``, relative to the SVG
+    file ``filename``.
+    """
+    if name not in layers.sources:
+        return None
+    source = layers.sources[name][0]
+    return os.path.relpath(source, os.path.dirname(os.path.abspath(filename)))
+
+
+def write_layer_group(f, layers, name, filename):
+    base, extra = layers.layers[name]
+    key = layers.sources.get(name, (None, None))[1]
+    write_base_group(f, name, base, key, source_path(layers, name, filename))
+
+
+def write_document(filename, layers):
+    """
+    Write a complete SVG document for ``layers``.
+    """
+    with io.open(filename, 'w', encoding='utf-8',
+                 buffering=buffer_size) as f:
+        write_header(f, layers)
+        for name in layers.layers:
+            write_layer_group(f, layers, name, filename)
+            write_extra_group(f, name)
+        f.write('</svg>\n')
+
+
+def group_end(buf, start):
+    """
+    Return the offset just past the ``</g>`` closing the group whose start
+    tag ends at ``start``.
+    """
+    depth = 1
+    for m in group_tag_re.finditer(buf, start):
+        closing, empty = m.groups()
+        if closing:
+            depth -= 1
+            if depth == 0:
+                return m.end()
+        elif not empty:
+            depth += 1
+    raise ValueError('unterminated layer group')
+
+
+def tag_attributes(tag):
+    return dict((name.decode('utf-8'),
+                 (double if double is not None else single).decode('utf-8'))
+                for name, double, single in attribute_re.findall(tag))
+
+
+def document_keys(filename):
+    """
+    Return the content keys recorded in the base layer groups of the SVG
+    document ``filename``, by layer name, without parsing the document.
+    """
+    keys = {}
+    with open(filename, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for m in base_group_re.finditer(buf):
+            attrs = tag_attributes(m.group())
+            name = attrs.get('regerberate:layer')
+            key = attrs.get('regerberate:hash')
+            if name and key:
+                keys[name] = key
+    finally:
+        buf.close()
+    return keys
+
+
+def update_document(filename, layers):
+    """
+    Update an existing SVG document in place.
+
+    Base layer groups whose recorded content key matches the current layer
+    are copied through unchanged, as is everything outside the base groups,
+    including the extra layers. Other base groups in ``layers`` are
+    regenerated, and layers which are not in the document yet are added at
+    the end.
+    """
+    with open(filename, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(
+        os.path.abspath(filename)), suffix='.tmp')
+    try:
+        with io.open(fd, 'w', encoding='utf-8', buffering=buffer_size,
+                     newline='') as out:
+            pos = 0
+            seen = set()
+
+            def copy(start, end):
+                out.flush()
+                out.buffer.write(buf[start:end])
+
+            for m in base_group_re.finditer(buf):
+                if m.start() < pos:
+                    continue
+                attrs = tag_attributes(m.group())
+                name = attrs.get('regerberate:layer')
+                end = group_end(buf, m.end())
+                if buf[end:end + 1] == b'\n':
+                    end += 1
+                copy(pos, m.start())
+                pos = end
+                key = layers.sources.get(name, (None, None))[1]
+                if (name not in layers.layers or
+                        attrs.get('regerberate:hash') == key):
+                    copy(m.start(), end)
+                else:
+                    write_layer_group(out, layers, name, filename)
+                seen.add(name)
+
+            tail = svg_end_re.search(buf, pos)
+            if tail is None:
+                raise ValueError('%s is not a complete SVG document' %
+                                 filename)
+            copy(pos, tail.start())
+            for name in layers.layers:
+                if name not in seen:
+                    write_layer_group(out, layers, name, filename)
+                    write_extra_group(out, name)
+            copy(tail.start(), len(buf))
+        replace_file(tmp_path, filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    finally:
+        buf.close()
+
+
+def write_drc_group(f, name, violations):
+    """
+    Write a group marking each of ``violations`` of layer ``name`` with a
+    circle, and a line across the gap or feature which is too small.
+    """
+    f.write('<g id=%s inkscape:groupmode="layer" inkscape:label=%s '
+            'sodipodi:insensitive="true" regerberate:layer=%s '
+            'regerberate:role="drc" style=%s>\n' % (
+                quoteattr(layer_id('drc', name)),
+                quoteattr(name + ' drc'), quoteattr(name),
+                quoteattr('fill:none;stroke:%s;stroke-width:0.05' %
+                          drc_color)))
+    for v in violations:
+        x = (v.x0 + v.x1) // 2
+        y = (v.y0 + v.y1) // 2
+        f.write('<circle cx="%s" cy="%s" r="%s"><title>%s</title>'
+                '</circle>\n' % (format_mm(x), format_mm(-y),
+                                 format_mm(drc_marker_radius),
+                                 escape(v.describe())))
+        if (v.x0, v.y0) != (v.x1, v.y1):
+            f.write('<path d="M%s %sL%s %s"/>\n' % (
+                format_mm(v.x0), format_mm(-v.y0), format_mm(v.x1),
+                format_mm(-v.y1)))
+    f.write('</g>\n')
+
+
+def write_drc_overlay(filename, violations):
+    """
+    Replace the drc groups of an existing SVG document with ones marking
+    ``violations``, a mapping of layer name to a list of ``Violation``, in
+    place. Layers without violations get no group.
+    """
+    with open(filename, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(
+        os.path.abspath(filename)), suffix='.tmp')
+    try:
+        with io.open(fd, 'w', encoding='utf-8', buffering=buffer_size,
+                     newline='') as out:
+            pos = 0
+
+            def copy(start, end):
+                out.flush()
+                out.buffer.write(buf[start:end])
+
+            for m in drc_group_re.finditer(buf):
+                if m.start() < pos:
+                    continue
+                end = group_end(buf, m.end())
+                if buf[end:end + 1] == b'\n':
+                    end += 1
+                copy(pos, m.start())
+                pos = end
+
+            tail = svg_end_re.search(buf, pos)
+            if tail is None:
+                raise ValueError('%s is not a complete SVG document' %
+                                 filename)
+            copy(pos, tail.start())
+            for name, layer_violations in violations.items():
+                if layer_violations:
+                    write_drc_group(out, name, layer_violations)
+            copy(tail.start(), len(buf))
+        replace_file(tmp_path, filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    finally:
+        buf.close()
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def element_style(attrib, parent):
+    """
+    Resolve the inherited paint properties of an element, from its
+    presentation attributes and ``style`` attribute.
+    """
+    style = dict(parent)
+    for name in inherited_properties:
+        if name in attrib:
+            style[name] = attrib[name].strip()
+    if attrib.get('display', '').strip() == 'none':
+        style['display'] = 'none'
+    for declaration in attrib.get('style', '').split(';'):
+        if ':' in declaration:
+            name, value = declaration.split(':', 1)
+            name = name.strip()
+            if name in inherited_properties or name == 'display':
+                style[name] = value.strip()
+    return style
+
+
+def paint(value):
+    """
+    Classify a fill or stroke value as ``None`` (no paint), ``'clear'`` or
+    ``'dark'``.
+    """
+    value = (value or '').lower()
+    if not value or value == 'none' or value == 'transparent':
+        return None
+    if value in clear_colors:
+        return 'clear'
+    return 'dark'
+
+
+def signed_area(xs, ys):
+    n = len(xs)
+    return sum(xs[i] * ys[(i + 1) % n] - xs[(i + 1) % n] * ys[i]
+               for i in range(n)) / 2.0
+
+
+def point_in_contour(x, y, xs, ys):
+    inside = False
+    n = len(xs)
+    j = n - 1
+    for i in range(n):
+        if ((ys[i] > y) != (ys[j] > y)) and \
+                (x < (xs[j] - xs[i]) * (y - ys[i]) / (ys[j] - ys[i]) + xs[i]):
+            inside = not inside
+        j = i
+    return inside
+
+
+def bridge_holes(contours):
+    """
+    Join hole contours (wound opposite to the outer contour containing them)
+    into that contour with a cut-in, since a Gerber region is a single
+    contour.
+    """
+    if len(contours) < 2:
+        return contours
+    areas = [signed_area(xs, ys) for xs, ys in contours]
+    outer_sign = areas[max(range(len(areas)), key=lambda i: abs(areas[i]))]
+    outers = []
+    holes = []
+    for contour, area in zip(contours, areas):
+        if (area > 0) == (outer_sign > 0):
+            outers.append([list(contour[0]), list(contour[1])])
+        else:
+            holes.append(contour)
+    for hxs, hys in holes:
+        for outer in outers:
+            oxs, oys = outer
+            if point_in_contour(hxs[0], hys[0], oxs, oys):
+                # Bridge from the hole's rightmost vertex to the nearest outer
+                # vertex, and back again after tracing the hole.
+                h = max(range(len(hxs)), key=hxs.__getitem__)
+                o = min(range(len(oxs)), key=lambda i: (oxs[i] - hxs[h]) ** 2 +
+                        (oys[i] - hys[h]) ** 2)
+                ring_x = list(hxs[h:]) + list(hxs[:h + 1])
+                ring_y = list(hys[h:]) + list(hys[:h + 1])
+                outer[0] = oxs[:o + 1] + ring_x + oxs[o:]
+                outer[1] = oys[:o + 1] + ring_y + oys[o:]
+                break
+        else:
+            outers.append([list(hxs), list(hys)])
+    return [(xs, ys) for xs, ys in outers]
+
+
+class ExtraLayerBuilder(object):
+    """
+    Accumulates the shapes of an extra layer into a ``GraphicsPlane``.
+    Filled shapes become regions, and stroked shapes become draws with a
+    circular aperture of the stroke width.
+    """
+    def __init__(self):
+        self.plane = GraphicsPlane()
+        self.stroke_apertures = {}
+
+    def aperture_for(self, width):
+        width = round(width, 4)
+        number = self.stroke_apertures.get(width)
+        if number is None:
+            number = 10 + len(self.stroke_apertures)
+            self.stroke_apertures[width] = number
+            self.plane.apertures[number] = Aperture.define(
+                number, 'C', '%.4f' % width, 'MM', {})
+        return number
+
+    def add_shape(self, subpaths, matrix, style):
+        fill = paint(style.get('fill', 'black'))
+        stroke = paint(style.get('stroke'))
+        a, b, c, d, e, f = matrix
+        scale = UNITS_PER_MM
+
+        def convert(sub):
+            xs = sub.xs
+            ys = sub.ys
+            return ([int(round((a * x + c * y + e) * scale))
+                     for x, y in zip(xs, ys)],
+                    [-int(round((b * x + d * y + f) * scale))
+                     for x, y in zip(xs, ys)])
+
+        contours = [convert(sub) for sub in subpaths]
+        if fill:
+            closed = [(xs, ys) for xs, ys in contours if len(xs) >= 3]
+            for xs, ys in bridge_holes(closed):
+                if (xs[0], ys[0]) != (xs[-1], ys[-1]):
+                    xs.append(xs[0])
+                    ys.append(ys[0])
+                self.plane.add_region(xs, ys, fill == 'dark')
+
+        width = length(style.get('stroke-width'), 1.0) * \
+            transform_scale(matrix)
+        if stroke and width > 0:
+            number = self.aperture_for(width)
+            dark = stroke == 'dark'
+            for sub, (xs, ys) in zip(subpaths, contours):
+                if sub.closed and (xs[0], ys[0]) != (xs[-1], ys[-1]):
+                    xs.append(xs[0])
+                    ys.append(ys[0])
+                for i in range(1, len(xs)):
+                    self.plane.add_draw(xs[i - 1], ys[i - 1], xs[i], ys[i],
+                                        number, dark)
+
+
+def root_matrix(attrib):
+    """
+    Return the transform from the root element's user units to millimetres.
+    """
+    view_box = [float(v) for v in
+                attrib.get('viewBox', '').replace(',', ' ').split()]
+    width = attrib.get('width', '').strip()
+    if len(view_box) == 4 and view_box[2] and width.endswith('mm'):
+        scale = length(width) / view_box[2]
+        return (scale, 0.0, 0.0, scale, 0.0, 0.0)
+    return identity
+
+
+def load_document(filename, layers):
+    """
+    Load the layers of an SVG document into the ``LayerSet`` ``layers``.
+
+    The document is read incrementally, and elements are discarded as soon
+    as they have been consumed, so memory use does not grow with the size of
+    the file. Base layers are re-read from the Gerber files they were
+    generated from, and only the contents of extra layers are converted.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    role_attr = '{%s}role' % REGERBERATE_NS
+    layer_attr = '{%s}layer' % REGERBERATE_NS
+    source_attr = '{%s}source' % REGERBERATE_NS
+
+    # Stack entries are (element, matrix, style, builder or None, skip).
+    stack = []
+    extras = {}
+    for event, elem in ET.iterparse(filename, events=('start', 'end')):
+        if event == 'start':
+            tag = local_name(elem.tag)
+            if not stack:
+                stack.append((elem, root_matrix(elem.attrib), {}, None,
+                              False))
+                continue
+            parent, matrix, style, builder, skip = stack[-1]
+            if not skip:
+                role = elem.get(role_attr)
+                if role == 'base':
+                    name = elem.get(layer_attr)
+                    source = elem.get(source_attr)
+                    if source:
+                        layers.update_from_gerber(
+                            os.path.join(directory, source))
+                    else:
+                        log.warning('base layer %s has no source', name)
+                    skip = True
+                elif role == 'extra':
+                    name = elem.get(layer_attr)
+                    builder = extras.setdefault(name, ExtraLayerBuilder())
+                elif role == 'drc':
+                    skip = True
+                elif tag not in ('svg', 'g') + shape_tags or \
+                        builder is None:
+                    # Definitions, images, text and anything outside the
+                    # layers we know about are not needed.
+                    skip = tag not in ('svg', 'g')
+                matrix = multiply(matrix, parse_transform(
+                    elem.get('transform')))
+                style = element_style(elem.attrib, style)
+                if style.get('display') == 'none':
+                    skip = True
+            stack.append((elem, matrix, style, builder, skip))
+        else:
+            elem, matrix, style, builder, skip = stack.pop()
+            tag = local_name(elem.tag)
+            if not skip and builder is not None and tag in shape_tags:
+                builder.add_shape(shape_subpaths(tag, elem.attrib), matrix,
+                                  style)
+            elem.clear()
+            if stack:
+                stack[-1][0].remove(elem)
+
+    for name, builder in extras.items():
+        plane = builder.plane if len(builder.plane) else None
+        base = layers.layers.get(name, (None, None))[0]
+        layers.layers[name] = base, plane
+    return layers
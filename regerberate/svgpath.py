@@ -0,0 +1,327 @@
+"""
+Parsing of SVG path data, shapes and transforms into flattened polylines.
+"""
+import math
+import re
+from array import array
+
+# Number of line segments each curve is flattened into.
+curve_segments = 16
+
+path_token_re = re.compile(
+    r'[MmLlHhVvCcSsQqTtAaZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+number_re = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+transform_re = re.compile(r'(matrix|translate|scale|rotate|skewX|skewY)'
+                          r'\s*\(([^)]*)\)')
+
+identity = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+# Number of arguments taken by each path command.
+command_arity = {
+    'M': 2, 'L': 2, 'H': 1, 'V': 1, 'C': 6, 'S': 4, 'Q': 4, 'T': 2, 'A': 7,
+    'Z': 0,
+}
+
+
+def multiply(a, b):
+    """
+    Compose two affine transforms ``(a, b, c, d, e, f)``, applying ``b``
+    first.
+    """
+    a0, a1, a2, a3, a4, a5 = a
+    b0, b1, b2, b3, b4, b5 = b
+    return (a0 * b0 + a2 * b1, a1 * b0 + a3 * b1,
+            a0 * b2 + a2 * b3, a1 * b2 + a3 * b3,
+            a0 * b4 + a2 * b5 + a4, a1 * b4 + a3 * b5 + a5)
+
+
+def parse_transform(s):
+    """
+    Parse an SVG ``transform`` attribute into an affine transform.
+    """
+    m = identity
+    for name, args in transform_re.findall(s or ''):
+        values = [float(v) for v in number_re.findall(args)]
+        if name == 'matrix':
+            t = tuple(values[:6])
+        elif name == 'translate':
+            t = (1.0, 0.0, 0.0, 1.0, values[0],
+                 values[1] if len(values) > 1 else 0.0)
+        elif name == 'scale':
+            sy = values[1] if len(values) > 1 else values[0]
+            t = (values[0], 0.0, 0.0, sy, 0.0, 0.0)
+        elif name == 'rotate':
+            theta = math.radians(values[0])
+            c = math.cos(theta)
+            s = math.sin(theta)
+            t = (c, s, -s, c, 0.0, 0.0)
+            if len(values) == 3:
+                cx, cy = values[1], values[2]
+                t = multiply(multiply((1.0, 0.0, 0.0, 1.0, cx, cy), t),
+                             (1.0, 0.0, 0.0, 1.0, -cx, -cy))
+        elif name == 'skewX':
+            t = (1.0, 0.0, math.tan(math.radians(values[0])), 1.0, 0.0, 0.0)
+        else:
+            t = (1.0, math.tan(math.radians(values[0])), 0.0, 1.0, 0.0, 0.0)
+        m = multiply(m, t)
+    return m
+
+
+def transform_scale(m):
+    """
+    Return the mean scale factor of a transform, used for stroke widths.
+    """
+    return math.sqrt(abs(m[0] * m[3] - m[1] * m[2]))
+
+
+class Subpath(object):
+    """
+    A flattened subpath, with its coordinates in two ``array('d')``.
+    """
+    __slots__ = ('xs', 'ys', 'closed')
+
+    def __init__(self, x, y):
+        self.xs = array('d', [x])
+        self.ys = array('d', [y])
+        self.closed = False
+
+    def line_to(self, x, y):
+        self.xs.append(x)
+        self.ys.append(y)
+
+
+def cubic(sub, x0, y0, x1, y1, x2, y2, x3, y3):
+    for n in range(1, curve_segments + 1):
+        t = n / curve_segments
+        u = 1 - t
+        sub.line_to(u * u * u * x0 + 3 * u * u * t * x1 +
+                    3 * u * t * t * x2 + t * t * t * x3,
+                    u * u * u * y0 + 3 * u * u * t * y1 +
+                    3 * u * t * t * y2 + t * t * t * y3)
+
+
+def quadratic(sub, x0, y0, x1, y1, x2, y2):
+    for n in range(1, curve_segments + 1):
+        t = n / curve_segments
+        u = 1 - t
+        sub.line_to(u * u * x0 + 2 * u * t * x1 + t * t * x2,
+                    u * u * y0 + 2 * u * t * y1 + t * t * y2)
+
+
+def elliptical_arc(sub, x0, y0, rx, ry, phi, large, sweep, x1, y1):
+    """
+    Flatten an SVG endpoint-parameterized elliptical arc (SVG 1.1 F.6.5).
+    """
+    if (x0, y0) == (x1, y1):
+        return
+    rx = abs(rx)
+    ry = abs(ry)
+    if not rx or not ry:
+        sub.line_to(x1, y1)
+        return
+    phi = math.radians(phi)
+    cos_phi = math.cos(phi)
+    sin_phi = math.sin(phi)
+    dx = (x0 - x1) / 2.0
+    dy = (y0 - y1) / 2.0
+    x1p = cos_phi * dx + sin_phi * dy
+    y1p = -sin_phi * dx + cos_phi * dy
+    scale = (x1p * x1p) / (rx * rx) + (y1p * y1p) / (ry * ry)
+    if scale > 1:
+        rx *= math.sqrt(scale)
+        ry *= math.sqrt(scale)
+    numerator = rx * rx * ry * ry - rx * rx * y1p * y1p - ry * ry * x1p * x1p
+    denominator = rx * rx * y1p * y1p + ry * ry * x1p * x1p
+    coefficient = math.sqrt(max(numerator, 0) / denominator)
+    if large == sweep:
+        coefficient = -coefficient
+    cxp = coefficient * rx * y1p / ry
+    cyp = -coefficient * ry * x1p / rx
+    cx = cos_phi * cxp - sin_phi * cyp + (x0 + x1) / 2.0
+    cy = sin_phi * cxp + cos_phi * cyp + (y0 + y1) / 2.0
+    theta = math.atan2((y1p - cyp) / ry, (x1p - cxp) / rx)
+    delta = math.atan2((-y1p - cyp) / ry, (-x1p - cxp) / rx) - theta
+    if sweep and delta < 0:
+        delta += 2 * math.pi
+    elif not sweep and delta > 0:
+        delta -= 2 * math.pi
+    for n in range(1, curve_segments + 1):
+        angle = theta + delta * n / curve_segments
+        x = rx * math.cos(angle)
+        y = ry * math.sin(angle)
+        sub.line_to(cos_phi * x - sin_phi * y + cx,
+                    sin_phi * x + cos_phi * y + cy)
+
+
+def parse_path(d):
+    """
+    Parse SVG path data into a list of flattened ``Subpath`` instances.
+    """
+    tokens = path_token_re.findall(d)
+    subpaths = []
+    sub = None
+    x = y = 0.0
+    start_x = start_y = 0.0
+    # Last control point, for smooth curve commands.
+    control = None
+    command = None
+    pos = 0
+    n = len(tokens)
+    while pos < n:
+        token = tokens[pos]
+        if token.isalpha():
+            command = token
+            pos += 1
+        elif command is None:
+            raise ValueError('path data must start with a command')
+        upper = command.upper()
+        relative = command != upper
+        arity = command_arity[upper]
+        args = [float(v) for v in tokens[pos:pos + arity]]
+        if len(args) != arity or any(v.isalpha()
+                                     for v in tokens[pos:pos + arity]):
+            raise ValueError('invalid path data near %r' % token)
+        pos += arity
+
+        if upper == 'Z':
+            if sub is not None:
+                sub.closed = True
+            x, y = start_x, start_y
+            sub = None
+            control = None
+            continue
+
+        if relative:
+            if upper == 'H':
+                args[0] += x
+            elif upper == 'V':
+                args[0] += y
+            elif upper == 'A':
+                args[5] += x
+                args[6] += y
+            else:
+                args = [v + (y if i % 2 else x) for i, v in enumerate(args)]
+
+        if upper == 'M':
+            x, y = args
+            start_x, start_y = x, y
+            sub = Subpath(x, y)
+            subpaths.append(sub)
+            control = None
+            # Further coordinate pairs are implicit line commands.
+            command = 'l' if relative else 'L'
+            continue
+
+        if sub is None:
+            sub = Subpath(x, y)
+            subpaths.append(sub)
+
+        if upper == 'L':
+            x, y = args
+            sub.line_to(x, y)
+            control = None
+        elif upper == 'H':
+            x = args[0]
+            sub.line_to(x, y)
+            control = None
+        elif upper == 'V':
+            y = args[0]
+            sub.line_to(x, y)
+            control = None
+        elif upper == 'C':
+            cubic(sub, x, y, *args)
+            control = ('C', args[2], args[3])
+            x, y = args[4], args[5]
+        elif upper == 'S':
+            if control and control[0] == 'C':
+                x1, y1 = 2 * x - control[1], 2 * y - control[2]
+            else:
+                x1, y1 = x, y
+            cubic(sub, x, y, x1, y1, *args)
+            control = ('C', args[0], args[1])
+            x, y = args[2], args[3]
+        elif upper == 'Q':
+            quadratic(sub, x, y, *args)
+            control = ('Q', args[0], args[1])
+            x, y = args[2], args[3]
+        elif upper == 'T':
+            if control and control[0] == 'Q':
+                x1, y1 = 2 * x - control[1], 2 * y - control[2]
+            else:
+                x1, y1 = x, y
+            quadratic(sub, x, y, x1, y1, *args)
+            control = ('Q', x1, y1)
+            x, y = args
+        elif upper == 'A':
+            elliptical_arc(sub, x, y, *args)
+            control = None
+            x, y = args[5], args[6]
+    return subpaths
+
+
+def ellipse_subpath(cx, cy, rx, ry):
+    segments = 4 * curve_segments
+    sub = Subpath(cx + rx, cy)
+    for n in range(1, segments + 1):
+        angle = 2 * math.pi * n / segments
+        sub.line_to(cx + rx * math.cos(angle), cy + ry * math.sin(angle))
+    sub.closed = True
+    return sub
+
+
+def points_subpath(s, closed):
+    values = [float(v) for v in number_re.findall(s or '')]
+    if len(values) < 2:
+        return []
+    sub = Subpath(values[0], values[1])
+    for i in range(2, len(values) - 1, 2):
+        sub.line_to(values[i], values[i + 1])
+    sub.closed = closed
+    return [sub]
+
+
+def length(s, default=0.0):
+    m = number_re.match((s or '').strip())
+    return float(m.group()) if m else default
+
+
+def shape_subpaths(tag, attrib):
+    """
+    Return flattened subpaths for an SVG shape element, given its local tag
+    name and attributes.
+    """
+    get = attrib.get
+    if tag == 'path':
+        return parse_path(get('d', ''))
+    elif tag == 'rect':
+        x, y = length(get('x')), length(get('y'))
+        w, h = length(get('width')), length(get('height'))
+        if w <= 0 or h <= 0:
+            return []
+        sub = Subpath(x, y)
+        sub.line_to(x + w, y)
+        sub.line_to(x + w, y + h)
+        sub.line_to(x, y + h)
+        sub.closed = True
+        return [sub]
+    elif tag == 'circle':
+        r = length(get('r'))
+        if r <= 0:
+            return []
+        return [ellipse_subpath(length(get('cx')), length(get('cy')), r, r)]
+    elif tag == 'ellipse':
+        rx, ry = length(get('rx')), length(get('ry'))
+        if rx <= 0 or ry <= 0:
+            return []
+        return [ellipse_subpath(length(get('cx')), length(get('cy')), rx, ry)]
+    elif tag == 'line':
+        sub = Subpath(length(get('x1')), length(get('y1')))
+        sub.line_to(length(get('x2')), length(get('y2')))
+        return [sub]
+    elif tag == 'polygon':
+        return points_subpath(get('points'), True)
+    elif tag == 'polyline':
+        return points_subpath(get('points'), False)
+    return []
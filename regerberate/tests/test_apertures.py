@@ -0,0 +1,144 @@
+import math
+from unittest import TestCase
+
+from ..gerber.apertures import (Aperture, MacroTemplate, compile_expression,
+                                parse_modifiers)
+from .util import mm
+
+
+def polygon_area(points):
+    return sum(points[i - 1][0] * points[i][1] - points[i][0] *
+               points[i - 1][1] for i in range(len(points))) / 2.0
+
+
+class TestExpressions(TestCase):
+    def evaluate(self, s, **variables):
+        return compile_expression(s)(dict((int(name[1:]), value)
+                                          for name, value
+                                          in variables.items()))
+
+    def test_precedence(self):
+        self.assertEqual(self.evaluate('1+2x3'), 7)
+        self.assertEqual(self.evaluate('(1+2)X3'), 9)
+        self.assertEqual(self.evaluate('8/2/2'), 2)
+        self.assertEqual(self.evaluate('10-2-3'), 5)
+
+    def test_unary(self):
+        self.assertEqual(self.evaluate('-2x-3'), 6)
+        self.assertEqual(self.evaluate('+.5'), 0.5)
+
+    def test_variables(self):
+        self.assertEqual(self.evaluate('$1x2+$2', v1=1.5, v2=1), 4)
+        # Undefined variables are zero.
+        self.assertEqual(self.evaluate('$3+1'), 1)
+
+    def test_constants_are_folded(self):
+        self.assertEqual(compile_expression('(1+2)x3').constant, 9)
+        self.assertFalse(hasattr(compile_expression('$1+2'), 'constant'))
+
+    def test_errors(self):
+        for s in ('', '1+', '(1', '1)', '2 $', 'a'):
+            with self.assertRaises(ValueError):
+                compile_expression(s)
+
+
+class TestMacroTemplate(TestCase):
+    def test_comments_and_assignment(self):
+        template = MacroTemplate('T', '0 a comment*$3=$1x2*'
+                                 '21,1,$3,$2,0,0,0')
+        [(dark, points)] = template.evaluate([1.0, 0.5])
+        self.assertTrue(dark)
+        xs = [x for x, y in points]
+        ys = [y for x, y in points]
+        self.assertEqual((min(xs), max(xs)), (-1, 1))
+        self.assertEqual((min(ys), max(ys)), (-0.25, 0.25))
+
+    def test_exposure_off_cuts_hole(self):
+        template = MacroTemplate('DONUT', '1,1,$1,0,0*1,0,$2,0,0')
+        shapes = template.evaluate([2.0, 1.0])
+        self.assertEqual([dark for dark, points in shapes], [True, False])
+
+    def test_outline_drops_closing_point_and_rotates(self):
+        template = MacroTemplate('TRI', '4,1,3,0,0,1,0,0,1,0,0,90')
+        [(dark, points)] = template.evaluate([])
+        self.assertEqual(len(points), 3)
+        for (x, y), (ex, ey) in zip(points, [(0, 0), (0, 1), (-1, 0)]):
+            self.assertAlmostEqual(x, ex)
+            self.assertAlmostEqual(y, ey)
+
+    def test_polygon(self):
+        template = MacroTemplate('HEX', '5,1,6,0,0,2,0')
+        [(dark, points)] = template.evaluate([])
+        self.assertEqual(len(points), 6)
+        self.assertAlmostEqual(points[0][0], 1)
+
+    def test_thermal(self):
+        template = MacroTemplate('TH', '7,0,0,2,1,0.2,0')
+        shapes = template.evaluate([])
+        self.assertEqual([dark for dark, points in shapes], [True] * 4)
+        # Each piece lies in its own quadrant, clear of the gaps.
+        for dark, points in shapes:
+            self.assertTrue(all(abs(x) >= 0.1 - 1e-9 and abs(y) >= 0.1 - 1e-9
+                                for x, y in points))
+        ring = math.pi * (1 - 0.25)
+        area = sum(polygon_area(points) for dark, points in shapes)
+        # Less four gaps of 0.2 by about the width of the ring.
+        self.assertAlmostEqual(area, ring - 4 * 0.2 * 0.5, delta=0.02)
+
+    def test_thermal_gaps_meet_inside(self):
+        template = MacroTemplate('TH', '7,0,0,2,0.2,0.6,0')
+        for dark, points in template.evaluate([]):
+            self.assertIn((0.3, 0.3), [(round(abs(x), 9), round(abs(y), 9))
+                                       for x, y in points])
+
+    def test_moire_is_all_dark(self):
+        template = MacroTemplate('MO', '6,0,0,2,0.2,0.2,3,0.05,2.2,0')
+        shapes = template.evaluate([])
+        self.assertTrue(all(dark for dark, points in shapes))
+        # Three rings of two halves each, and the crosshair.
+        self.assertEqual(len(shapes), 3 * 2 + 2)
+
+    def test_unknown_primitive(self):
+        with self.assertRaises(ValueError):
+            MacroTemplate('BAD', '9,1,2,3')
+
+
+class TestApertureDefine(TestCase):
+    templates = {'DONUT': MacroTemplate('DONUT', '1,1,$1,0,0*1,0,$2,0,0')}
+
+    def test_standard_with_hole(self):
+        aperture = Aperture.define(10, 'R', '2X1X0.5', 'MM', {})
+        self.assertEqual(aperture.bbox, (-mm(1), -mm(0.5), mm(1), mm(0.5)))
+        self.assertEqual([dark for dark, points in aperture.shapes],
+                         [True, False])
+        self.assertIsNone(aperture.macro)
+        self.assertIsNone(aperture.diameter)
+
+    def test_circle_diameter(self):
+        aperture = Aperture.define(10, 'C', '0.5', 'MM', {})
+        self.assertEqual(aperture.diameter, mm(0.5))
+
+    def test_macro_in_inches(self):
+        aperture = Aperture.define(11, 'DONUT', '0.1X0.05', 'IN',
+                                   self.templates)
+        self.assertEqual(aperture.macro, '1,1,$1,0,0*1,0,$2,0,0')
+        self.assertAlmostEqual(aperture.bbox[2], mm(1.27), delta=1)
+        outer = polygon_area(aperture.shapes[0][1])
+        inner = polygon_area(aperture.shapes[1][1])
+        self.assertAlmostEqual(outer / inner, 4, places=6)
+
+    def test_undefined_macro(self):
+        with self.assertRaises(AssertionError):
+            Aperture.define(12, 'MISSING', '1', 'MM', self.templates)
+
+    def test_record_round_trip(self):
+        aperture = Aperture.define(11, 'DONUT', '1X0.5', 'MM',
+                                   self.templates)
+        copy = Aperture.from_record(aperture.to_record())
+        for name in ('number', 'template_name', 'modifiers', 'unit', 'macro',
+                     'shapes', 'bbox'):
+            self.assertEqual(getattr(copy, name), getattr(aperture, name))
+
+    def test_parse_modifiers(self):
+        self.assertEqual(parse_modifiers('0.06X.04'), [0.06, 0.04])
+        self.assertEqual(parse_modifiers(None), [])
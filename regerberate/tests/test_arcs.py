@@ -0,0 +1,88 @@
+import math
+from unittest import TestCase
+
+from ..gerber.arcs import (arc_points, arc_sweep, segment_count,
+                           single_quadrant_center)
+from ..gerber.plane import ARC, DRAW, CLOCKWISE
+from .util import mm, parse_gerber
+
+
+class TestSweep(TestCase):
+    def test_directions(self):
+        self.assertAlmostEqual(arc_sweep(1, 0, 0, 1, 0, 0, False),
+                               math.pi / 2)
+        self.assertAlmostEqual(arc_sweep(1, 0, 0, 1, 0, 0, True),
+                               -3 * math.pi / 2)
+
+    def test_full_circle(self):
+        self.assertAlmostEqual(arc_sweep(1, 0, 1, 0, 0, 0, False),
+                               2 * math.pi)
+        self.assertAlmostEqual(arc_sweep(1, 0, 1, 0, 0, 0, True),
+                               -2 * math.pi)
+
+
+class TestSingleQuadrantCenter(TestCase):
+    def test_each_quadrant(self):
+        # A quarter circle of radius 10 in each quadrant, counterclockwise,
+        # with unsigned offsets; the centre is the origin each time.
+        for x0, y0, x1, y1 in ((10, 0, 0, 10), (0, 10, -10, 0),
+                               (-10, 0, 0, -10), (0, -10, 10, 0)):
+            self.assertEqual(single_quadrant_center(
+                x0, y0, x1, y1, abs(x0), abs(y0), False), (0, 0))
+            # The same arc, clockwise, from its other end.
+            self.assertEqual(single_quadrant_center(
+                x1, y1, x0, y0, abs(x1), abs(y1), True), (0, 0))
+
+    def test_short_arc_is_chosen(self):
+        # Both (0, 0) and (10, 10) are 10 from each end; the direction
+        # decides which of them gives an arc of at most 90 degrees.
+        cx, cy = single_quadrant_center(0, 10, 10, 0, 0, 10, True)
+        self.assertEqual((cx, cy), (0, 0))
+        cx, cy = single_quadrant_center(0, 10, 10, 0, 10, 0, False)
+        self.assertEqual((cx, cy), (10, 10))
+
+
+class TestFlattening(TestCase):
+    def test_segment_count(self):
+        self.assertEqual(segment_count(10, math.pi, 20), 1)
+        tolerance = 1000
+        radius = 10 ** 6
+        n = segment_count(radius, 2 * math.pi, tolerance)
+        # Each chord's sagitta is within the tolerance, and one chord
+        # fewer would not be.
+        self.assertLessEqual(radius * (1 - math.cos(math.pi / n)),
+                             tolerance)
+        self.assertGreater(radius * (1 - math.cos(math.pi / (n - 1))),
+                           tolerance)
+
+    def test_points_on_circle(self):
+        radius = mm(5)
+        points = arc_points(radius, 0, 0, radius, 0, 0, False,
+                            tolerance=mm(0.01))
+        self.assertEqual(points[0], (radius, 0))
+        self.assertEqual(points[-1], (0, radius))
+        for x, y in points:
+            self.assertAlmostEqual(math.hypot(x, y), radius, delta=1)
+            self.assertGreaterEqual(min(x, y), 0)
+
+
+class TestParsedArcs(TestCase):
+    def test_multi_quadrant(self):
+        plane = parse_gerber('%ADD10C,0.1*%\nD10*\nG75*\nX5000000Y0D02*\n'
+                             'G02X-5000000Y0I-5000000J0D01*\n')
+        self.assertEqual(plane.kinds[0], ARC)
+        self.assertTrue(plane.flags[0] & CLOCKWISE)
+        self.assertEqual((plane.cx[0], plane.cy[0]), (0, 0))
+
+    def test_single_quadrant(self):
+        # Unsigned offsets; the centre which gives a quarter circle is
+        # below and left of the start point.
+        plane = parse_gerber('%ADD10C,0.1*%\nD10*\nG74*\nX0Y5000000D02*\n'
+                             'G02X5000000Y0I0J5000000D01*\n')
+        self.assertEqual(plane.kinds[0], ARC)
+        self.assertEqual((plane.cx[0], plane.cy[0]), (0, 0))
+
+    def test_single_quadrant_coincident_points(self):
+        plane = parse_gerber('%ADD10C,0.1*%\nD10*\nG74*\nX0Y5000000D02*\n'
+                             'G03X0Y5000000I0J5000000D01*\n')
+        self.assertEqual(plane.kinds[0], DRAW)
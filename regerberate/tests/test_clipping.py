@@ -0,0 +1,204 @@
+import math
+import random
+import time
+from unittest import TestCase
+
+from ..clipping import Edges, flatten, pixel_touches, snap_round
+
+
+def square(x, y, size, clockwise=False):
+    points = [(x, y), (x + size, y), (x + size, y + size), (x, y + size)]
+    if clockwise:
+        points.reverse()
+    return points
+
+
+def crosses(a, b):
+    """
+    Whether two segments cross at a point inside both of them.
+    """
+    def side(x0, y0, x1, y1, x, y):
+        return (x1 - x0) * (y - y0) - (y1 - y0) * (x - x0)
+
+    ax0, ay0, ax1, ay1 = a
+    bx0, by0, bx1, by1 = b
+    return (side(ax0, ay0, ax1, ay1, bx0, by0) *
+            side(ax0, ay0, ax1, ay1, bx1, by1) < 0 and
+            side(bx0, by0, bx1, by1, ax0, ay0) *
+            side(bx0, by0, bx1, by1, ax1, ay1) < 0)
+
+
+def area(contours):
+    """
+    Total area of the contours, in square units.
+    """
+    return sum(xs[i - 1] * ys[i] - xs[i] * ys[i - 1]
+               for xs, ys in contours for i in range(len(xs))) / 2
+
+
+def winding(contours, x, y):
+    """
+    Winding number of the contours around a point which is not on any of
+    their edges.
+    """
+    count = 0
+    for xs, ys in contours:
+        for i in range(len(xs) - 1):
+            x0, y0, x1, y1 = xs[i], ys[i], xs[i + 1], ys[i + 1]
+            if (y0 <= y) != (y1 <= y):
+                if x0 + (x1 - x0) * (y - y0) / (y1 - y0) > x:
+                    count += 1 if y1 > y0 else -1
+    return count
+
+
+def expected(polygons, x, y):
+    """
+    Whether a point is dark after applying the polygons in order.
+    """
+    dark = False
+    for polarity, points in polygons:
+        xs = [px for px, py in points] + [points[0][0]]
+        ys = [py for px, py in points] + [points[0][1]]
+        if winding([(xs, ys)], x, y):
+            dark = polarity
+    return dark
+
+
+class TestFlatten(TestCase):
+    def assert_image(self, polygons, contours, size):
+        for i in range(size):
+            for j in range(size):
+                x, y = i + 0.5, j + 0.5
+                count = winding(contours, x, y)
+                self.assertIn(count, (0, 1))
+                self.assertEqual(bool(count), expected(polygons, x, y),
+                                 (x, y))
+
+    def test_empty(self):
+        self.assertEqual(flatten([]), [])
+        self.assertEqual(flatten([(False, square(0, 0, 10))]), [])
+
+    def test_union(self):
+        contours = flatten([(True, square(0, 0, 10)),
+                            (True, square(5, 5, 10, clockwise=True))])
+        self.assertEqual(area(contours), 175)
+
+    def test_clear_cuts_hole(self):
+        polygons = [(True, square(0, 0, 10)), (False, square(3, 3, 4))]
+        contours = flatten(polygons)
+        self.assertEqual(area(contours), 84)
+        self.assert_image(polygons, contours, 12)
+
+    def test_later_dark_fills_hole(self):
+        polygons = [(True, square(0, 0, 10)), (False, square(2, 2, 6)),
+                    (True, square(4, 4, 2))]
+        contours = flatten(polygons)
+        self.assertEqual(area(contours), 100 - 36 + 4)
+        self.assert_image(polygons, contours, 12)
+
+    def test_clear_before_dark_has_no_effect(self):
+        contours = flatten([(False, square(0, 0, 10)),
+                            (True, square(2, 2, 4))])
+        self.assertEqual(area(contours), 16)
+
+    def test_self_intersecting(self):
+        bowtie = [(0, 0), (10, 10), (10, 0), (0, 10)]
+        contours = flatten([(True, bowtie)])
+        self.assertEqual(area(contours), 50)
+
+    def test_random_rectangles(self):
+        r = random.Random(1)
+        for trial in range(40):
+            polygons = [(r.random() < 0.7,
+                         square(r.randrange(20), r.randrange(20),
+                                r.randrange(1, 10), r.random() < 0.5))
+                        for _ in range(r.randrange(1, 15))]
+            self.assert_image(polygons, flatten(polygons), 30)
+
+    def test_random_polygons(self):
+        r = random.Random(2)
+        for trial in range(40):
+            polygons = []
+            for _ in range(r.randrange(1, 6)):
+                points = [(r.randrange(1000), r.randrange(1000))
+                          for _ in range(r.randrange(3, 7))]
+                polygons.append((r.random() < 0.7, points))
+            contours = flatten(polygons)
+            for _ in range(200):
+                x = r.randrange(1000) + 0.37
+                y = r.randrange(1000) + 0.61
+                self.assertIn(winding(contours, x, y), (0, 1))
+
+    def test_pour_with_cutouts(self):
+        polygons = [(True, square(0, 0, 1000))]
+        for i in range(10):
+            for j in range(10):
+                polygons.append((False, square(i * 100 + 20, j * 100 + 20,
+                                               60)))
+                polygons.append((True, square(i * 100 + 40, j * 100 + 40,
+                                              20)))
+        cutouts = 100 * (60 ** 2 - 20 ** 2)
+        self.assertEqual(area(flatten(polygons)), 1000 ** 2 - cutouts)
+
+
+def rings(vertices):
+    """
+    Twenty annular pads of ``vertices`` vertices each, crowded into one
+    corner of a board whose far corner holds a small fiducial.
+    """
+    r = random.Random(5)
+    polygons = []
+    for _ in range(20):
+        x = r.randrange(10 ** 6)
+        y = r.randrange(10 ** 6)
+        for radius, dark in ((20000, True), (15000, False)):
+            polygons.append((dark, [
+                (x + int(radius * math.cos(2 * math.pi * k / vertices)),
+                 y + int(radius * math.sin(2 * math.pi * k / vertices)))
+                for k in range(vertices)]))
+    polygons.append((True, [(10 ** 8, 10 ** 8), (10 ** 8 + 100, 10 ** 8),
+                            (10 ** 8, 10 ** 8 + 100)]))
+    return polygons
+
+
+class TestSnapRound(TestCase):
+    def test_pixel_touches_half_open(self):
+        # The segment passes through the corner shared by four squares,
+        # which belongs to the square above and to the right of it.
+        self.assertTrue(pixel_touches(5, 4, 4, 3, 5, 4))
+        self.assertFalse(pixel_touches(4, 4, 4, 3, 5, 4))
+        self.assertFalse(pixel_touches(5, 3, 4, 3, 5, 4))
+        self.assertTrue(pixel_touches(4, 3, 4, 3, 5, 4))
+
+    def test_no_crossings_remain(self):
+        r = random.Random(3)
+        for trial in range(30):
+            edges = Edges()
+            for owner in range(4):
+                points = [(r.randrange(12), r.randrange(12))
+                          for _ in range(5)]
+                for i in range(len(points)):
+                    edges.add(points[i - 1][0], points[i - 1][1],
+                              points[i][0], points[i][1], owner)
+            snapped = snap_round(edges)
+            segments = list(zip(snapped.x0, snapped.y0,
+                                snapped.x1, snapped.y1))
+            for a in range(len(segments)):
+                for b in range(a + 1, len(segments)):
+                    self.assertFalse(crosses(segments[a], segments[b]),
+                                     (segments[a], segments[b]))
+
+    def test_scaling(self):
+        # Vertices crowded into a small part of the board must not share
+        # a few grid cells: four times the input takes well under eight
+        # times as long.
+        def elapsed(polygons):
+            start = time.perf_counter()
+            flatten(polygons)
+            return time.perf_counter() - start
+
+        small = rings(16)
+        large = rings(64)
+        ratio = (min(elapsed(large) for _ in range(2)) /
+                 min(elapsed(small) for _ in range(2)))
+        self.assertLess(ratio, 8)
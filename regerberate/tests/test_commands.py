@@ -0,0 +1,38 @@
+from unittest import TestCase
+
+from ..gerber.commands import (parse_command, CommentCommand, FlashCommand,
+                               InterpolateCommand,
+                               LinearInterpolationModeCommand,
+                               ModalOperationCommand, MoveCommand)
+
+
+class TestOperationSpelling(TestCase):
+    def test_round_trip(self):
+        for s in ('X100Y200D01*', 'X100Y200D1*', 'X100Y200D2*',
+                  'X100Y200D03*', 'G1X100Y200D1*', 'G01X100Y200D01*',
+                  'G2X100Y200I5J-5D01*', 'G03X100I5D1*', 'Y-5D002*',
+                  'D01*', 'D3*', 'G1X5*', 'X100Y200*', 'G1*', 'G01*',
+                  'G3*', 'G4*', 'G4 note*', 'G04 note*', 'M2*'):
+            self.assertEqual(parse_command(s).to_string(), s)
+
+    def test_codes_are_normalized(self):
+        cmd = parse_command('G1X100Y200D1*')
+        self.assertIsInstance(cmd, InterpolateCommand)
+        self.assertEqual(cmd.mode, 'G01')
+        self.assertIsInstance(parse_command('X1Y2D2*'), MoveCommand)
+        self.assertIsInstance(parse_command('X1Y2D003*'), FlashCommand)
+        cmd = parse_command('G3X5*')
+        self.assertIsInstance(cmd, ModalOperationCommand)
+        self.assertEqual(cmd.mode, 'G03')
+        self.assertIsInstance(parse_command('G1*'),
+                              LinearInterpolationModeCommand)
+        self.assertIsInstance(parse_command('G4 note*'), CommentCommand)
+
+    def test_bare_codes_share_instances_per_spelling(self):
+        self.assertIs(parse_command('G1*'), parse_command('G1*'))
+        self.assertIs(parse_command('G01*'), LinearInterpolationModeCommand())
+        self.assertIsNot(parse_command('G1*'), parse_command('G01*'))
+
+    def test_constructed_commands_use_canonical_codes(self):
+        self.assertEqual(InterpolateCommand('1', '2', mode='G02').to_string(),
+                         'G02X1Y2D01*')
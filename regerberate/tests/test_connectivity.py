@@ -0,0 +1,119 @@
+import random
+from unittest import TestCase
+
+from ..connectivity import (Shape, UnionFind, find_shorts, is_copper,
+                            islands, segment_distance2, segments_touch,
+                            shapes_touch, split_segment)
+from .util import mm, parse_gerber
+
+
+class TestUnionFind(TestCase):
+    def test_singletons(self):
+        sets = UnionFind(4)
+        self.assertEqual([sets.find(n) for n in range(4)], [0, 1, 2, 3])
+
+    def test_union(self):
+        sets = UnionFind(6)
+        sets.union(0, 1)
+        sets.union(2, 3)
+        root = sets.union(1, 3)
+        self.assertEqual(set(sets.find(n) for n in range(4)), {root})
+        self.assertEqual(sets.size[root], 4)
+        self.assertEqual(sets.union(0, 2), root)
+        self.assertNotEqual(sets.find(4), sets.find(5))
+
+    def test_matches_naive_partition(self):
+        r = random.Random(7)
+        n = 200
+        sets = UnionFind(n)
+        labels = list(range(n))
+        for _ in range(150):
+            a, b = r.randrange(n), r.randrange(n)
+            sets.union(a, b)
+            old, new = labels[b], labels[a]
+            labels = [new if label == old else label for label in labels]
+        for a in range(n):
+            for b in range(0, n, 7):
+                self.assertEqual(sets.find(a) == sets.find(b),
+                                 labels[a] == labels[b])
+
+
+class TestSegments(TestCase):
+    def test_touch(self):
+        self.assertTrue(segments_touch(0, 0, 10, 10, 0, 10, 10, 0))
+        self.assertTrue(segments_touch(0, 0, 10, 0, 10, 0, 20, 5))
+        self.assertTrue(segments_touch(0, 0, 10, 0, 5, 0, 20, 0))
+        self.assertFalse(segments_touch(0, 0, 10, 0, 11, 0, 20, 0))
+        self.assertFalse(segments_touch(0, 0, 10, 0, 0, 1, 10, 1))
+
+    def test_distance(self):
+        self.assertEqual(segment_distance2(0, 0, 10, 0, 0, 3, 10, 3), 9)
+        self.assertEqual(segment_distance2(0, 0, 10, 0, 13, 4, 20, 4), 25)
+        self.assertEqual(segment_distance2(0, 0, 10, 10, 0, 10, 10, 0), 0)
+
+    def test_split(self):
+        pieces = split_segment(0, 0, 100, 0, length=30)
+        self.assertEqual(len(pieces), 4)
+        self.assertEqual(pieces[0][:2], (0, 0))
+        self.assertEqual(pieces[-1][2:], (100, 0))
+        for a, b in zip(pieces, pieces[1:]):
+            self.assertEqual(a[2:], b[:2])
+
+
+class TestShapes(TestCase):
+    def test_tracks_touch_within_radii(self):
+        a = Shape([0, 100], [0, 0], radius=10)
+        self.assertTrue(shapes_touch(a, Shape([0, 100], [20, 20], 10)))
+        self.assertFalse(shapes_touch(a, Shape([0, 100], [21, 21], 10)))
+
+    def test_contour_contains_shape(self):
+        outer = Shape.contour([(0, 0), (100, 0), (100, 100), (0, 100)])
+        inner = Shape([50], [50], radius=5)
+        self.assertTrue(outer.contains(50, 50))
+        self.assertTrue(shapes_touch(outer, inner))
+        self.assertTrue(shapes_touch(inner, outer))
+        self.assertFalse(shapes_touch(outer, Shape([150], [50], 5)))
+
+
+class TestIslands(TestCase):
+    def test_islands(self):
+        plane = parse_gerber('%ADD10C,1*%\nD10*\n'
+                             'X0Y0D02*\nX10000000Y0D01*\n'
+                             'X10000000Y10000000D01*\n'
+                             'X20000000Y0D02*\nX30000000Y0D01*\n')
+        groups = islands(plane)
+        self.assertEqual(len(groups), 2)
+
+    def test_step_and_repeat_copies_are_separate(self):
+        plane = parse_gerber('%ADD10C,1*%\n%SRX3Y1I5.0J0*%\nD10*\n'
+                             'X0Y0D02*\nX2000000Y0D01*\n%SR*%\n')
+        self.assertEqual(len(islands(plane)), 3)
+
+    def test_is_copper(self):
+        self.assertTrue(is_copper('board.GTL'))
+        self.assertTrue(is_copper('simple.cmp'))
+        self.assertTrue(is_copper('board.g2'))
+        self.assertFalse(is_copper('simple.plc'))
+
+
+class TestShorts(TestCase):
+    base = ('%ADD10C,1*%\nD10*\n'
+            'X0Y0D02*\nX10000000Y0D01*\n'
+            'X0Y5000000D02*\nX10000000Y5000000D01*\n')
+
+    def test_art_joining_tracks(self):
+        art = parse_gerber('%ADD10C,0.5*%\nD10*\n'
+                           'X5000000Y0D02*\nX5000000Y5000000D01*\n')
+        shorts = find_shorts(parse_gerber(self.base), art)
+        self.assertEqual(len(shorts), 1)
+        self.assertEqual(len(shorts[0].island_boxes), 2)
+        self.assertEqual(shorts[0].art_box,
+                         (mm(4.75), mm(-0.25), mm(5.25), mm(5.25)))
+
+    def test_art_on_one_track(self):
+        art = parse_gerber('%ADD10C,0.5*%\nD10*\n'
+                           'X5000000Y0D02*\nX5000000Y2000000D01*\n')
+        self.assertEqual(find_shorts(parse_gerber(self.base), art), [])
+
+    def test_empty_layers(self):
+        self.assertEqual(find_shorts(parse_gerber(self.base), None), [])
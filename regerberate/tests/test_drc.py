@@ -0,0 +1,150 @@
+import math
+import random
+from unittest import TestCase, skipIf
+
+try:
+    import numpy as np
+    from ..drc import (Rule, check_layer, grid_pairs, parse_rule, rule_for,
+                       segment_distances)
+except ImportError:
+    np = None
+
+from ..connectivity import segment_distance2
+from .util import mm, parse_gerber
+
+
+def random_boxes(r, n):
+    xmin = np.array([r.uniform(0, 1000) for _ in range(n)])
+    ymin = np.array([r.uniform(0, 1000) for _ in range(n)])
+    return (xmin, ymin, xmin + np.array([r.uniform(0, 60) for _ in range(n)]),
+            ymin + np.array([r.uniform(0, 60) for _ in range(n)]))
+
+
+def overlapping(a, b, i, j):
+    return a[0][i] <= b[2][j] and b[0][j] <= a[2][i] and \
+        a[1][i] <= b[3][j] and b[1][j] <= a[3][i]
+
+
+@skipIf(np is None, 'NumPy is not installed')
+class TestRules(TestCase):
+    def test_parse_rule(self):
+        key, rule = parse_rule('.cmp:clearance=0.2')
+        self.assertEqual(key, '.cmp')
+        self.assertEqual(rule.clearance, mm(0.2))
+        self.assertIsNone(rule.width)
+
+    def test_parse_rule_starts_from_defaults(self):
+        key, rule = parse_rule('board.plc:clearance=0.1')
+        self.assertEqual(rule.width, mm(0.15))
+        self.assertEqual(rule.clearance, mm(0.1))
+        key, rule = parse_rule('board.plc:width=')
+        self.assertIsNone(rule.width)
+
+    def test_parse_rule_errors(self):
+        for s in ('clearance=0.2', '.cmp:depth=1', '.cmp:width'):
+            with self.assertRaises(ValueError):
+                parse_rule(s)
+
+    def test_rule_for(self):
+        rules = {'.cmp': Rule(clearance=mm(0.3)),
+                 'top.cmp': Rule(width=mm(0.1))}
+        self.assertEqual(rule_for('top.cmp', rules).width, mm(0.1))
+        self.assertEqual(rule_for('x.CMP', rules).clearance, mm(0.3))
+        self.assertEqual(rule_for('x.sol').clearance, mm(0.15))
+        self.assertEqual(rule_for('x.sts').width, mm(0.1))
+        self.assertIsNone(rule_for('x.txt').clearance)
+
+
+@skipIf(np is None, 'NumPy is not installed')
+class TestGridPairs(TestCase):
+    def pairs(self, a, b, same=False):
+        found = [(int(i), int(j)) for ii, jj in grid_pairs(a, b, same)
+                 for i, j in zip(ii, jj)]
+        self.assertEqual(len(found), len(set(found)))
+        return sorted(found)
+
+    def test_matches_brute_force(self):
+        r = random.Random(8)
+        a = random_boxes(r, 300)
+        b = random_boxes(r, 200)
+        self.assertEqual(self.pairs(a, b),
+                         [(i, j) for i in range(300) for j in range(200)
+                          if overlapping(a, b, i, j)])
+
+    def test_same_boxes(self):
+        r = random.Random(9)
+        a = random_boxes(r, 300)
+        self.assertEqual(self.pairs(a, a, same=True),
+                         [(i, j) for i in range(300)
+                          for j in range(i + 1, 300)
+                          if overlapping(a, a, i, j)])
+
+    def test_empty(self):
+        empty = (np.zeros(0),) * 4
+        r = random.Random(10)
+        self.assertEqual(self.pairs(empty, random_boxes(r, 5)), [])
+
+
+@skipIf(np is None, 'NumPy is not installed')
+class TestSegmentDistances(TestCase):
+    def test_matches_scalar_distance(self):
+        r = random.Random(11)
+        segments = [[r.randrange(-100, 100) for _ in range(8)]
+                    for _ in range(500)]
+        columns = [np.array(column, dtype=np.float64)
+                   for column in zip(*segments)]
+        distance, px, py, qx, qy = segment_distances(*columns)
+        for n, s in enumerate(segments):
+            self.assertAlmostEqual(distance[n],
+                                   math.sqrt(segment_distance2(*s)), 6)
+            # The points are on their segments and the distance apart.
+            self.assertAlmostEqual(math.hypot(px[n] - qx[n], py[n] - qy[n]),
+                                   distance[n], 6)
+
+    def test_crossing(self):
+        distance, px, py, qx, qy = segment_distances(
+            *[np.array([v], dtype=np.float64)
+              for v in (0, 0, 10, 10, 0, 10, 10, 0)])
+        self.assertEqual(distance[0], 0)
+        self.assertEqual((px[0], py[0], qx[0], qy[0]), (5, 5, 5, 5))
+
+
+@skipIf(np is None, 'NumPy is not installed')
+class TestCheckLayer(TestCase):
+    base = ('%ADD10C,0.5*%\nD10*\n'
+            'X0Y0D02*\nX10000000Y0D01*\n')
+
+    def test_clearance(self):
+        art = parse_gerber('%ADD10C,0.2*%\nD10*\n'
+                           'X0Y400000D02*\nX10000000Y400000D01*\n')
+        violations = check_layer('top.cmp', parse_gerber(self.base), art,
+                                 Rule(clearance=mm(0.2)))
+        self.assertEqual(len(violations), 1)
+        violation = violations[0]
+        self.assertEqual(violation.kind, 'clearance')
+        self.assertAlmostEqual(violation.distance, mm(0.05), delta=2)
+        self.assertAlmostEqual(violation.y0, mm(0.3), delta=2)
+        self.assertAlmostEqual(violation.y1, mm(0.25), delta=2)
+
+    def test_connected_art_is_not_checked(self):
+        art = parse_gerber('%ADD10C,0.2*%\nD10*\n'
+                           'X5000000Y0D02*\nX5000000Y2000000D01*\n')
+        self.assertEqual(check_layer('top.cmp', parse_gerber(self.base),
+                                     art, Rule(clearance=mm(0.2))), [])
+
+    def test_drawn_width(self):
+        art = parse_gerber('%ADD10C,0.1*%\nD10*\n'
+                           'X0Y0D02*\nX1000000Y0D01*\n')
+        violations = check_layer('top.plc', None, art, Rule(width=mm(0.15)))
+        self.assertEqual([(v.kind, v.distance) for v in violations],
+                         [('width', mm(0.1))])
+
+    def test_region_width(self):
+        art = parse_gerber('G36*\nX0Y0D02*\nX5000000Y0D01*\n'
+                           'X5000000Y100000D01*\nX0Y100000D01*\n'
+                           'X0Y0D01*\nG37*\n')
+        violations = check_layer('top.plc', None, art, Rule(width=mm(0.15)))
+        self.assertEqual(len(violations), 1)
+        self.assertAlmostEqual(violations[0].distance, mm(0.1), delta=2)
+        wide = check_layer('top.plc', None, art, Rule(width=mm(0.05)))
+        self.assertEqual(wide, [])
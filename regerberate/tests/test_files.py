@@ -0,0 +1,49 @@
+import os
+import os.path
+import stat
+import tempfile
+from unittest import TestCase
+
+from ..files import replace_file
+from ..layerset import LayerSet
+from ..project import write_project
+
+
+def mode(filename):
+    return stat.S_IMODE(os.stat(filename).st_mode)
+
+
+class TestReplaceFile(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'out')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def temporary(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory.name)
+        os.close(fd)
+        return tmp_path
+
+    def test_keeps_existing_mode(self):
+        with open(self.filename, 'w'):
+            pass
+        os.chmod(self.filename, 0o644)
+        replace_file(self.temporary(), self.filename)
+        self.assertEqual(mode(self.filename), 0o644)
+
+    def test_new_file_uses_umask(self):
+        umask = os.umask(0o022)
+        try:
+            replace_file(self.temporary(), self.filename)
+        finally:
+            os.umask(umask)
+        self.assertEqual(mode(self.filename), 0o644)
+
+    def test_write_project_keeps_mode(self):
+        with open(self.filename, 'w'):
+            pass
+        os.chmod(self.filename, 0o640)
+        write_project(self.filename, LayerSet())
+        self.assertEqual(mode(self.filename), 0o640)
@@ -0,0 +1,60 @@
+import math
+from unittest import TestCase
+
+from ..layerset import LayerSet
+from ..geometry import aperture_outlines, plane_polygons
+from ..clipping import flatten
+from .util import parse_gerber, contour_area
+
+
+class TestFlashHoles(TestCase):
+    def test_hole_only_cuts_its_aperture(self):
+        plane = parse_gerber('%ADD10R,3X3*%\n%ADD11C,1X0.5*%\n'
+                             'D10*X0Y0D03*\nD11*X0Y0D03*\n')
+        contours = flatten(plane_polygons(plane))
+        area = sum(contour_area(xs, ys) for xs, ys in contours)
+        self.assertAlmostEqual(area, 9.0, places=6)
+
+    def test_composite_keeps_base_under_hole(self):
+        base = parse_gerber('%ADD10R,3X3*%\nD10*X0Y0D03*\n')
+        extra = parse_gerber('%ADD11C,1X0.5*%\nD11*X0Y0D03*\n')
+        plane = LayerSet().composite(base, extra)
+        area = 0
+        for i in range(len(plane)):
+            points = plane[i].vertices
+            area += contour_area([x for x, y in points],
+                                 [y for x, y in points])
+        self.assertAlmostEqual(area, 9.0, places=6)
+
+    def test_hole_cut_from_flash_alone(self):
+        plane = parse_gerber('%ADD11R,2X2X1*%\nD11*X0Y0D03*\n')
+        contours = flatten(plane_polygons(plane))
+        area = sum(contour_area(xs, ys) for xs, ys in contours)
+        self.assertAlmostEqual(area, 4.0 - math.pi / 4, places=2)
+
+    def test_outlines_are_all_dark(self):
+        plane = parse_gerber('%ADD11C,1X0.5*%\nD11*X0Y0D03*\n')
+        aperture = plane.apertures[11]
+        outlines = aperture_outlines(aperture)
+        self.assertTrue(outlines)
+        self.assertIs(aperture_outlines(aperture), outlines)
+        polygons = list(plane_polygons(plane))
+        self.assertTrue(all(dark for dark, points in polygons))
+
+    def test_thermal_keeps_earlier_primitives(self):
+        # A dark square under a thermal; the gaps and the inner circle of
+        # the thermal only shape the thermal itself.
+        for primitive in ('7,0,0,3,2,0.5,0', '6,0,0,3,0.4,0.3,2,0.1,3,0'):
+            plane = parse_gerber('%%AMSQ*21,1,4,4,0,0,0*%s*%%\n'
+                                 '%%ADD10SQ*%%\nD10*X0Y0D03*\n' % primitive)
+            contours = flatten(plane_polygons(plane))
+            area = sum(contour_area(xs, ys) for xs, ys in contours)
+            self.assertAlmostEqual(area, 16.0, places=6)
+
+    def test_clear_flash_removes_only_outline(self):
+        plane = parse_gerber('%ADD10R,3X3*%\n%ADD11R,2X2X1*%\n'
+                             'D10*X0Y0D03*\n%LPC*%\nD11*X0Y0D03*\n')
+        contours = flatten(plane_polygons(plane))
+        area = sum(contour_area(xs, ys) for xs, ys in contours)
+        # The hole of the clear flash is left dark.
+        self.assertAlmostEqual(area, 9.0 - 4.0 + math.pi / 4, places=2)
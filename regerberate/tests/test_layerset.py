@@ -0,0 +1,73 @@
+import os
+import os.path
+import tempfile
+from unittest import TestCase
+
+from ..layerset import LayerSet
+from ..svg import document_keys
+from .util import header
+
+
+class TestUpdateFromGerbers(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def gerber(self, *parts, **kwargs):
+        filename = os.path.join(self.directory.name, *parts)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w') as f:
+            f.write(header + '%%ADD10C,%s*%%\nD10*\nX0Y0D03*\nM02*\n' %
+                    kwargs.get('diameter', 1))
+        return filename
+
+    def test_duplicate_names_rejected(self):
+        a = self.gerber('a', 'top.cmp')
+        b = self.gerber('b', 'top.cmp')
+        layers = LayerSet()
+        with self.assertRaises(ValueError) as cm:
+            layers.update_from_gerbers([a, b])
+        self.assertIn('top.cmp', str(cm.exception))
+        self.assertEqual(len(layers.layers), 0)
+
+    def test_same_file_twice(self):
+        a = self.gerber('a', 'top.cmp')
+        layers = LayerSet()
+        layers.update_from_gerbers([a, os.path.join(
+            self.directory.name, 'a', '.', 'top.cmp')])
+        self.assertEqual(list(layers.layers), ['top.cmp'])
+
+    def test_layers_in_order(self):
+        names = ['top.cmp', 'bottom.sol', 'silk.plc']
+        layers = LayerSet()
+        layers.update_from_gerbers([self.gerber(name) for name in names])
+        self.assertEqual(list(layers.layers), names)
+
+    def test_unchanged_layers_not_parsed(self):
+        top = self.gerber('top.cmp')
+        bottom = self.gerber('bottom.sol')
+        svg_filename = os.path.join(self.directory.name, 'board.svg')
+        layers = LayerSet()
+        layers.update_from_gerbers([top, bottom])
+        layers.write_svg(svg_filename)
+        with open(svg_filename, 'rb') as f:
+            before = f.read()
+        keys = document_keys(svg_filename)
+        self.assertEqual(sorted(keys), ['bottom.sol', 'top.cmp'])
+
+        self.gerber('bottom.sol', diameter=2)
+        layers = LayerSet()
+        layers.update_from_gerbers([top, bottom], unchanged=keys)
+        self.assertEqual(list(layers.layers), ['bottom.sol'])
+        self.assertEqual(layers.sources['top.cmp'], (top, keys['top.cmp']))
+        layers.update_svg(svg_filename)
+        with open(svg_filename, 'rb') as f:
+            after = f.read()
+        top_group = before[before.index(b'regerberate:layer="top.cmp"'):]
+        top_group = top_group[:top_group.index(b'</g>')]
+        self.assertIn(top_group, after)
+        self.assertNotEqual(after, before)
+        self.assertEqual(document_keys(svg_filename)['top.cmp'],
+                         keys['top.cmp'])
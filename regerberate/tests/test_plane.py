@@ -0,0 +1,156 @@
+import io
+from unittest import TestCase, mock
+
+from ..gerber import plane as plane_module
+from ..gerber.plane import GraphicsPlane
+from .util import mm, parse_gerber
+
+body = '''%AMDONUT*1,1,$1,0,0*1,0,$2,0,0*%
+%ADD10C,0.5*%
+%ADD11R,2X1X0.4*%
+%ADD12DONUT,1.5X0.5*%
+D10*
+X0Y0D02*
+X5000000Y0D01*
+G75*
+G03X5000000Y4000000I0J2000000D01*
+G01*
+%SRX3Y2I10.0J20.0*%
+D11*
+X1000000Y1000000D03*
+D12*
+X2000000Y1000000D03*
+%SR*%
+G36*
+X0Y10000000D02*
+X3000000Y10000000D01*
+X3000000Y12000000D01*
+X0Y10000000D01*
+G37*
+'''
+
+
+class TestDumpLoad(TestCase):
+    def round_trip(self, plane):
+        f = io.BytesIO()
+        plane.dump(f)
+        return GraphicsPlane.load(f.getvalue())
+
+    def test_round_trip(self):
+        plane = parse_gerber(body)
+        loaded = self.round_trip(plane)
+        self.assertTrue(loaded.mapped)
+        self.assertEqual(len(loaded), len(plane))
+        for name in GraphicsPlane.column_types:
+            self.assertEqual(list(getattr(loaded, name)),
+                             list(getattr(plane, name)), name)
+        self.assertEqual(loaded.repeats, plane.repeats)
+        self.assertEqual(sorted(loaded.apertures), [10, 11, 12])
+        for number, aperture in plane.apertures.items():
+            copy = loaded.apertures[number]
+            self.assertEqual(copy.template_name, aperture.template_name)
+            self.assertEqual(copy.modifiers, aperture.modifiers)
+            self.assertEqual(copy.unit, aperture.unit)
+            self.assertEqual(copy.shapes, aperture.shapes)
+            self.assertEqual(copy.bbox, aperture.bbox)
+        self.assertEqual(loaded.digest(), plane.digest())
+        self.assertEqual(loaded.bounding_box(), plane.bounding_box())
+
+    def test_table_is_json(self):
+        f = io.BytesIO()
+        parse_gerber(body).dump(f)
+        self.assertNotIn(b'Aperture', f.getvalue())
+        self.assertIn(b'"DONUT"', f.getvalue())
+
+    def test_loaded_plane_is_writable_after_copy(self):
+        loaded = self.round_trip(parse_gerber(body))
+        loaded.make_writable()
+        loaded.translate(mm(1), mm(1))
+        self.assertFalse(loaded.mapped)
+
+    def test_digest_depends_on_apertures(self):
+        a = parse_gerber('%ADD10C,0.5*%\nD10*\nX0Y0D03*\n')
+        b = parse_gerber('%ADD10C,0.6*%\nD10*\nX0Y0D03*\n')
+        self.assertNotEqual(a.digest(), b.digest())
+        self.assertEqual(a.digest(), self.round_trip(a).digest())
+
+    def test_bad_version(self):
+        f = io.BytesIO()
+        GraphicsPlane().dump(f)
+        data = bytearray(f.getvalue())
+        data[4] += 1
+        with self.assertRaises(ValueError):
+            GraphicsPlane.load(bytes(data))
+
+
+class TestStepAndRepeat(TestCase):
+    def test_bounding_box_covers_copies(self):
+        plane = parse_gerber('%ADD10C,1*%\n%SRX3Y2I10.0J20.0*%\nD10*\n'
+                             'X0Y0D03*\n%SR*%\n')
+        self.assertEqual(len(plane), 1)
+        self.assertEqual(plane.bounding_box(),
+                         (mm(-0.5), mm(-0.5), mm(20.5), mm(20.5)))
+        self.assertEqual(plane.flattened().bounding_box(),
+                         plane.bounding_box())
+
+    def test_segments(self):
+        plane = parse_gerber('%ADD10C,1*%\nD10*\nX0Y0D03*\n'
+                             '%SRX2Y1I5.0J0*%\nX1000000Y0D03*\n%SR*%\n'
+                             'X9000000Y0D03*\n')
+        self.assertEqual(list(plane.segments()),
+                         [(0, 1, [(0, 0)]),
+                          (1, 2, [(0, 0), (mm(5), 0)]),
+                          (2, 3, [(0, 0)])])
+
+
+class TestTransforms(TestCase):
+    coordinates = ('x0', 'y0', 'x1', 'y1', 'cx', 'cy', 'region_x',
+                   'region_y')
+
+    def transformed(self, use_numpy):
+        plane = parse_gerber(body)
+        with mock.patch.object(plane_module, 'np',
+                               plane_module.np if use_numpy else None):
+            plane.translate(mm(1.5), -mm(2))
+            plane.scale(3, 2)
+            box = plane.bounding_box()
+        return plane, box
+
+    def test_numpy_matches_pure_python(self):
+        if plane_module.np is None:
+            self.skipTest('NumPy is not installed')
+        a, box_a = self.transformed(True)
+        b, box_b = self.transformed(False)
+        for name in self.coordinates:
+            self.assertEqual(list(getattr(a, name)),
+                             list(getattr(b, name)), name)
+            self.assertIsInstance(getattr(a, name), type(getattr(b, name)))
+        self.assertEqual(box_a, box_b)
+        self.assertEqual(a.repeats, b.repeats)
+
+    def test_translate_then_scale(self):
+        plane, box = self.transformed(False)
+        original = parse_gerber(body)
+        self.assertEqual(plane.x1[0], (original.x1[0] + mm(1.5)) * 3 // 2)
+        self.assertEqual(plane.y0[0], (original.y0[0] - mm(2)) * 3 // 2)
+        self.assertEqual(plane.repeats[0][4], mm(10) * 3 // 2)
+
+    def test_mapped_plane(self):
+        f = io.BytesIO()
+        parse_gerber(body).dump(f)
+        plane = GraphicsPlane.load(f.getvalue())
+        x0 = list(plane.x0)
+        plane.translate(1, 0)
+        self.assertEqual(list(plane.x0), [x + 1 for x in x0])
+
+    def test_large_scale_falls_back(self):
+        plane = parse_gerber('%ADD10C,1*%\nD10*\nX-1000000Y0D03*\n')
+        plane.scale(1 << 62, 1 << 60)
+        self.assertEqual(plane.x1[0], -mm(4))
+
+    def test_large_translate_is_not_wrapped(self):
+        plane = parse_gerber('%ADD10C,1*%\nD10*\nX1000000Y0D03*\n')
+        plane.translate((1 << 63) - 1 - mm(1) - 1, 0)
+        self.assertEqual(plane.x1[0], (1 << 63) - 2)
+        with self.assertRaises(OverflowError):
+            plane.translate(mm(1), 0)
@@ -0,0 +1,124 @@
+import random
+from unittest import TestCase
+
+from ..gerber.rtree import PackedRTree, hilbert, hilbert_keys
+from .util import mm, parse_gerber
+
+
+def random_boxes(r, n, extent=10000, size=300):
+    boxes = []
+    for _ in range(n):
+        x = r.randrange(-extent, extent)
+        y = r.randrange(-extent, extent)
+        boxes.append((x, y, x + r.randrange(size), y + r.randrange(size)))
+    return boxes
+
+
+def tree_of(boxes, node_size=4):
+    return PackedRTree(*[[box[k] for box in boxes] for k in range(4)],
+                       node_size=node_size)
+
+
+def overlaps(a, b):
+    return not (a[0] > b[2] or a[2] < b[0] or a[1] > b[3] or a[3] < b[1])
+
+
+def box_distance(box, x, y):
+    dx = max(box[0] - x, 0, x - box[2])
+    dy = max(box[1] - y, 0, y - box[3])
+    return dx * dx + dy * dy
+
+
+class TestHilbert(TestCase):
+    def test_curve_is_a_permutation(self):
+        self.assertEqual(sorted(hilbert(x << 14, y << 14) >> 28
+                                for x in range(4) for y in range(4)),
+                         list(range(16)))
+
+    def test_adjacent_steps(self):
+        # Consecutive points along the curve are neighbouring cells.
+        order = sorted(((x, y) for x in range(16) for y in range(16)),
+                       key=lambda p: hilbert(p[0] << 12, p[1] << 12))
+        for (x0, y0), (x1, y1) in zip(order, order[1:]):
+            self.assertEqual(abs(x1 - x0) + abs(y1 - y0), 1)
+
+    def test_keys_follow_cells(self):
+        xs = [0, 255, 256, 65535]
+        ys = [0, 255, 0, 65535]
+        keys = hilbert_keys(xs, ys)
+        self.assertEqual(keys[0] >> 16, keys[1] >> 16)
+        self.assertNotEqual(keys[1] >> 16, keys[2] >> 16)
+
+
+class TestPackedRTree(TestCase):
+    def test_empty(self):
+        tree = tree_of([])
+        self.assertEqual(len(tree), 0)
+        self.assertEqual(tree.query(0, 0, 10, 10), [])
+        self.assertEqual(tree.nearest(0, 0), [])
+        self.assertEqual(list(tree.overlapping_pairs()), [])
+
+    def test_single(self):
+        tree = tree_of([(0, 0, 10, 10)])
+        self.assertEqual(tree.query(10, 10, 20, 20), [0])
+        self.assertEqual(tree.query(11, 0, 20, 20), [])
+        self.assertEqual(tree.nearest(50, 50), [0])
+
+    def test_query_matches_brute_force(self):
+        r = random.Random(4)
+        boxes = random_boxes(r, 500)
+        tree = tree_of(boxes)
+        for query in random_boxes(r, 100, size=3000):
+            self.assertEqual(sorted(tree.query(*query)),
+                             [i for i, box in enumerate(boxes)
+                              if overlaps(box, query)])
+
+    def test_nearest_matches_brute_force(self):
+        r = random.Random(5)
+        boxes = random_boxes(r, 300)
+        tree = tree_of(boxes)
+        for _ in range(50):
+            x = r.randrange(-12000, 12000)
+            y = r.randrange(-12000, 12000)
+            found = tree.nearest(x, y, 5)
+            distances = sorted(box_distance(box, x, y) for box in boxes)
+            self.assertEqual([box_distance(boxes[i], x, y) for i in found],
+                             distances[:5])
+
+    def test_nearest_max_distance(self):
+        tree = tree_of([(0, 0, 0, 0), (10, 0, 10, 0), (30, 0, 30, 0)])
+        self.assertEqual(tree.nearest(0, 0, 3, max_distance=10), [0, 1])
+
+    def test_overlapping_pairs(self):
+        r = random.Random(6)
+        boxes = random_boxes(r, 400, extent=3000)
+        tree = tree_of(boxes)
+        pairs = [tuple(sorted(pair)) for pair in tree.overlapping_pairs()]
+        self.assertEqual(len(pairs), len(set(pairs)))
+        self.assertEqual(sorted(pairs),
+                         [(a, b) for a in range(len(boxes))
+                          for b in range(a + 1, len(boxes))
+                          if overlaps(boxes[a], boxes[b])])
+
+
+class TestPlaneIndex(TestCase):
+    def test_query_step_and_repeat_copies(self):
+        plane = parse_gerber('%ADD10C,1*%\nD10*\nX0Y0D03*\n'
+                             '%SRX3Y2I10.0J20.0*%\nX2000000Y0D03*\n%SR*%\n')
+        self.assertEqual(len(plane.spatial_index()), 1 + 6)
+        self.assertEqual(plane.query((mm(21), mm(19), mm(23), mm(21))),
+                         [(1, mm(20), mm(20))])
+        self.assertEqual(sorted(plane.query((mm(-1), mm(-1), mm(1),
+                                             mm(1)))), [(0, 0, 0)])
+
+    def test_nearest(self):
+        plane = parse_gerber('%ADD10C,1*%\nD10*\nX0Y0D03*\n'
+                             'X5000000Y0D03*\n')
+        self.assertEqual(plane.nearest(mm(4), 0), [(1, 0, 0)])
+
+    def test_index_rebuilt_after_translate(self):
+        plane = parse_gerber('%ADD10C,1*%\nD10*\nX0Y0D03*\n')
+        self.assertEqual(len(plane.query((0, 0, 0, 0))), 1)
+        plane.translate(mm(10), 0)
+        self.assertEqual(plane.query((0, 0, 0, 0)), [])
+        self.assertEqual(plane.query((mm(10), 0, mm(10), 0)), [(0, 0, 0)])
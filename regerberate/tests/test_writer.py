@@ -0,0 +1,80 @@
+import io
+import os.path
+import tempfile
+from unittest import TestCase
+
+from ..gerber.parser import GerberParser
+from ..gerber.writer import GerberWriter, write_gerber
+from .util import parse_gerber
+
+macros = '''%AMDONUT*
+0 Outer and inner diameter*
+1,1,$1,0,0*1,0,$2,0,0*%
+%ADD10DONUT,1.5X0.5*%
+%ADD11DONUT,1.5X0.5*%
+%ADD12DONUT,2X0.5*%
+%ADD13C,0.5*%
+D10*
+X0Y0D03*
+D11*
+X5000000Y0D03*
+D12*
+X10000000Y0D03*
+D13*
+X0Y5000000D02*
+X5000000Y5000000D01*
+'''
+
+
+def written(plane):
+    f = io.StringIO()
+    writer = GerberWriter(f)
+    writer.write_header()
+    writer.write_plane(plane)
+    writer.write_footer()
+    return f.getvalue()
+
+
+class TestApertureDefinitions(TestCase):
+    def test_macros_written_verbatim(self):
+        text = written(parse_gerber(macros))
+        self.assertIn('%AMDONUT*0 Outer and inner diameter*'
+                      '1,1,$1,0,0*1,0,$2,0,0*%\n', text)
+        self.assertEqual(text.count('%AM'), 1)
+        self.assertIn('%ADD10DONUT,1.5X0.5*%', text)
+        self.assertIn('%ADD11DONUT,2X0.5*%', text)
+        self.assertIn('%ADD12C,0.5*%', text)
+        self.assertNotIn('%ADD13', text)
+
+    def test_round_trip(self):
+        plane = parse_gerber(macros)
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, 'out.gbr')
+            write_gerber(filename, plane)
+            copy = GerberParser(filename).parse()
+        self.assertEqual(len(copy), len(plane))
+        for number, aperture in plane.apertures.items():
+            match = copy.apertures[copy.aperture_numbers[
+                list(plane.aperture_numbers).index(number)]]
+            self.assertEqual(match.template_name, aperture.template_name)
+            self.assertEqual(match.modifiers, aperture.modifiers)
+            self.assertEqual(match.shapes, aperture.shapes)
+
+    def test_inch_macro_written_as_outline(self):
+        plane = parse_gerber('%AMBOX*21,1,$1,$1,0,0,0*%\n'
+                             '%ADD10BOX,0.1*%\nD10*\nX0Y0D03*\n')
+        plane.apertures[10].unit = 'IN'
+        text = written(plane)
+        self.assertIn('%AMSHAPE1*4,1,4,', text)
+        self.assertIn('%ADD10SHAPE1*%', text)
+
+    def test_conflicting_macro_names(self):
+        f = io.StringIO()
+        writer = GerberWriter(f)
+        self.assertEqual(writer.define_macro('M', '1,1,$1,0,0'), 'M')
+        self.assertEqual(writer.define_macro('M', '1,1,$1,0,0'), 'M')
+        self.assertEqual(writer.define_macro('M', '21,1,$1,$1,0,0,0'),
+                         'M_2')
+        self.assertEqual(writer.define_macro(None, '4,1,3,0,0,1,0,0,1,0,0'),
+                         'SHAPE1')
+        self.assertEqual(f.getvalue().count('%AM'), 3)
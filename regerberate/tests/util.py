@@ -0,0 +1,32 @@
+import os.path
+import tempfile
+
+from ..gerber.coordinates import UNITS_PER_MM
+from ..gerber.parser import GerberParser
+
+header = '%FSLAX36Y36*%\n%MOMM*%\n'
+
+
+def parse_gerber(body, name='test.gbr'):
+    """
+    Parse Gerber commands ``body``, after a header setting millimetres and
+    six fractional digits, into a ``GraphicsPlane``.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        filename = os.path.join(path, name)
+        with open(filename, 'w') as f:
+            f.write(header + body + 'M02*\n')
+        return GerberParser(filename).parse()
+
+
+def mm(value):
+    return int(round(value * UNITS_PER_MM))
+
+
+def contour_area(xs, ys):
+    """
+    Signed area of a closed contour in square millimetres.
+    """
+    area2 = sum(xs[i - 1] * ys[i] - xs[i] * ys[i - 1]
+                for i in range(len(xs)))
+    return area2 / 2.0 / UNITS_PER_MM ** 2
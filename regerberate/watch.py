@@ -0,0 +1,138 @@
+"""
+Watch a board and its Gerber files, re-rendering output as they change.
+
+Parsed planes are kept in memory between changes, so re-reading a board only
+parses Gerber files whose content changed, and only layers whose base or
+extra geometry changed are composited and written again. Files are polled,
+which works the same everywhere, including network filesystems; rapid
+saves are batched by waiting until files have been quiet for a short time.
+"""
+import logging
+import os
+import os.path
+import time
+
+from .cache import MemoryCache
+from .layerset import LayerSet
+from .project import is_project
+
+log = logging.getLogger(__name__)
+
+
+def file_state(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class Watcher(object):
+    """
+    Keep the Gerber files in ``output_path`` rendered from the SVG or project
+    file ``input``, and ``input`` up to date with the Gerber files it was
+    prepared from.
+    """
+    def __init__(self, input, output_path, cache=None, interval=0.2,
+                 debounce=0.3):
+        self.input = input
+        self.output_path = output_path
+        self.cache = MemoryCache(cache)
+        self.interval = interval
+        self.debounce = debounce
+        self.layers = None
+        # Layer name -> digests of the base and extra planes last rendered.
+        self.rendered = {}
+        # Filename -> (mtime, size) when last seen.
+        self.states = {}
+
+    def watched_files(self):
+        filenames = [self.input]
+        if self.layers is not None:
+            filenames.extend(filename for filename, key in
+                             self.layers.sources.values())
+        return filenames
+
+    def snapshot(self):
+        self.states = dict((filename, file_state(filename))
+                           for filename in self.watched_files())
+
+    def changed_files(self):
+        return [filename for filename in self.watched_files()
+                if file_state(filename) != self.states.get(filename)]
+
+    def wait_for_changes(self):
+        """
+        Block until watched files change and have then been left alone for
+        ``debounce`` seconds, returning the changed files.
+        """
+        changed = set()
+        quiet_since = None
+        while True:
+            new = self.changed_files()
+            if new:
+                changed.update(new)
+                self.snapshot()
+                quiet_since = time.monotonic()
+            elif changed and \
+                    time.monotonic() - quiet_since >= self.debounce:
+                return sorted(changed)
+            time.sleep(self.interval)
+
+    def update_input(self, gerbers):
+        """
+        Bring ``input`` up to date with changed Gerber files.
+        """
+        gerbers = [filename for filename in gerbers
+                   if file_state(filename) is not None]
+        if not gerbers:
+            return
+        log.info('updating %s from %s', self.input, ', '.join(gerbers))
+        if is_project(self.input):
+            layers = LayerSet.load_project(self.input, self.cache)
+            layers.update_from_gerbers(gerbers)
+            layers.write_project(self.input)
+        else:
+            layers = LayerSet(self.cache)
+            layers.update_from_gerbers(gerbers)
+            layers.update_svg(self.input)
+
+    def render(self):
+        """
+        Reload ``input`` and render each layer which changed since the last
+        render. Return the names of the layers rendered.
+        """
+        self.layers = layers = LayerSet.load_file(self.input, self.cache)
+        if not os.path.isdir(self.output_path):
+            os.makedirs(self.output_path)
+        names = []
+        for name in list(layers.layers):
+            base, extra = layers.layers[name]
+            digests = tuple(plane.digest() if plane is not None else None
+                            for plane in (base, extra))
+            if self.rendered.get(name) != digests:
+                layers.render_gerbers(self.output_path, [name])
+                self.rendered[name] = digests
+                names.append(name)
+        return names
+
+    def update(self, changed=()):
+        start = time.monotonic()
+        self.update_input([filename for filename in changed
+                           if filename != self.input])
+        names = self.render()
+        self.snapshot()
+        log.info('rendered %s in %.2fs',
+                 ', '.join(names) if names else 'nothing',
+                 time.monotonic() - start)
+        return names
+
+    def run(self):
+        self.update()
+        log.info('watching %d files', len(self.states))
+        while True:
+            changed = self.wait_for_changes()
+            try:
+                self.update(changed)
+            except Exception:
+                log.exception('update failed, waiting for the next change')
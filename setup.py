@@ -20,6 +20,10 @@ setup(name='regerberate',
       install_requires=[
           'coloredlogs',
       ],
+      extras_require={
+          'preview': ['numpy'],
+          'drc': ['numpy'],
+      },
       license='MIT',
       packages=find_packages(),
       test_suite='nose.collector',